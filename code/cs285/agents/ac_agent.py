@@ -1,8 +1,15 @@
 from collections import OrderedDict
 
+import torch
+
 from cs285.critics.bootstrapped_continuous_critic import \
     BootstrappedContinuousCritic
 from cs285.infrastructure.replay_buffer import ReplayBuffer
+from cs285.infrastructure.memmap_replay_buffer import MemmapReplayBuffer
+from cs285.infrastructure.prioritized_replay_buffer import PrioritizedReplayBuffer
+from cs285.infrastructure import distributed
+from cs285.infrastructure import pytorch_util as ptu
+from cs285.infrastructure.timing import phase
 from cs285.infrastructure.utils import *
 from cs285.policies.MLP_policy import MLPPolicyAC
 from .base_agent import BaseAgent
@@ -17,6 +24,7 @@ class ACAgent(BaseAgent):
 
         self.gamma = self.agent_params['gamma']
         self.standardize_advantages = self.agent_params['standardize_advantages']
+        self.prioritized_replay = self.agent_params.get('prioritized_replay', False)
 
         self.actor = MLPPolicyAC(
             self.agent_params['ac_dim'],
@@ -25,26 +33,55 @@ class ACAgent(BaseAgent):
             self.agent_params['size'],
             self.agent_params['discrete'],
             self.agent_params['learning_rate'],
-            normal=self.agent_params['normal']
+            normal=self.agent_params['normal'],
+            compile_inference=self.agent_params.get('compile_policy', False),
+            shared_trunk=self.agent_params.get('shared_trunk', False),
         )
         self.critic = BootstrappedContinuousCritic(self.agent_params)
 
-        self.replay_buffer = ReplayBuffer()
+        if self.prioritized_replay:
+            self.replay_buffer = PrioritizedReplayBuffer(
+                alpha=self.agent_params['per_alpha'],
+                beta=self.agent_params['per_beta'],
+            )
+        elif self.agent_params.get('replay_buffer_dir'):
+            self.replay_buffer = MemmapReplayBuffer(self.agent_params['replay_buffer_dir'])
+        else:
+            self.replay_buffer = ReplayBuffer()
 
     def train(self, ob_no, ac_na, re_n, next_ob_no, terminal_n):
+        # convert the batch to tensors once; they stay on the device until logging
+        batch = ptu.to_tensor_batch(ob_no, ac_na, re_n, next_ob_no, terminal_n)
+
         # TODO Implement the following pseudocode:
         # for agent_params['num_critic_updates_per_agent_update'] steps,
         #     update the critic
         for _ in range(self.agent_params['num_critic_updates_per_agent_update']):
-            critic_loss = self.critic.update(ob_no, ac_na, next_ob_no, re_n, terminal_n)
+            if self.prioritized_replay:
+                # fit the critic on the transitions with the largest TD errors
+                with phase('buffer_sample'):
+                    c_ob_no, c_ac_na, c_re_n, c_next_ob_no, c_terminal_n, weight_n, indices = \
+                        self.replay_buffer.sample_prioritized_data(ob_no.shape[0])
+                    c_batch = ptu.to_tensor_batch(c_ob_no, c_ac_na, c_re_n, c_next_ob_no, c_terminal_n)
+                with phase('critic_update'):
+                    critic_loss = self.critic.update(c_batch.ob_no, c_batch.ac_na, c_batch.next_ob_no, c_batch.re_n,
+                                                     c_batch.terminal_n, weight_n=weight_n)
+                with phase('buffer_priorities'):
+                    self.replay_buffer.update_priorities(indices, self.critic.td_error_n)
+            else:
+                with phase('critic_update'):
+                    critic_loss = self.critic.update(batch.ob_no, batch.ac_na, batch.next_ob_no, batch.re_n,
+                                                     batch.terminal_n)
 
         # advantage = estimate_advantage(...)
-        advantage = self.estimate_advantage(ob_no, next_ob_no, re_n, terminal_n)
+        with phase('advantage'):
+            advantage = self.estimate_advantage(batch.ob_no, batch.next_ob_no, batch.re_n, batch.terminal_n)
 
         # for agent_params['num_actor_updates_per_agent_update'] steps,
         #     update the actor
-        for _ in range(self.agent_params['num_actor_updates_per_agent_update']):
-            actor_loss = self.actor.update(ob_no, ac_na, advantage)
+        with phase('actor_update'):
+            for _ in range(self.agent_params['num_actor_updates_per_agent_update']):
+                actor_loss = self.actor.update(batch.ob_no, batch.ac_na, advantage)
 
         loss = OrderedDict()
         loss['Critic_Loss'] = critic_loss
@@ -60,15 +97,37 @@ class ACAgent(BaseAgent):
         # HINT: Remember to cut off the V(s') term (ie set it to 0) at terminal states (ie terminal_n=1)
         # 4) calculate advantage (adv_n) as A(s, a) = Q(s, a) - V(s)
 
-        v = self.critic.forward_np(ob_no)
-        v_prime = self.critic.forward_np(next_ob_no)
+        ob_no, next_ob_no = ptu.as_tensor(ob_no), ptu.as_tensor(next_ob_no)
+        re_n, terminal_n = ptu.as_tensor(re_n), ptu.as_tensor(terminal_n)
+
+        # V(s) and V(s') in a single forward pass
+        n = ob_no.shape[0]
+        with torch.no_grad():
+            values = self.critic(torch.cat([ob_no, next_ob_no]))
+        v, v_prime = values[:n], values[n:]
         q = re_n+self.gamma*v_prime*(1-terminal_n)
         adv_n = q-v
 
         if self.standardize_advantages:
-            adv_n = (adv_n - np.mean(adv_n)) / (np.std(adv_n) + 1e-8)
+            # over the batches of all ranks when training data-parallel
+            adv_mean, adv_std = distributed.mean_std(adv_n)
+            adv_n = (adv_n - adv_mean) / (adv_std + 1e-8)
         return adv_n
 
+    def state_dict(self):
+        return {
+            'actor': self.actor.state_dict(),
+            'actor_optimizers': self.actor.optimizer_state_dict(),
+            'critic': self.critic.state_dict(),
+            'critic_optimizer': self.critic.optimizer.state_dict(),
+        }
+
+    def load_state_dict(self, state):
+        self.actor.load_state_dict(state['actor'])
+        self.actor.load_optimizer_state_dict(state['actor_optimizers'])
+        self.critic.load_state_dict(state['critic'])
+        self.critic.optimizer.load_state_dict(state['critic_optimizer'])
+
     def add_to_replay_buffer(self, paths):
         self.replay_buffer.add_rollouts(paths)
 
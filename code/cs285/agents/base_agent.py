@@ -1,3 +1,8 @@
+import torch
+
+from cs285.infrastructure import pytorch_util as ptu
+
+
 class BaseAgent(object):
     def __init__(self, **kwargs):
         super(BaseAgent, self).__init__(**kwargs)
@@ -12,5 +17,15 @@ class BaseAgent(object):
     def sample(self, batch_size):
         raise NotImplementedError
 
+    def state_dict(self) -> dict:
+        """Return everything needed to resume training: weights, optimizer states, counters."""
+        raise NotImplementedError
+
+    def load_state_dict(self, state):
+        raise NotImplementedError
+
     def save(self, path):
-        raise NotImplementedError
\ No newline at end of file
+        torch.save(self.state_dict(), path)
+
+    def load(self, path):
+        self.load_state_dict(torch.load(path, map_location=ptu.device, weights_only=False))
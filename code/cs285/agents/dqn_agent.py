@@ -0,0 +1,85 @@
+from functools import partial
+
+from cs285.critics.dqn_critic import DQNCritic
+from cs285.infrastructure import distributed
+from cs285.infrastructure.dqn_utils import create_parking_q_network
+from cs285.infrastructure.replay_buffer import ReplayBuffer
+from cs285.infrastructure.timing import phase
+from cs285.infrastructure.utils import get_pathlength
+from cs285.policies.argmax_policy import PriceGridPolicy
+from .base_agent import BaseAgent
+
+
+class DQNAgent(BaseAgent):
+    def __init__(self, env, agent_params):
+        super(DQNAgent, self).__init__()
+
+        self.env = env
+        self.agent_params = agent_params
+
+        self.gamma = self.agent_params['gamma']
+        self.n_step = self.agent_params['n_step']
+        self.n_levels = self.agent_params['n_price_levels']
+        self.learning_starts = self.agent_params['learning_starts']
+        self.target_update_freq = self.agent_params['target_update_freq']
+        self.exploration = self.agent_params['exploration_schedule']
+
+        # one branch of n_price_levels Q-values per rate area
+        critic_params = dict(
+            self.agent_params,
+            ac_dim=self.n_levels,
+            n_branches=self.agent_params['ac_dim'],
+            q_func=partial(create_parking_q_network,
+                           n_layers=self.agent_params['n_layers'],
+                           size=self.agent_params['size']),
+        )
+        self.critic = DQNCritic(critic_params, self.agent_params['optimizer_spec'])
+        self.critic.update_target_network()
+
+        # greedy for evaluation, epsilon-greedy for collecting data
+        self.actor = PriceGridPolicy(self.critic, self.n_levels)
+        self.collect_policy = PriceGridPolicy(self.critic, self.n_levels, self.exploration.value(0))
+
+        self.replay_buffer = ReplayBuffer(self.agent_params['replay_buffer_size'])
+        self.t = 0
+        self.num_param_updates = 0
+
+    def train(self, ob_no, ac_na, re_n, next_ob_no, terminal_n, gamma_n):
+        log = {}
+        if self.t > self.learning_starts:
+            with phase('critic_update'):
+                log = self.critic.update(ob_no, self.actor.to_levels(ac_na), next_ob_no, re_n, terminal_n,
+                                         gamma_n=gamma_n)
+            self.num_param_updates += 1
+            if self.num_param_updates % self.target_update_freq == 0:
+                self.critic.update_target_network()
+
+        log['Exploration_Epsilon'] = self.collect_policy.epsilon
+        return log
+
+    def state_dict(self):
+        return {
+            'q_net': self.critic.q_net.state_dict(),
+            'q_net_target': self.critic.q_net_target.state_dict(),
+            'optimizer': self.critic.optimizer.state_dict(),
+            't': self.t,
+            'num_param_updates': self.num_param_updates,
+        }
+
+    def load_state_dict(self, state):
+        self.critic.q_net.load_state_dict(state['q_net'])
+        self.critic.q_net_target.load_state_dict(state['q_net_target'])
+        self.critic.optimizer.load_state_dict(state['optimizer'])
+        self.t = state['t']
+        self.num_param_updates = state['num_param_updates']
+        self.collect_policy.epsilon = self.exploration.value(self.t)
+
+    def add_to_replay_buffer(self, paths):
+        self.replay_buffer.add_rollouts(paths)
+        # env steps of all data-parallel ranks, so that learning_starts and the
+        # exploration schedule follow the global step count
+        self.t += distributed.sum_int(sum(get_pathlength(path) for path in paths))
+        self.collect_policy.epsilon = self.exploration.value(self.t)
+
+    def sample(self, batch_size):
+        return self.replay_buffer.sample_random_nstep_data(batch_size, self.n_step, self.gamma)
@@ -1,9 +1,16 @@
+from collections import deque
+
 import numpy as np
 
 from .base_agent import BaseAgent
+from cs285.infrastructure import distributed
+from cs285.infrastructure import pytorch_util as ptu
 from cs285.policies.MLP_policy import MLPPolicyPG
 from cs285.infrastructure.replay_buffer import ReplayBuffer
-from cs285.infrastructure.utils import normalize
+from cs285.infrastructure.memmap_replay_buffer import MemmapReplayBuffer
+from cs285.infrastructure.timing import phase
+from cs285.infrastructure.utils import normalize, segment_starts, discounted_segment_sum, discounted_segment_cumsum, \
+    convert_listofrollouts
 
 class PGAgent(BaseAgent):
     def __init__(self, env, agent_params):
@@ -16,6 +23,17 @@ class PGAgent(BaseAgent):
         self.standardize_advantages = self.agent_params['standardize_advantages']
         self.nn_baseline = self.agent_params['nn_baseline']
         self.reward_to_go = self.agent_params['reward_to_go']
+        self.gae_lambda = self.agent_params.get('gae_lambda')
+        assert self.gae_lambda is None or self.nn_baseline, 'GAE needs the nn_baseline value network'
+        # without reward-to-go the baseline fits whole-trajectory returns, not state values
+        assert self.gae_lambda is None or self.reward_to_go, 'GAE needs reward_to_go value targets'
+
+        # off-policy reuse of the last reuse_batches batches, importance weighted
+        self.reuse_batches = self.agent_params.get('reuse_batches', 0)
+        self.is_mode = self.agent_params.get('is_mode', 'decision')
+        self.is_truncation = self.agent_params.get('is_truncation', 1.0)
+        self.min_ess = self.agent_params.get('min_ess', 0.1)
+        self.recent_batches = deque(maxlen=self.reuse_batches + 1)
 
         # actor/policy
         self.actor = MLPPolicyPG(
@@ -26,11 +44,20 @@ class PGAgent(BaseAgent):
             discrete=self.agent_params['discrete'],
             learning_rate=self.agent_params['learning_rate'],
             nn_baseline=self.agent_params['nn_baseline'],
-            normal=self.agent_params['normal']
+            normal=self.agent_params['normal'],
+            ppo_clip=self.agent_params.get('ppo_clip'),
+            ppo_epochs=self.agent_params.get('ppo_epochs', 10),
+            ppo_minibatch_size=self.agent_params.get('ppo_minibatch_size'),
+            ppo_target_kl=self.agent_params.get('ppo_target_kl'),
+            compile_inference=self.agent_params.get('compile_policy', False),
+            shared_trunk=self.agent_params.get('shared_trunk', False),
         )
 
         # replay buffer
-        self.replay_buffer = ReplayBuffer(1000000)
+        if self.agent_params.get('replay_buffer_dir'):
+            self.replay_buffer = MemmapReplayBuffer(self.agent_params['replay_buffer_dir'], 1000000)
+        else:
+            self.replay_buffer = ReplayBuffer(1000000)
 
     def train(self, obs, acs, rews_list, next_obs, terminals):
 
@@ -39,14 +66,26 @@ class PGAgent(BaseAgent):
             and the calculated qvals/advantages that come from the seen rewards.
         """
 
-        # step 1: calculate q values of each (s_t, a_t) point, using rewards (r_0, ..., r_t, ..., r_T)
-        q_values = self.calculate_q_vals(rews_list)
+        # prepend the still-usable past batches, with their importance weights
+        weights, reuse_log = None, {}
+        if self.reuse_batches > 0:
+            with phase('importance_weights'):
+                obs, acs, rews_list, weights, reuse_log = self.add_past_batches(obs, acs, rews_list)
+
+        # convert observations and actions to tensors once, for the baseline and the actor
+        obs, acs = ptu.as_tensor(obs), ptu.as_tensor(acs)
+
+        with phase('advantage'):
+            # step 1: calculate q values of each (s_t, a_t) point, using rewards (r_0, ..., r_t, ..., r_T)
+            q_values = self.calculate_q_vals(rews_list)
 
-        # step 2: calculate advantages that correspond to each (s_t, a_t) point
-        advantage_values = self.estimate_advantage(obs, q_values)
+            # step 2: calculate advantages that correspond to each (s_t, a_t) point
+            advantage_values = self.estimate_advantage(obs, q_values, rews_list)
 
-        # step 3: use all datapoints (s_t, a_t, q_t, adv_t) to update the PG actor/policy
-        log = self.actor.update(obs, acs, advantage_values, qvals=q_values)
+        # step 3: use all datapoints (s_t, a_t, q_t, adv_t) to update the PG actor/policy (and the baseline)
+        with phase('actor_update'):
+            log = self.actor.update(obs, acs, advantage_values, qvals=q_values, weights_n=weights)
+        log.update(reuse_log)
         return log
 
     def calculate_q_vals(self, rewards_list):
@@ -55,13 +94,17 @@ class PGAgent(BaseAgent):
             Monte Carlo estimation of the Q function.
         """
 
+        # all rollouts are processed at once, as one flat array of rewards plus the rollout lengths
+        rewards = np.concatenate(rewards_list)
+        lengths = [len(r) for r in rewards_list]
+
         # Case 1: trajectory-based PG
         # Estimate Q^{pi}(s_t, a_t) by the total discounted reward summed over entire trajectory
         if not self.reward_to_go:
 
             # For each point (s_t, a_t), associate its value as being the discounted sum of rewards over the full trajectory
             # In other words: value of (s_t, a_t) = sum_{t'=0}^T gamma^t' r_{t'}
-            q_values = np.concatenate([self._discounted_return(r) for r in rewards_list])
+            q_values = self._discounted_return(rewards, lengths)
 
         # Case 2: reward-to-go PG
         # Estimate Q^{pi}(s_t, a_t) by the discounted sum of rewards starting from t
@@ -69,14 +112,15 @@ class PGAgent(BaseAgent):
 
             # For each point (s_t, a_t), associate its value as being the discounted sum of rewards over the full trajectory
             # In other words: value of (s_t, a_t) = sum_{t'=t}^T gamma^(t'-t) * r_{t'}
-            q_values = np.concatenate([self._discounted_cumsum(r) for r in rewards_list])
+            q_values = self._discounted_cumsum(rewards, lengths)
 
         return q_values
 
-    def estimate_advantage(self, obs, q_values):
+    def estimate_advantage(self, obs, q_values, rewards_list=None):
 
         """
-            Computes advantages by (possibly) subtracting a baseline from the estimated Q values
+            Computes advantages by (possibly) subtracting a baseline from the estimated Q values,
+            or with GAE(lambda) on top of the baseline when gae_lambda is set
         """
 
         # Estimate the advantage as [Q-b], when nn_baseline is True,
@@ -84,8 +128,13 @@ class PGAgent(BaseAgent):
         if self.nn_baseline:
             b_n = self.actor.run_baseline_prediction(obs)
             assert b_n.ndim == q_values.ndim
-            b_n = b_n * np.std(q_values) + np.mean(q_values)
-            adv_n = q_values - b_n
+            # statistics over the batches of all ranks when training data-parallel
+            q_mean, q_std = distributed.mean_std(q_values)
+            b_n = b_n * q_std + q_mean
+            if self.gae_lambda is not None:
+                adv_n = self._gae_advantage(b_n, rewards_list)
+            else:
+                adv_n = q_values - b_n
 
         # Else, just set the advantage to [Q]
         else:
@@ -93,16 +142,85 @@ class PGAgent(BaseAgent):
 
         # Normalize the resulting advantages
         if self.standardize_advantages:
-            adv_n = normalize(adv_n, np.mean(adv_n), np.std(adv_n))
+            adv_n = normalize(adv_n, *distributed.mean_std(adv_n))
 
         return adv_n
 
     #####################################################
     #####################################################
 
+    def state_dict(self):
+        return {
+            'actor': self.actor.state_dict(),
+            'actor_optimizers': self.actor.optimizer_state_dict(),
+            'recent_batches': list(self.recent_batches),
+        }
+
+    def load_state_dict(self, state):
+        self.actor.load_state_dict(state['actor'])
+        self.actor.load_optimizer_state_dict(state['actor_optimizers'])
+        self.recent_batches.extend(state['recent_batches'])
+
     def add_to_replay_buffer(self, paths):
+        if self.reuse_batches > 0:
+            # the policy has not changed since collection: these are the behaviour log-probs
+            observations, actions = convert_listofrollouts(paths)[:2]
+            log_probs = np.split(self.actor.get_log_prob(observations, actions),
+                                 np.cumsum([len(path["reward"]) for path in paths])[:-1])
+            for path, log_prob in zip(paths, log_probs):
+                path["log_prob"] = log_prob
+            self.recent_batches.append(paths)
         self.replay_buffer.add_rollouts(paths)
 
+    def add_past_batches(self, obs, acs, rews_list):
+        """
+            Weight every past batch by truncated importance ratios between the current
+            policy and the policy that collected it: per trajectory,
+            min(c, prod_t pi(a_t|s_t) / mu(a_t|s_t)), or per decision, min(c, prod_{t'<=t} ...).
+            Batches whose normalized effective sample size (sum w)^2 / (n sum w^2)
+            falls below min_ess are dropped for good.
+        """
+        all_obs, all_acs, all_rews, all_weights, ess, kept = [], [], [], [], [], []
+        for paths in list(self.recent_batches)[:-1]:
+            observations, actions = convert_listofrollouts(paths)[:2]
+            lengths = [len(path["reward"]) for path in paths]
+            log_ratio = self.actor.get_log_prob(observations, actions) - \
+                np.concatenate([path["log_prob"] for path in paths])
+
+            if self.is_mode == 'trajectory':
+                log_weights = np.repeat(np.add.reduceat(log_ratio, segment_starts(lengths)), lengths)
+            else:
+                cumsum = np.cumsum(log_ratio)
+                starts = segment_starts(lengths)
+                log_weights = cumsum - np.repeat(cumsum[starts] - log_ratio[starts], lengths)
+            weights = np.minimum(np.exp(log_weights), self.is_truncation)
+
+            batch_ess = np.sum(weights) ** 2 / (len(weights) * np.sum(weights ** 2) + 1e-8)
+            if batch_ess < self.min_ess:
+                continue
+            kept.append(paths)
+            ess.append(batch_ess)
+            all_obs.append(observations)
+            all_acs.append(actions)
+            all_rews += [path["reward"] for path in paths]
+            all_weights.append(weights)
+
+        # batches are lists of dicts of arrays, so rebuild rather than deque.remove them
+        self.recent_batches = deque(kept + [self.recent_batches[-1]], maxlen=self.recent_batches.maxlen)
+
+        # the batch just collected is on-policy
+        all_obs.append(obs)
+        all_acs.append(acs)
+        all_rews += list(rews_list)
+        all_weights.append(np.ones(len(obs)))
+
+        reuse_log = {
+            'Reuse_Batches': len(ess),
+            'Reuse_ESS': np.mean(ess) if ess else 1.,
+        }
+        return np.concatenate(all_obs), np.concatenate(all_acs), all_rews, \
+            np.concatenate(all_weights).astype(np.float32), reuse_log
+
     def sample(self, batch_size):
         return self.replay_buffer.sample_recent_data(batch_size, concat_rew=False)
 
@@ -110,62 +228,41 @@ class PGAgent(BaseAgent):
     ################## HELPER FUNCTIONS #################
     #####################################################
 
-    def _discounted_return(self, rewards):
+    def _gae_advantage(self, values, rewards_list):
         """
-            Helper function
-
-            Input: list of rewards {r_0, r_1, ..., r_t', ... r_T} from a single rollout of length T
-
-            Output: list where each index t contains sum_{t'=0}^T gamma^t' r_{t'}
-                note that all entries of this output are equivalent
-                because each sum is from 0 to T (and doesnt involve t)
+            Helper function which
+            -takes the baseline values V(s_t) and the rewards of several rollouts,
+            -computes the TD residuals delta_t = r_t + gamma * V(s_{t+1}) - V(s_t),
+             with V(s_{T+1}) = 0 past the end of each rollout,
+            -and returns A_t = sum_{t'=t}^T (gamma * lambda)^(t'-t) * delta_{t'}
         """
+        rewards = np.concatenate(rewards_list)
+        lengths = [len(r) for r in rewards_list]
 
-        # create a list of indices (t'): from 0 to T
-        indices = np.arange(len(rewards))
-
-        # create a list where the entry at each index (t') is gamma^(t')
-        discounts = self.gamma ** indices
+        # V(s_{t+1}) is the next entry's value within the same rollout
+        next_values = np.append(values[1:], 0.)
+        next_values[segment_starts(lengths) + np.asarray(lengths) - 1] = 0.
+        deltas = rewards + self.gamma * next_values - values
 
-        # create a list where the entry at each index (t') is gamma^(t') * r_{t'}
-        discounted_rewards = discounts * rewards
+        return discounted_segment_cumsum(deltas, lengths, self.gamma * self.gae_lambda)
 
-        # scalar: sum_{t'=0}^T gamma^(t') * r_{t'}
-        sum_of_discounted_rewards = sum(discounted_rewards)
+    def _discounted_return(self, rewards, lengths):
+        """
+            Helper function
 
-        # list where each entry t contains the same thing
-        # it contains sum_{t'=0}^T gamma^t' r_{t'}
-        list_of_discounted_returns = np.ones_like(rewards) * sum_of_discounted_rewards
+            Input: flat array of rewards {r_0, r_1, ..., r_t', ... r_T} of several rollouts, and their lengths
 
-        return list_of_discounted_returns
+            Output: array where each index t contains sum_{t'=0}^T gamma^t' r_{t'} of t's rollout
+                note that all entries of a rollout are equivalent
+                because each sum is from 0 to T (and doesnt involve t)
+        """
+        return discounted_segment_sum(rewards, lengths, self.gamma)
 
-    def _discounted_cumsum(self, rewards):
+    def _discounted_cumsum(self, rewards, lengths):
         """
             Helper function which
-            -takes a list of rewards {r_0, r_1, ..., r_t', ... r_T},
-            -and returns a list where the entry in each index t' is sum_{t'=t}^T gamma^(t'-t) * r_{t'}
+            -takes a flat array of rewards {r_0, r_1, ..., r_t', ... r_T} of several rollouts, and their lengths
+            -and returns an array where the entry in each index t is sum_{t'=t}^T gamma^(t'-t) * r_{t'},
+             T being the end of t's rollout
         """
-
-        all_discounted_cumsums = []
-
-        # for loop over steps (t) of the given rollout
-        for start_time_index in range(len(rewards)):
-            # create a list of indices (t'): goes from t to T
-            indices = np.arange(start_time_index, len(rewards))
-
-            # create a list of indices (t'-t)
-            indices_adjusted = indices - start_time_index
-
-            # create a list where the entry at each index (t') is gamma^(t'-t)
-            discounts = self.gamma ** (indices_adjusted)  # each entry is gamma^(t'-t)
-
-            # create a list where the entry at each index (t') is gamma^(t'-t) * r_{t'}
-            discounted_rtg = discounts * rewards[start_time_index:]
-
-            # scalar: sum_{t'=t}^T gamma^(t'-t) * r_{t'}
-            sum_discounted_rtg = sum(discounted_rtg)
-            all_discounted_cumsums.append(sum_discounted_rtg)
-
-        list_of_discounted_cumsums = np.array(all_discounted_cumsums)
-        return list_of_discounted_cumsums
-
+        return discounted_segment_cumsum(rewards, lengths, self.gamma)
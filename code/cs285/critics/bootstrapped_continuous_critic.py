@@ -1,4 +1,5 @@
 from .base_critic import BaseCritic
+import torch
 from torch import nn
 from torch import optim
 
@@ -32,6 +33,8 @@ class BootstrappedContinuousCritic(nn.Module, BaseCritic):
         self.num_target_updates = hparams['num_target_updates']
         self.num_grad_steps_per_target_update = hparams['num_grad_steps_per_target_update']
         self.gamma = hparams['gamma']
+        # each gradient step uses a random minibatch of this size (None: the full batch)
+        self.minibatch_size = hparams.get('critic_minibatch_size')
         self.critic_network = ptu.build_mlp(
             self.ob_dim,
             1,
@@ -49,11 +52,12 @@ class BootstrappedContinuousCritic(nn.Module, BaseCritic):
         return self.critic_network(obs).squeeze(1)
 
     def forward_np(self, obs):
-        obs = ptu.from_numpy(obs)
-        predictions = self(obs)
+        obs = ptu.as_tensor(obs)
+        with torch.no_grad():
+            predictions = self(obs)
         return ptu.to_numpy(predictions)
 
-    def update(self, ob_no, ac_na, next_ob_no, reward_n, terminal_n):
+    def update(self, ob_no, ac_na, next_ob_no, reward_n, terminal_n, weight_n=None):
         """
             Update the parameters of the critic.
 
@@ -68,6 +72,8 @@ class BootstrappedContinuousCritic(nn.Module, BaseCritic):
                     the reward for each timestep
                 terminal_n: length: sum_of_path_lengths. Each element in terminal_n is either 1 if the episode ended
                     at that timestep of 0 if the episode did not end
+                weight_n: optional importance-sampling weights (prioritized replay), one per transition.
+                    The TD errors of the updated critic are then kept in self.td_error_n
 
             returns:
                 training loss
@@ -86,21 +92,42 @@ class BootstrappedContinuousCritic(nn.Module, BaseCritic):
         # HINT: make sure to squeeze the output of the critic_network to ensure
         #       that its dimensions match the reward
 
-        ob_no = ptu.from_numpy(ob_no)
-        ac_na = ptu.from_numpy(ac_na)
-        next_ob_no = ptu.from_numpy(next_ob_no)
-        reward_n = ptu.from_numpy(reward_n)
-        terminal_n = ptu.from_numpy(terminal_n)
+        # numpy arrays or tensors already on the device (see ptu.TensorBatch)
+        ob_no = ptu.as_tensor(ob_no)
+        next_ob_no = ptu.as_tensor(next_ob_no)
+        reward_n = ptu.as_tensor(reward_n)
+        terminal_n = ptu.as_tensor(terminal_n)
+        if weight_n is not None:
+            weight_n = ptu.as_tensor(weight_n)
+        n = ob_no.shape[0]
         for i in range(self.num_grad_steps_per_target_update * self.num_target_updates):
             if i % self.num_grad_steps_per_target_update==0:
-
-                v_prime = self(next_ob_no)
-                target = reward_n+self.gamma*v_prime*(1-terminal_n)
-                target = target.detach()
-            loss = self.loss(self(ob_no), target)
+                # the targets are fixed until the next target update: one pass, no graph
+                with torch.no_grad():
+                    v_prime = self(next_ob_no)
+                    target = reward_n+self.gamma*v_prime*(1-terminal_n)
+
+            if self.minibatch_size is not None and self.minibatch_size < n:
+                indices = torch.randint(n, (self.minibatch_size,), device=ob_no.device)
+                prediction = self(ob_no[indices])
+                minibatch_target = target[indices]
+                minibatch_weight = None if weight_n is None else weight_n[indices]
+            else:
+                prediction = self(ob_no)
+                minibatch_target = target
+                minibatch_weight = weight_n
+
+            if minibatch_weight is None:
+                loss = self.loss(prediction, minibatch_target)
+            else:
+                loss = torch.mean(minibatch_weight * (prediction - minibatch_target) ** 2)
 
             self.optimizer.zero_grad()
             loss.backward()
             self.optimizer.step()
 
+        if weight_n is not None:
+            # TD errors of the whole batch, for the replay priorities
+            with torch.no_grad():
+                self.td_error_n = ptu.to_numpy(target - self(ob_no))
         return loss.item()
@@ -3,11 +3,18 @@ import torch
 import torch.optim as optim
 from torch.nn import utils
 from torch import nn
+from torch.nn import functional as F
 
+from cs285.infrastructure import distributed
 from cs285.infrastructure import pytorch_util as ptu
 
 
 class DQNCritic(BaseCritic):
+    """
+        With n_branches set, the Q-network has one head of ac_dim action values
+        per action dimension (an action is one index per branch), and the target
+        bootstraps from the mean over branches of each branch's greedy value.
+    """
 
     def __init__(self, hparams, optimizer_spec, **kwargs):
         super().__init__(**kwargs)
@@ -20,14 +27,16 @@ class DQNCritic(BaseCritic):
             self.input_shape = hparams['input_shape']
 
         self.ac_dim = hparams['ac_dim']
+        self.n_branches = hparams.get('n_branches')
         self.double_q = hparams['double_q']
         self.grad_norm_clipping = hparams['grad_norm_clipping']
         self.gamma = hparams['gamma']
 
         self.optimizer_spec = optimizer_spec
         network_initializer = hparams['q_func']
-        self.q_net = network_initializer(self.ob_dim, self.ac_dim)
-        self.q_net_target = network_initializer(self.ob_dim, self.ac_dim)
+        num_outputs = self.ac_dim * (self.n_branches or 1)
+        self.q_net = network_initializer(self.ob_dim, num_outputs)
+        self.q_net_target = network_initializer(self.ob_dim, num_outputs)
         self.optimizer = self.optimizer_spec.constructor(
             self.q_net.parameters(),
             **self.optimizer_spec.optim_kwargs
@@ -40,29 +49,50 @@ class DQNCritic(BaseCritic):
         self.q_net.to(ptu.device)
         self.q_net_target.to(ptu.device)
 
-    def update(self, ob_no, ac_na, next_ob_no, reward_n, terminal_n):
-        ob_no = ptu.from_numpy(ob_no)
-        ac_na = ptu.from_numpy(ac_na).to(torch.long)
-        next_ob_no = ptu.from_numpy(next_ob_no)
-        reward_n = ptu.from_numpy(reward_n)
-        terminal_n = ptu.from_numpy(terminal_n)
+    def _branch_values(self, q_net, obs):
+        # [N, n_branches, ac_dim], with a single branch when the action is one index
+        return q_net(obs).view(obs.shape[0], self.n_branches or 1, self.ac_dim)
 
-        qa_t_values = self.q_net(ob_no)
-        q_t_values = torch.gather(qa_t_values, 1, ac_na.unsqueeze(1)).squeeze(1)
-        qa_tp1_values = self.q_net_target(next_ob_no)
+    def update(self, ob_no, ac_na, next_ob_no, reward_n, terminal_n, weight_n=None, gamma_n=None):
+        """
+            gamma_n: per-sample discount of the bootstrap term, e.g. gamma ** k
+            for a k-step return; defaults to gamma
+        """
+        ob_no = ptu.as_tensor(ob_no)
+        ac_na = ptu.as_tensor(ac_na).to(torch.long)
+        next_ob_no = ptu.as_tensor(next_ob_no)
+        reward_n = ptu.as_tensor(reward_n)
+        terminal_n = ptu.as_tensor(terminal_n)
+        gamma_n = self.gamma if gamma_n is None else ptu.as_tensor(gamma_n)
+        if ac_na.dim() == 1:
+            ac_na = ac_na.unsqueeze(1)
 
-        if self.double_q:
-            next_actions = self.q_net(next_ob_no).argmax(dim=1)
-            q_tp1 = torch.gather(qa_tp1_values, 1, next_actions.unsqueeze(1)).squeeze(1)
-        else:
-            q_tp1, _ = qa_tp1_values.max(dim=1)
+        qa_t_values = self._branch_values(self.q_net, ob_no)
+        q_t_values = torch.gather(qa_t_values, 2, ac_na.unsqueeze(2)).squeeze(2)
+
+        with torch.no_grad():
+            qa_tp1_values = self._branch_values(self.q_net_target, next_ob_no)
+            if self.double_q:
+                next_actions = self._branch_values(self.q_net, next_ob_no).argmax(dim=2)
+                q_tp1 = torch.gather(qa_tp1_values, 2, next_actions.unsqueeze(2)).squeeze(2)
+            else:
+                q_tp1, _ = qa_tp1_values.max(dim=2)
+            target = reward_n + gamma_n * q_tp1.mean(dim=1) * (1 - terminal_n)
 
-        target = reward_n + self.gamma * q_tp1 * (1 - terminal_n)
-        target = target.detach()
-        loss = self.loss(q_t_values, target)
+        # every branch regresses onto the same target
+        losses = F.smooth_l1_loss(q_t_values, target.unsqueeze(1).expand_as(q_t_values),
+                                  reduction='none').mean(dim=1)
+        if weight_n is None:
+            loss = losses.mean()
+        else:
+            weight_n = ptu.as_tensor(weight_n)
+            loss = torch.mean(weight_n * losses)
+        self.td_error_n = ptu.to_numpy(target - q_t_values.detach().mean(dim=1))
 
         self.optimizer.zero_grad()
         loss.backward()
+        # clip the gradients averaged over data-parallel ranks, not each rank's own
+        distributed.average_gradients(self.optimizer)
         utils.clip_grad_value_(self.q_net.parameters(), self.grad_norm_clipping)
         self.optimizer.step()
 
@@ -75,6 +105,9 @@ class DQNCritic(BaseCritic):
             target_param.data.copy_(param.data)
 
     def qa_values(self, obs):
-        obs = ptu.from_numpy(obs)
-        qa_values = self.q_net(obs)
+        obs = ptu.as_tensor(obs)
+        with torch.no_grad():
+            qa_values = self._branch_values(self.q_net, obs)
+        if self.n_branches is None:
+            qa_values = qa_values.squeeze(1)
         return ptu.to_numpy(qa_values)
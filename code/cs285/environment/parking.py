@@ -1,6 +1,10 @@
+import os
+from collections import namedtuple
 import numpy as np
 from datetime import datetime, timedelta
 
+from cs285.infrastructure.timing import phase
+
 EARTH_D = 7917.5 # mi
 LAT_D, LON_D = 69, 54.6
 MAX_E = 10
@@ -9,19 +13,86 @@ SPEED = 30
 LOSS_COST = 10
 THRESH_MIN, THRESH_MAX = 0, 1
 P_MIN, P_MAX = 0.5, 8
+N_STAGES, N_SLOTS = 7, 48
+NEIGHBOUR_FILES = ('block_dist_sorted.npy', 'block_backup.npy')
+# first day of every stage (see parking_env.identify_stage), and the end of the simulated period
+STAGE_STARTS = [datetime(2019, 12, 1), datetime(2020, 3, 15), datetime(2020, 5, 17), datetime(2020, 7, 17),
+                datetime(2020, 9, 30), datetime(2020, 10, 20), datetime(2020, 11, 13), datetime(2020, 11, 30)]
+
+# an evaluation episode: its start date and the seed of its random stream
+Scenario = namedtuple('Scenario', ['start', 'seed'])
+
+
+def manhattan_distances(lon, lat):
+    return LON_D * np.abs(lon-lon.reshape(-1, 1)) + LAT_D * np.abs(lat-lat.reshape(-1, 1))
+
+
+# for every block, the distances to all blocks in increasing order and the matching block indices
+def block_neighbours(df_block):
+    # parking_env.great_circle_v is the great-circle alternative
+    mat_distance = manhattan_distances(df_block['LONGITUDE'].values, df_block['LATITUDE'].values)
+    return np.sort(mat_distance, axis=1), np.argsort(mat_distance, axis=1)
+
+
+# precompute the neighbour arrays once, e.g. for all the workers of a sweep
+def save_block_neighbours(df_block, cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+    for filename, array in zip(NEIGHBOUR_FILES, block_neighbours(df_block)):
+        np.save(os.path.join(cache_dir, filename), array)
+
+
+# memory-mapped, so that every process using the same cache shares one copy in the page cache
+def load_block_neighbours(cache_dir):
+    return [np.load(os.path.join(cache_dir, filename), mmap_mode='r') for filename in NEIGHBOUR_FILES]
+
+
+# a fixed suite of n evaluation episodes, the i-th starting on a random day of stage i % N_STAGES;
+# replayed with parking_env.reset(scenario), every policy sees the same demand, price thresholds
+# and parking times (common random numbers), so that returns are compared pairwise
+def eval_scenarios(n, seed=0):
+    rng = np.random.RandomState(seed)
+    scenarios = []
+    for i in range(n):
+        stage = i % N_STAGES
+        start = STAGE_STARTS[stage] + timedelta(rng.randint((STAGE_STARTS[stage + 1] - STAGE_STARTS[stage]).days))
+        scenarios.append(Scenario(start, rng.randint(2 ** 31)))
+    return scenarios
+
+
+# the hourly rates of the rate areas before dynamic pricing (see data/Meters/README.md)
+HISTORICAL_RATES = {
+    'Area 1': 3.5, 'Area 2': 3., 'Area 3': 2.,
+    'Port 1': 2.5, 'Port 2': 2.5, 'Port 3': 2., 'Port 4': 2.,
+    'Port 5': 3., 'Port 6': 3., 'Port 7': 3., 'Port 8': 3.,
+    'Port 9': 1., 'Port 10': 1., 'Port 11': 1., 'Port 12': 1.,
+}
+
+
+# price of every rate area (action index OLD_RATE_AREA_id) at the historical rates,
+# `fallback` for the areas without one
+def historical_prices(df_block, fallback=2.):
+    names = df_block.groupby('OLD_RATE_AREA_id')['OLD_RATE_AREA'].first()
+    return np.array([HISTORICAL_RATES.get(names.get(i), fallback)
+                     for i in range(len(df_block['OLD_RATE_AREA_id'].unique()))])
+
+
+# the action for the given prices, inverse of do_simulation's P_MIN + (P_MAX-P_MIN) * a
+def price_action(prices):
+    return (np.asarray(prices, dtype=float) - P_MIN) / (P_MAX - P_MIN)
+
 
 class parking_block():
-    def __init__(self, params, dist):
+    def __init__(self, params, dist, backup_block):
         # params are from csv file
-        # dist records the distance between each two blocks
+        # dist records the distance to every block in increasing order, backup_block the matching block indices
 
         self.block_id = params['BLOCKFACE_ID']
         self.loc = (params['LONGITUDE'], params['LATITUDE'])
         self.capacity = params['SPACE_NUM']
         self.rate_area = params['OLD_RATE_AREA_id']
         self.occupied = 0   # the count of occupied meters
-        self.dist = np.sort(dist)
-        self.backup_block = np.argsort(dist)    # the priority of back-up blocks
+        self.dist = dist
+        self.backup_block = backup_block    # the priority of back-up blocks
 
     def is_full(self):
         return self.capacity == self.occupied
@@ -41,9 +112,11 @@ class parking_block():
                     occ=self.occupied, cap=self.capacity)
 
 class vehicle():
-    def __init__(self, params):
+    def __init__(self, params, rng=np.random):
         self.loc_arrive = params['id']
-        self.price_thresh = np.random.uniform(THRESH_MIN, THRESH_MAX)
+        # all of a vehicle's randomness is drawn on arrival, whatever the prices it meets
+        self.price_thresh = rng.uniform(THRESH_MIN, THRESH_MAX)
+        self.duration_noise = rng.normal()
         self.ind_loc_current = 0
         self.cruising_dist = 0
         self.parked = False
@@ -63,20 +136,54 @@ class vehicle():
                         cur=self.ind_loc_current, dist=self.cruising_dist, rt=self.remaining_time) if self.parked else '')
 
 class parking_env():
-    def __init__(self, df_block, df_demand):
+    # obs_mode 'raw': [stage, slot, occupied count of every block]
+    # obs_mode 'aggregate': per-rate-area occupancy ratio and free capacity, one-hot stage,
+    #   cyclic slot, plus the occupancy ratio of a spatial_bins x spatial_bins lon/lat grid
+    # neighbour_cache: directory of precomputed block neighbours (see save_block_neighbours)
+    # neighbours: the (sorted_dist, backup_block) arrays themselves, e.g. shared by the envs of a multi-seed run
+    def __init__(self, df_block, df_demand, obs_mode='raw', spatial_bins=0, neighbour_cache=None, neighbours=None):
         self.date = datetime(2019,12,1)
         self.slot = 0
         self.stage = 0
         self.df_demand = df_demand
-        # mat_distance = self.great_circle_v(df_block['LONGITUDE'].values, df_block['LATITUDE'].values)
-        mat_distance = self.manhattan_v(df_block['LONGITUDE'].values, df_block['LATITUDE'].values)
-        self.blocks = [parking_block(record, mat_distance[i]) for i, record in enumerate(df_block.to_dict('records'))]
+        # every env draws from its own generator, so that several can be stepped side by side;
+        # rng is the one of the current episode: np_random, or the stream of an eval scenario
+        self.np_random = np.random.RandomState()
+        self.rng = self.np_random
+        if neighbours is not None:
+            sorted_dist, backup_block = neighbours
+        elif neighbour_cache is not None and os.path.exists(os.path.join(neighbour_cache, NEIGHBOUR_FILES[0])):
+            sorted_dist, backup_block = load_block_neighbours(neighbour_cache)
+        else:
+            sorted_dist, backup_block = block_neighbours(df_block)
+        assert len(sorted_dist) == len(df_block), 'The block neighbours are for another block table'
+        self.sorted_dist, self.backup_block = sorted_dist, backup_block
+        self.blocks = [parking_block(record, sorted_dist[i], backup_block[i]) for i, record in enumerate(df_block.to_dict('records'))]
         self.vehicles = np.empty(0)
-        self.ob_dim = 2 + len(self.blocks)
         self.ac_dim = len(df_block['OLD_RATE_AREA_id'].unique())
 
+        # static per-block arrays for the vectorized observation features
+        self.obs_mode = obs_mode
+        self.spatial_bins = spatial_bins
+        self.area_index = df_block['OLD_RATE_AREA_id'].values.astype(int)
+        self.area_capacity = np.bincount(self.area_index, weights=df_block['SPACE_NUM'].values,
+                                         minlength=self.ac_dim)
+        if spatial_bins > 0:
+            lon_bin = self.bin_coordinates(df_block['LONGITUDE'].values, spatial_bins)
+            lat_bin = self.bin_coordinates(df_block['LATITUDE'].values, spatial_bins)
+            self.cell_index = lon_bin * spatial_bins + lat_bin
+            self.cell_capacity = np.bincount(self.cell_index, weights=df_block['SPACE_NUM'].values,
+                                             minlength=spatial_bins ** 2)
+
+        if self.obs_mode == 'raw':
+            self.ob_dim = 2 + len(self.blocks)
+        elif self.obs_mode == 'aggregate':
+            self.ob_dim = 2 * self.ac_dim + N_STAGES + 2 + spatial_bins ** 2
+        else:
+            raise ValueError('Unknown obs_mode {}'.format(obs_mode))
+
     def seed(self, s):
-        np.random.seed(s)
+        self.np_random.seed(s)
 
     def identify_stage(self, dt):
         if dt < datetime(2020, 3, 15):
@@ -119,12 +226,16 @@ class parking_env():
                 + np.cos(lat) * np.cos(lat).reshape(-1, 1) * np.cos(lon-lon.reshape(-1, 1)))
 
     def manhattan_v(self, lon, lat):
-        return LON_D * np.abs(lon-lon.reshape(-1, 1)) + LAT_D * np.abs(lat-lat.reshape(-1, 1))
+        return manhattan_distances(lon, lat)
+
+    def bin_coordinates(self, x, bins):
+        edges = np.linspace(x.min(), x.max(), bins + 1)[1:-1]
+        return np.searchsorted(edges, x, side='right')
 
     # generate demand for each block at time t
     def generate_demand(self):
         df = self.df_demand[(self.df_demand['slot'] == self.slot) & (self.df_demand['stage'] == self.stage)]
-        d = np.random.poisson(df['mean'].values, len(df))
+        d = self.rng.poisson(df['mean'].values, len(df))
         return d
 
     def simulate_v_park(self, v, p):
@@ -132,8 +243,8 @@ class parking_env():
         if (not self.blocks[ind_cur_block].is_full()) | (p[self.blocks[ind_cur_block].rate_area] <= v.price_thresh):
             v.parked = True
             self.blocks[ind_cur_block].inc_v()
-            parking_time = np.random.normal((self.cal_linear_coef(self.blocks[ind_cur_block]) + 7820.5177
-                            - 820.3637*p[self.blocks[ind_cur_block].rate_area]) / 3600, 1.28)
+            parking_time = (self.cal_linear_coef(self.blocks[ind_cur_block]) + 7820.5177
+                            - 820.3637*p[self.blocks[ind_cur_block].rate_area]) / 3600 + 1.28 * v.duration_noise
             v.remaining_time = max(parking_time * 2, 0)
             v.fee = v.remaining_time * p[self.blocks[ind_cur_block].rate_area]
         else:
@@ -148,55 +259,121 @@ class parking_env():
         self.stage = self.identify_stage(self.date)
 
         # parked vehicles
-        ind_vehicles = []
-        for i, v in enumerate(self.vehicles):
-            v.dec_time()
-            if v.remaining_time == 0:
-                ind_cur_block = self.blocks[v.loc_arrive].backup_block[v.ind_loc_current]
-                self.blocks[ind_cur_block].dec_v()
-            else:
-                ind_vehicles.append(i)
-        self.vehicles = self.vehicles[ind_vehicles]
+        with phase('departures'):
+            ind_vehicles = []
+            for i, v in enumerate(self.vehicles):
+                v.dec_time()
+                if v.remaining_time == 0:
+                    ind_cur_block = self.blocks[v.loc_arrive].backup_block[v.ind_loc_current]
+                    self.blocks[ind_cur_block].dec_v()
+                else:
+                    ind_vehicles.append(i)
+            self.vehicles = self.vehicles[ind_vehicles]
 
         # parking vehicles
         num_parked_vehicles = len(self.vehicles)
-        d = self.generate_demand()
-        for i, block in enumerate(self.blocks):
-            self.vehicles = np.append(self.vehicles, [vehicle({'id': i}) for _ in range(d[i])])
-        for t_e in range(MAX_E-1):
-            for v in self.vehicles[num_parked_vehicles:]:
-                if not v.parked:
-                    self.simulate_v_park(v, P_MIN + (P_MAX-P_MIN) * a)
+        with phase('demand'):
+            d = self.generate_demand()
+            # block by block, as before, but appended to the vehicle array at once
+            arrivals = [vehicle({'id': i}, self.rng) for i in np.repeat(np.arange(len(self.blocks)), d)]
+            self.vehicles = np.append(self.vehicles, arrivals)
+        with phase('cruising'):
+            for t_e in range(MAX_E-1):
+                for v in self.vehicles[num_parked_vehicles:]:
+                    if not v.parked:
+                        self.simulate_v_park(v, P_MIN + (P_MAX-P_MIN) * a)
 
-        reward = 0
-        for v in self.vehicles[num_parked_vehicles:]:
-            if v.parked:
-                reward += v.fee - v.cruising_dist / SPEED * VOT
-            else:
-                reward -= LOSS_COST
+        with phase('reward'):
+            reward = 0
+            # the terms of the reward, and the demand it comes from
+            info = {'revenue': 0., 'cruising_cost': 0., 'lost_demand': 0, 'arrivals': len(self.vehicles) - num_parked_vehicles}
+            for v in self.vehicles[num_parked_vehicles:]:
+                if v.parked:
+                    reward += v.fee - v.cruising_dist / SPEED * VOT
+                    info['revenue'] += v.fee
+                    info['cruising_cost'] += v.cruising_dist / SPEED * VOT
+                else:
+                    reward -= LOSS_COST
+                    info['lost_demand'] += 1
 
-        return reward
+        return reward, info
 
     # given the action, simulate the process and get the reward
     def step(self, a):
-        reward = self.do_simulation(a)
+        reward, info = self.do_simulation(a)
         ob = self._get_obs()
         done = self.date >= datetime(2020, 11, 30)
-        return ob, reward, done, None
+        return ob, reward, done, info
 
     def _get_obs(self):
-        return np.concatenate([[self.stage, self.slot], [block.occupied for block in self.blocks]])
+        occupied = np.fromiter((block.occupied for block in self.blocks), dtype=float, count=len(self.blocks))
+        if self.obs_mode == 'raw':
+            return np.concatenate([[self.stage, self.slot], occupied])
 
-    def reset_model(self):
-        self.date = datetime(2019,12,1) + timedelta(np.random.randint(0, 366))
+        area_occupied = np.bincount(self.area_index, weights=occupied, minlength=self.ac_dim)
+        stage_one_hot = np.zeros(N_STAGES)
+        stage_one_hot[self.stage] = 1
+        angle = 2 * np.pi * self.slot / N_SLOTS
+        features = [area_occupied / np.maximum(self.area_capacity, 1),
+                    self.area_capacity - area_occupied,
+                    stage_one_hot,
+                    [np.sin(angle), np.cos(angle)]]
+        if self.spatial_bins > 0:
+            cell_occupied = np.bincount(self.cell_index, weights=occupied, minlength=self.spatial_bins ** 2)
+            features.append(cell_occupied / np.maximum(self.cell_capacity, 1))
+        return np.concatenate(features)
+
+    # total number of occupied spaces for a batch of observations, in either obs_mode
+    def total_occupancy(self, observations):
+        if self.obs_mode == 'raw':
+            return np.sum(observations[:, 2:], axis=1)
+        return self.area_capacity.sum() - np.sum(observations[:, self.ac_dim:2 * self.ac_dim], axis=1)
+
+    # bytes of the data that does not change during a run; the per-block sorted
+    # distances and backup orders are N x N in total
+    def static_nbytes(self):
+        block_bytes = sum(block.dist.nbytes + block.backup_block.nbytes for block in self.blocks)
+        index_bytes = self.area_index.nbytes + self.area_capacity.nbytes
+        if self.spatial_bins > 0:
+            index_bytes += self.cell_index.nbytes + self.cell_capacity.nbytes
+        return block_bytes + index_bytes + int(self.df_demand.memory_usage(deep=True).sum())
+
+    # the simulation clock and everything parked, for checkpoints
+    def state_dict(self):
+        return {
+            'date': self.date,
+            'slot': self.slot,
+            'stage': self.stage,
+            'vehicles': self.vehicles,
+            'occupied': np.array([block.occupied for block in self.blocks]),
+            'rng': self.np_random.get_state(),
+        }
+
+    def load_state_dict(self, state):
+        self.date, self.slot, self.stage = state['date'], state['slot'], state['stage']
+        self.vehicles = state['vehicles']
+        for block, occupied in zip(self.blocks, state['occupied']):
+            block.occupied = occupied
+        if 'rng' in state:
+            self.np_random.set_state(state['rng'])
+        self.rng = self.np_random
+
+    def reset_model(self, scenario=None):
+        if scenario is None:
+            self.rng = self.np_random
+            self.date = datetime(2019,12,1) + timedelta(self.np_random.randint(0, 366))
+        else:
+            self.rng = np.random.RandomState(scenario.seed)
+            self.date = scenario.start
+        self.slot = 0
         self.stage = self.identify_stage(self.date)
         self.vehicles = np.empty(0)
         for b in self.blocks:
             b.reset()
         return self._get_obs()
 
-    def reset(self):
-        ob = self.reset_model()
+    def reset(self, scenario=None):
+        ob = self.reset_model(scenario)
         return ob
 
     def __str__(self):
@@ -0,0 +1,104 @@
+import copy
+import glob
+import os
+import queue
+import threading
+
+import numpy as np
+import torch
+
+CHECKPOINT_DIR = 'checkpoints'
+CHECKPOINT_PATTERN = 'checkpoint_{:06d}.pt'
+
+
+def snapshot(state):
+    """
+        Deep copy of a (nested) state dict with every tensor copied to the cpu,
+        so that training can keep updating the live tensors while it is written
+    """
+    if isinstance(state, torch.Tensor):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return {key: snapshot(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot(value) for value in state)
+    if isinstance(state, np.ndarray) and state.dtype != object:
+        return state.copy()
+    return copy.deepcopy(state)
+
+
+def list_checkpoints(checkpoint_dir):
+    return sorted(glob.glob(os.path.join(checkpoint_dir, CHECKPOINT_PATTERN.replace('{:06d}', '*'))))
+
+
+def latest_checkpoint(checkpoint_dir):
+    checkpoints = list_checkpoints(checkpoint_dir)
+    return checkpoints[-1] if checkpoints else None
+
+
+def load_checkpoint(filename):
+    # checkpoints hold numpy RNG states and env objects, not only tensors
+    return torch.load(filename, map_location='cpu', weights_only=False)
+
+
+class CheckpointWriter(object):
+    """
+        Writes checkpoints from a background thread and keeps the newest keep_last of them.
+
+        save() snapshots the state in the caller's thread and returns; pickling and
+        disk I/O happen on the writer thread. Each file is written to a temporary
+        name and renamed, so a killed run never leaves a truncated checkpoint behind.
+    """
+
+    def __init__(self, checkpoint_dir, keep_last=3):
+        self.checkpoint_dir = checkpoint_dir
+        # [:-0] would be an empty slice, i.e. keep everything
+        assert keep_last >= 1, 'keep_last must be at least 1'
+        self.keep_last = keep_last
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+
+        # at most one checkpoint waits while another is being written
+        self.queue = queue.Queue(maxsize=1)
+        # the writer thread stops at its first error, which save() and close() re-raise
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def save(self, state, itr):
+        self._put((itr, snapshot(state)))
+
+    def _put(self, item):
+        # never wait on a writer thread that has stopped
+        while True:
+            self._raise_error()
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise RuntimeError('Writing a checkpoint to {} failed'.format(self.checkpoint_dir)) from self.error
+
+    def _run(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                itr, state = item
+                filename = os.path.join(self.checkpoint_dir, CHECKPOINT_PATTERN.format(itr))
+                torch.save(state, filename + '.tmp')
+                os.replace(filename + '.tmp', filename)
+                for old_checkpoint in list_checkpoints(self.checkpoint_dir)[:-self.keep_last]:
+                    os.remove(old_checkpoint)
+        except BaseException as e:
+            self.error = e
+
+    def close(self):
+        # wait for the pending checkpoints to be on disk
+        if self.thread.is_alive():
+            self._put(None)
+            self.thread.join()
+        self._raise_error()
@@ -0,0 +1,188 @@
+"""
+    Data-parallel training on the cpu with the gloo backend. Every rank runs the whole
+    training loop on its own share of the batch, from its own envs; the ranks start from
+    rank 0's weights and average their gradients before every optimizer step, so their
+    weights stay identical. Outside of a launched run every helper falls back to the
+    single-process behaviour.
+"""
+import os
+import sys
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from cs285.infrastructure import pytorch_util as ptu
+
+# rank r seeds its envs and random generators with seed + r * RANK_SEED_STRIDE
+RANK_SEED_STRIDE = 1000
+
+
+def launch(fn, world_size, port, *args):
+    """
+        Run fn(*args) in world_size processes on this machine, connected through localhost
+    """
+    mp.spawn(_run_rank, args=(fn, world_size, port, args), nprocs=world_size)
+
+
+def _run_rank(rank, fn, world_size, port, args):
+    os.environ.update(RANK=str(rank), WORLD_SIZE=str(world_size),
+                      MASTER_ADDR='127.0.0.1', MASTER_PORT=str(port))
+    # the cores are shared between ranks; rank 0 speaks for all of them
+    torch.set_num_threads(max(1, torch.get_num_threads() // world_size))
+    if rank > 0:
+        sys.stdout = open(os.devnull, 'w')
+    fn(*args)
+
+
+def init_from_env():
+    # join the process group described by RANK/WORLD_SIZE/MASTER_ADDR/MASTER_PORT, if any
+    if not dist.is_initialized() and int(os.environ.get('WORLD_SIZE', 1)) > 1:
+        dist.init_process_group('gloo', init_method='env://')
+
+
+def is_enabled():
+    return dist.is_available() and dist.is_initialized()
+
+
+def rank():
+    return dist.get_rank() if is_enabled() else 0
+
+
+def world_size():
+    return dist.get_world_size() if is_enabled() else 1
+
+
+def is_main():
+    return rank() == 0
+
+
+def rank_seed(seed):
+    return seed + RANK_SEED_STRIDE * rank()
+
+
+def shard(n):
+    # this rank's share of n, e.g. of the steps collected per iteration
+    return -(-n // world_size())
+
+
+def rank_dir(directory):
+    # per-rank subdirectory, for data that differs between ranks; rank 0 keeps `directory`
+    if rank() == 0:
+        return directory
+    return os.path.join(directory, 'rank{}'.format(rank()))
+
+
+def sync_agent(agent):
+    """
+        Copy rank 0's weights (including target networks) to every rank, and average
+        the gradients of every optimizer of the agent across ranks before each step
+    """
+    if not is_enabled():
+        return
+    modules, optimizers = ptu.find_modules_and_optimizers(agent)
+    with torch.no_grad():
+        for module in modules:
+            for tensor in list(module.parameters()) + list(module.buffers()):
+                dist.broadcast(tensor.data, 0)
+    for optimizer in optimizers:
+        optimizer.register_step_pre_hook(_average_gradients)
+
+
+def average_gradients(optimizer):
+    """
+        Average the gradients of the optimizer's parameters over ranks now, e.g. to clip
+        the averaged gradients; the optimizer's next step then leaves them as they are
+    """
+    if not is_enabled():
+        return
+    _all_reduce_gradients(optimizer)
+    optimizer._gradients_averaged = True
+
+
+def _average_gradients(optimizer, args, kwargs):
+    if getattr(optimizer, '_gradients_averaged', False):
+        optimizer._gradients_averaged = False
+        return
+    _all_reduce_gradients(optimizer)
+
+
+def _all_reduce_gradients(optimizer):
+    # one all-reduce of all the gradients, flattened
+    grads = [p.grad for group in optimizer.param_groups for p in group['params'] if p.grad is not None]
+    if not grads:
+        return
+    flat = torch.cat([grad.reshape(-1) for grad in grads])
+    dist.all_reduce(flat)
+    flat /= world_size()
+    offset = 0
+    for grad in grads:
+        grad.copy_(flat[offset:offset + grad.numel()].view_as(grad))
+        offset += grad.numel()
+
+
+def mean_std(x):
+    """
+        Mean and (biased) standard deviation of the array or tensor x over the data
+        of all ranks, as floats; of the local data when not distributed
+    """
+    if not is_enabled():
+        if isinstance(x, torch.Tensor):
+            return x.mean().item(), x.std(unbiased=False).item()
+        return np.mean(x), np.std(x)
+    x = torch.as_tensor(x).detach().to('cpu', torch.float64).reshape(-1)
+    moments = torch.stack([torch.tensor(float(len(x)), dtype=torch.float64), x.sum(), (x * x).sum()])
+    dist.all_reduce(moments)
+    n, total, total_sq = moments.tolist()
+    mean = total / n
+    return mean, max(total_sq / n - mean ** 2, 0.) ** 0.5
+
+
+def mean(value):
+    # average of a float over ranks
+    if not is_enabled():
+        return value
+    value = torch.tensor(float(value), dtype=torch.float64)
+    dist.all_reduce(value)
+    return value.item() / world_size()
+
+
+def sum_int(value):
+    if not is_enabled():
+        return value
+    value = torch.tensor(int(value), dtype=torch.int64)
+    dist.all_reduce(value)
+    return int(value.item())
+
+
+def max_int(value):
+    if not is_enabled():
+        return value
+    value = torch.tensor(int(value), dtype=torch.int64)
+    dist.all_reduce(value, op=dist.ReduceOp.MAX)
+    return int(value.item())
+
+
+def gather_lists(lists):
+    """
+        dict of lists -> the same dict with every list concatenated over ranks, in rank order
+    """
+    if not is_enabled():
+        return lists
+    gathered = [None] * world_size()
+    dist.all_gather_object(gathered, lists)
+    return {key: [value for rank_lists in gathered for value in rank_lists[key]] for key in lists}
+
+
+def check_same(value, what):
+    if not is_enabled():
+        return
+    gathered = [None] * world_size()
+    dist.all_gather_object(gathered, value)
+    assert all(other == gathered[0] for other in gathered), 'ranks disagree on {}: {}'.format(what, gathered)
+
+
+def close():
+    if is_enabled():
+        dist.destroy_process_group()
@@ -0,0 +1,47 @@
+from collections import namedtuple
+
+import torch.optim as optim
+
+from cs285.infrastructure import pytorch_util as ptu
+
+OptimizerSpec = namedtuple(
+    "OptimizerSpec",
+    ["constructor", "optim_kwargs", "learning_rate_schedule"],
+)
+
+
+def create_parking_q_network(ob_dim, num_actions, n_layers=2, size=64):
+    return ptu.build_mlp(ob_dim, num_actions, n_layers, size, activation='relu')
+
+
+def parking_optimizer(learning_rate):
+    # LambdaLR multiplies lr=1 by the schedule, so the schedule is the learning rate itself
+    return OptimizerSpec(
+        constructor=optim.Adam,
+        optim_kwargs=dict(lr=1),
+        learning_rate_schedule=lambda t: learning_rate,
+    )
+
+
+class LinearSchedule(object):
+    def __init__(self, schedule_timesteps, final_p, initial_p=1.0):
+        """Linear interpolation between initial_p and final_p over
+        schedule_timesteps. After this many timesteps pass final_p is
+        returned.
+        Parameters
+        ----------
+        schedule_timesteps: int
+            Number of timesteps for which to linearly anneal initial_p
+            to final_p
+        initial_p: float
+            initial output value
+        final_p: float
+            final output value
+        """
+        self.schedule_timesteps = schedule_timesteps
+        self.final_p = final_p
+        self.initial_p = initial_p
+
+    def value(self, t):
+        fraction = min(float(t) / self.schedule_timesteps, 1.0)
+        return self.initial_p + fraction * (self.final_p - self.initial_p)
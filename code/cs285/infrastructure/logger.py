@@ -2,17 +2,23 @@ import os
 from tensorboardX import SummaryWriter
 import numpy as np
 
+from cs285.infrastructure.metrics_sink import MetricsSink
+
 class Logger:
-    def __init__(self, log_dir, n_logged_samples=10, summary_writer=None):
+    def __init__(self, log_dir, n_logged_samples=10, summary_writer=None, max_queue=1000, flush_secs=30):
         self._log_dir = log_dir
         print('########################')
         print('logging outputs to ', log_dir)
         print('########################')
         self._n_logged_samples = n_logged_samples
-        self._summ_writer = SummaryWriter(log_dir, flush_secs=1, max_queue=1)
+        # events are queued in memory and written by tensorboardX's own writer thread
+        self._summ_writer = SummaryWriter(log_dir, flush_secs=flush_secs, max_queue=max_queue)
+        # the same scalars as a csv that can be read without tensorboard
+        self._metrics = MetricsSink(log_dir, max_rows=max_queue, flush_secs=flush_secs)
 
     def log_scalar(self, scalar, name, step_):
         self._summ_writer.add_scalar('{}'.format(name), scalar, step_)
+        self._metrics.log(scalar, name, step_)
 
     def log_scalars(self, scalar_dict, group_name, step, phase):
         """Will log all scalars in the same plot."""
@@ -68,7 +74,8 @@ class Logger:
 
     def flush(self):
         self._summ_writer.flush()
+        self._metrics.flush()
 
-
-
-
+    def close(self):
+        self._summ_writer.close()
+        self._metrics.close()
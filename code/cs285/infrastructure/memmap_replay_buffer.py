@@ -0,0 +1,253 @@
+import json
+import os
+
+import numpy as np
+
+from cs285.infrastructure.rollout_dataset import append_npy, truncate_npy
+from cs285.infrastructure.utils import add_noise, Path
+
+# (path key, dtype) of every field kept on disk
+FIELDS = [
+    ('observation', np.float32),
+    ('action', np.float32),
+    ('reward', np.float32),
+    ('next_observation', np.float32),
+    ('terminal', np.float32),
+]
+META_FILE = 'meta.json'
+# (absolute start, length) of every trajectory ever added, appended to as they come
+PATHS_FILE = 'paths.npy'
+
+
+class MemmapReplayBuffer(object):
+    """
+        Disk-backed replay buffer with the same sampling interface as ReplayBuffer.
+
+        Every field is a preallocated ring of max_size rows stored as a memory-mapped
+        .npy file under buffer_dir. A small json file records the write head and the
+        number of stored transitions and trajectories, and paths.npy the (start, length)
+        of every trajectory, so that a new process can reopen the directory and continue
+        appending.
+        Sampling only touches the rows it reads, through the page cache.
+    """
+
+    def __init__(self, buffer_dir, max_size=1000000):
+
+        self.buffer_dir = buffer_dir
+        self.max_size = max_size
+
+        # total number of transitions ever added; the ring head is num_added % max_size
+        self.num_added = 0
+        # absolute (never wrapped) start index and length of each stored trajectory
+        self.path_starts = []
+        self.path_lengths = []
+        # rows of paths.npy: written so far, and the first one still in the buffer;
+        # the (start, length) of the paths added since the last flush
+        self.num_paths = 0
+        self.first_path = 0
+        self.new_paths = []
+        self.shapes = None
+        self.arrays = None
+
+        os.makedirs(self.buffer_dir, exist_ok=True)
+        if os.path.exists(self._meta_path()):
+            self._open()
+
+    ########################################
+    ########################################
+
+    @property
+    def size(self):
+        return min(self.num_added, self.max_size)
+
+    @property
+    def head(self):
+        return self.num_added % self.max_size
+
+    def __len__(self):
+        return self.size
+
+    def _meta_path(self):
+        return os.path.join(self.buffer_dir, META_FILE)
+
+    def _paths_path(self):
+        return os.path.join(self.buffer_dir, PATHS_FILE)
+
+    def _field_path(self, key):
+        return os.path.join(self.buffer_dir, key + '.npy')
+
+    def _open(self):
+        with open(self._meta_path(), 'r') as f:
+            meta = json.load(f)
+        if meta['max_size'] != self.max_size:
+            print('Reopening replay buffer with max_size {} (requested {})'.format(
+                meta['max_size'], self.max_size))
+        self.max_size = meta['max_size']
+        self.num_added = meta['num_added']
+        if 'path_starts' in meta:
+            # written before paths.npy: every path is written there at the next flush
+            self.path_starts = meta['path_starts']
+            self.path_lengths = meta['path_lengths']
+            self.new_paths = list(zip(self.path_starts, self.path_lengths))
+        else:
+            self.num_paths = meta['num_paths']
+            self.first_path = meta['first_path']
+            if self.num_paths > 0:
+                # drop the rows of a flush that was interrupted before its meta was written
+                truncate_npy(self._paths_path(), self.num_paths)
+                paths = np.load(self._paths_path())[self.first_path:]
+                self.path_starts = paths[:, 0].tolist()
+                self.path_lengths = paths[:, 1].tolist()
+        self.shapes = {key: tuple(shape) for key, shape in meta['shapes'].items()}
+        self.arrays = {key: np.lib.format.open_memmap(self._field_path(key), mode='r+')
+                       for key, _ in FIELDS}
+        print('Reopened replay buffer at {} with {} transitions'.format(self.buffer_dir, self.size))
+
+    def _create(self, path):
+        self.shapes = {key: path[key].shape[1:] for key, _ in FIELDS}
+        self.arrays = {
+            key: np.lib.format.open_memmap(self._field_path(key), mode='w+', dtype=dtype,
+                                           shape=(self.max_size,) + self.shapes[key])
+            for key, dtype in FIELDS
+        }
+
+    def _write_meta(self):
+        meta = {
+            'max_size': self.max_size,
+            'num_added': self.num_added,
+            'head': self.head,
+            'size': self.size,
+            'num_paths': self.num_paths,
+            'first_path': self.first_path,
+            'shapes': {key: list(shape) for key, shape in self.shapes.items()},
+        }
+        tmp_path = self._meta_path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path())
+
+    def flush(self):
+        if self.arrays is None:
+            return
+        for array in self.arrays.values():
+            array.flush()
+        if self.new_paths:
+            append_npy(self._paths_path(), np.array(self.new_paths, dtype=np.int64))
+            self.num_paths += len(self.new_paths)
+            self.new_paths = []
+        self._write_meta()
+
+    ########################################
+    ########################################
+
+    def add_rollouts(self, paths, noised=False):
+
+        if self.arrays is None:
+            self._create(paths[0])
+
+        for path in paths:
+            length = len(path['reward'])
+            if length > self.max_size:
+                path = {key: path[key][-self.max_size:] for key, _ in FIELDS}
+                length = self.max_size
+            if noised:
+                path = dict(path)
+                path['observation'] = add_noise(path['observation'])
+                path['next_observation'] = add_noise(path['next_observation'])
+
+            rows = self._ring_indices(self.num_added, self.num_added + length)
+            for key, _ in FIELDS:
+                self.arrays[key][rows] = path[key]
+
+            self.path_starts.append(self.num_added)
+            self.path_lengths.append(length)
+            self.new_paths.append((self.num_added, length))
+            self.num_added += length
+
+        self._drop_overwritten_paths()
+        self.flush()
+
+    def add_dataset(self, dataset, chunk_size=10000):
+        """
+            Copy every transition of a RolloutDataset into the ring, chunk by chunk
+        """
+        if self.arrays is None:
+            self._create(dataset)
+
+        # only the most recent max_size transitions can survive anyway
+        first = max(0, len(dataset) - self.max_size)
+        for start in range(first, len(dataset), chunk_size):
+            stop = min(start + chunk_size, len(dataset))
+            rows = self._ring_indices(self.num_added + start - first, self.num_added + stop - first)
+            for key, _ in FIELDS:
+                self.arrays[key][rows] = dataset[key][start:stop]
+
+        offsets = dataset.offsets
+        for start, length in zip(offsets[:-1], np.diff(offsets)):
+            if start >= first:
+                self.path_starts.append(int(self.num_added + start - first))
+                self.path_lengths.append(int(length))
+                self.new_paths.append((self.path_starts[-1], self.path_lengths[-1]))
+        self.num_added += len(dataset) - first
+        self._drop_overwritten_paths()
+        self.flush()
+
+    def _drop_overwritten_paths(self):
+        # forget trajectories whose first transition has been overwritten
+        oldest = self.num_added - self.size
+        first_kept = next((i for i, start in enumerate(self.path_starts) if start >= oldest),
+                          len(self.path_starts))
+        del self.path_starts[:first_kept]
+        del self.path_lengths[:first_kept]
+        self.first_path += first_kept
+
+    def _ring_indices(self, start, stop):
+        return np.arange(start, stop) % self.max_size
+
+    def _read(self, rows):
+        return [self.arrays[key][rows] for key, _ in FIELDS]
+
+    ########################################
+    ########################################
+
+    def sample_random_rollouts(self, num_rollouts):
+        rand_indices = np.random.permutation(len(self.path_starts))[:num_rollouts]
+        return [self._read_path(i) for i in rand_indices]
+
+    def sample_recent_rollouts(self, num_rollouts=1):
+        num_paths = len(self.path_starts)
+        return [self._read_path(i) for i in range(max(0, num_paths - num_rollouts), num_paths)]
+
+    def _read_path(self, i):
+        rows = self._ring_indices(self.path_starts[i], self.path_starts[i] + self.path_lengths[i])
+        obs, acs, rews, next_obs, terminals = self._read(rows)
+        return Path(obs, [], acs, rews, next_obs, terminals)
+
+    ########################################
+    ########################################
+
+    def sample_random_data(self, batch_size):
+
+        # sorted rows keep the reads close to sequential on disk
+        rand_indices = np.sort(np.random.choice(self.size, min(batch_size, self.size), replace=False))
+        return tuple(self._read(rand_indices))
+
+    def sample_recent_data(self, batch_size=1, concat_rew=True):
+
+        if concat_rew:
+            batch_size = min(batch_size, self.size)
+            rows = self._ring_indices(self.num_added - batch_size, self.num_added)
+            return tuple(self._read(rows))
+        else:
+            num_recent_rollouts_to_return = 0
+            num_datapoints_so_far = 0
+            index = -1
+            while num_datapoints_so_far < batch_size and num_recent_rollouts_to_return < len(self.path_lengths):
+                num_datapoints_so_far += self.path_lengths[index]
+                index -= 1
+                num_recent_rollouts_to_return += 1
+            rows = self._ring_indices(self.num_added - num_datapoints_so_far, self.num_added)
+            observations, actions, concatenated_rews, next_observations, terminals = self._read(rows)
+            split_points = np.cumsum(self.path_lengths[-num_recent_rollouts_to_return:])[:-1]
+            unconcatenated_rews = np.split(concatenated_rews, split_points)
+            return observations, actions, unconcatenated_rews, next_observations, terminals
@@ -0,0 +1,97 @@
+import os
+import resource
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+from cs285.infrastructure import pytorch_util as ptu
+
+MB = 1024 ** 2
+
+
+def nbytes(x):
+    """
+        Bytes held by an array, a tensor, or a (nested) list / tuple / dict of them
+    """
+    if isinstance(x, np.ndarray):
+        return x.nbytes
+    if isinstance(x, torch.Tensor):
+        return x.element_size() * x.nelement()
+    if isinstance(x, dict):
+        return sum(nbytes(value) for value in x.values())
+    if isinstance(x, (list, tuple)):
+        return sum(nbytes(value) for value in x)
+    return 0
+
+
+def process_rss():
+    # current and peak resident set size, in bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        current = peak
+    # ru_maxrss is only updated from time to time
+    return current, max(current, peak)
+
+
+def replay_buffer_bytes(replay_buffer):
+    """
+        Bytes per field of a ReplayBuffer (and subclasses) or a MemmapReplayBuffer.
+        Memory-mapped fields are reported too, but live in the page cache rather than the heap.
+    """
+    if hasattr(replay_buffer, 'arrays'):
+        return OrderedDict((key, nbytes(array)) for key, array in (replay_buffer.arrays or {}).items())
+
+    fields = OrderedDict([
+        ('obs', replay_buffer.obs),
+        ('acs', replay_buffer.acs),
+        ('rews', replay_buffer.concatenated_rews),
+        ('next_obs', replay_buffer.next_obs),
+        ('terminals', replay_buffer.terminals),
+        ('unconcatenated_rews', replay_buffer.unconcatenated_rews),
+        # every added path dict is kept, on top of the concatenated arrays above
+        ('paths', replay_buffer.paths),
+    ])
+    if hasattr(replay_buffer, 'priorities'):
+        fields['priorities'] = [replay_buffer.priorities, replay_buffer.tree.tree]
+    return OrderedDict((key, nbytes(value)) for key, value in fields.items())
+
+
+def torch_bytes(agent):
+    """
+        Parameter (and buffer) bytes of every module of the agent, and the state bytes
+        of its optimizers (see ptu.find_modules_and_optimizers)
+    """
+    modules, optimizers = ptu.find_modules_and_optimizers(agent)
+    tensors = {id(tensor): tensor for module in modules
+               for tensor in list(module.parameters()) + list(module.buffers())}
+    parameter_bytes = sum(nbytes(tensor) for tensor in tensors.values())
+    optimizer_bytes = sum(nbytes(list(optimizer.state.values())) for optimizer in optimizers)
+    return parameter_bytes, optimizer_bytes
+
+
+def memory_report(agent, env):
+    """
+        Memory/* scalars, in MB unless noted. Cheap enough to compute every iteration:
+        only sizes are summed, nothing is copied.
+    """
+    report = OrderedDict()
+    buffer_fields = replay_buffer_bytes(agent.replay_buffer)
+    for key, value in buffer_fields.items():
+        report['Memory/Buffer_' + key] = value / MB
+    report['Memory/Buffer_Total'] = sum(buffer_fields.values()) / MB
+
+    report['Memory/Env_VehiclesAlive'] = len(env.vehicles)
+    report['Memory/Env_StaticData'] = env.static_nbytes() / MB
+
+    parameter_bytes, optimizer_bytes = torch_bytes(agent)
+    report['Memory/Torch_Parameters'] = parameter_bytes / MB
+    report['Memory/Torch_OptimizerState'] = optimizer_bytes / MB
+
+    current, peak = process_rss()
+    report['Memory/RSS'] = current / MB
+    report['Memory/PeakRSS'] = peak / MB
+    return report
@@ -0,0 +1,72 @@
+import csv
+import os
+import threading
+import time
+
+import pandas as pd
+
+METRICS_FILE = 'metrics.csv'
+COLUMNS = ['step', 'name', 'value', 'wall_time']
+
+
+class MetricsSink(object):
+    """
+        Buffers scalars in memory and appends them to <log_dir>/metrics.csv
+        (one step,name,value,wall_time row per scalar) from a background thread,
+        once max_rows are pending or flush_secs have passed. log() only appends
+        to a list, so it costs next to nothing in the training loop.
+    """
+
+    def __init__(self, log_dir, max_rows=1000, flush_secs=30):
+        self.filename = os.path.join(log_dir, METRICS_FILE)
+        self.max_rows = max_rows
+        self.flush_secs = flush_secs
+
+        self._rows = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def log(self, value, name, step):
+        with self._lock:
+            self._rows.append((step, name, float(value), time.time()))
+            if len(self._rows) >= self.max_rows:
+                self._wake.set()
+
+    def flush(self):
+        with self._lock:
+            rows, self._rows = self._rows, []
+        if not rows:
+            return
+        with self._write_lock:
+            # a resumed run appends to the file of the original one
+            write_header = not os.path.exists(self.filename)
+            with open(self.filename, 'a', newline='') as f:
+                writer = csv.writer(f)
+                if write_header:
+                    writer.writerow(COLUMNS)
+                writer.writerows(rows)
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_secs)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+
+
+def load_metrics(log_dir):
+    """
+        Read a run's metrics.csv back as a wide DataFrame: one row per step,
+        one column per scalar name (the last value wins if a step was logged twice)
+    """
+    df = pd.read_csv(os.path.join(log_dir, METRICS_FILE))
+    return df.pivot_table(index='step', columns='name', values='value', aggfunc='last')
@@ -0,0 +1,117 @@
+import numpy as np
+
+from cs285.infrastructure.replay_buffer import ReplayBuffer
+from cs285.infrastructure.utils import get_pathlength
+
+
+class SumTree(object):
+    """
+        Array-backed binary sum-tree over `capacity` leaves.
+
+        tree[1] is the root, node i has children 2i and 2i+1, and the leaves
+        live in tree[cap:2*cap]. All operations are vectorized over a batch of
+        leaves, so updating or sampling k leaves costs O(k log N) numpy work.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = 1
+        while self.capacity < capacity:
+            self.capacity *= 2
+        self.depth = int(np.log2(self.capacity))
+        self.tree = np.zeros(2 * self.capacity)
+
+    def total(self):
+        return self.tree[1]
+
+    def update(self, indices, priorities):
+        nodes = np.asarray(indices) + self.capacity
+        self.tree[nodes] = priorities
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes // 2)
+
+    def build(self, priorities):
+        # rebuild every level from scratch, e.g. after the leaves have shifted
+        self.tree[:] = 0
+        self.tree[self.capacity:self.capacity + len(priorities)] = priorities
+        level = self.capacity // 2
+        while level >= 1:
+            self.tree[level:2 * level] = self.tree[2 * level:4 * level:2] + self.tree[2 * level + 1:4 * level:2]
+            level //= 2
+
+    def find(self, values):
+        # descend from the root, going right whenever the value exceeds the left subtree's mass
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = self.tree[2 * nodes]
+            go_right = values > left
+            values -= left * go_right
+            nodes = 2 * nodes + go_right
+        return nodes - self.capacity
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+        ReplayBuffer that additionally samples transitions proportionally to
+        (|TD error| + eps) ** alpha, and returns importance-sampling weights
+        (N * P(i)) ** -beta, normalized by their max, with each batch.
+        New transitions get the largest priority seen so far.
+    """
+
+    def __init__(self, max_size=1000000, alpha=0.6, beta=0.4, eps=1e-6):
+        super().__init__(max_size)
+        self.alpha = alpha
+        self.beta = beta
+        self.eps = eps
+        self.tree = SumTree(max_size)
+        self.priorities = None
+        self.max_priority = 1.0
+
+    def add_rollouts(self, paths, noised=False):
+        old_size = 0 if self.obs is None else self.obs.shape[0]
+        super().add_rollouts(paths, noised)
+        self._add_priorities(old_size, sum(get_pathlength(path) for path in paths))
+
+    def add_dataset(self, dataset):
+        old_size = 0 if self.obs is None else self.obs.shape[0]
+        super().add_dataset(dataset)
+        self._add_priorities(old_size, min(len(dataset), self.max_size))
+
+    def _add_priorities(self, old_size, num_new):
+        new_priorities = np.full(num_new, self.max_priority ** self.alpha)
+        if self.priorities is None:
+            self.priorities = new_priorities[-self.max_size:]
+        else:
+            self.priorities = np.concatenate([self.priorities, new_priorities])[-self.max_size:]
+
+        if old_size + num_new > self.max_size:
+            # the oldest transitions were dropped, so every index has shifted
+            self.tree.build(self.priorities)
+        else:
+            self.tree.update(np.arange(old_size, old_size + num_new), new_priorities)
+
+    def sample_prioritized_data(self, batch_size, beta=None):
+        beta = self.beta if beta is None else beta
+        size = self.obs.shape[0]
+        total = self.tree.total()
+
+        # stratified sampling: one draw from each of batch_size equal slices of the total mass
+        segment = total / batch_size
+        values = (np.arange(batch_size) + np.random.uniform(size=batch_size)) * segment
+        indices = np.minimum(self.tree.find(values), size - 1)
+
+        probs = self.priorities[indices] / total
+        weights = (size * probs) ** (-beta)
+        weights = (weights / weights.max()).astype(np.float32)
+
+        return self.obs[indices], self.acs[indices], self.concatenated_rews[indices], \
+            self.next_obs[indices], self.terminals[indices], weights, indices
+
+    def update_priorities(self, indices, td_errors):
+        td_errors = np.abs(td_errors) + self.eps
+        priorities = td_errors ** self.alpha
+        self.priorities[indices] = priorities
+        self.tree.update(indices, priorities)
+        self.max_priority = max(self.max_priority, np.max(td_errors))
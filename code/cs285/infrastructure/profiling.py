@@ -0,0 +1,107 @@
+import os
+import sys
+import threading
+from collections import Counter
+
+import torch
+
+from cs285.infrastructure import timing
+
+
+def parse_iteration_range(spec):
+    # 'a:b' -> iterations a, ..., b-1, like a python slice
+    start, stop = spec.split(':')
+    start, stop = int(start), int(stop)
+    assert 0 <= start < stop, 'profile_iters must be a:b with 0 <= a < b, got {}'.format(spec)
+    return start, stop
+
+
+class SamplingProfiler(object):
+    """
+        Statistical profiler: a background thread records the python call stack
+        of the profiled thread every `interval` seconds. The profiled code runs
+        unmodified, so pure-python hot spots such as parking_env.simulate_v_park
+        show up with their true share of the time. Stacks are written in the
+        folded format read by flamegraph.pl, speedscope and similar tools.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.counts = Counter()
+        self._thread_id = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename),
+                                                 code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def write_folded(self, filename):
+        with open(filename, 'w') as f:
+            for stack, count in self.counts.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+class IterationProfiler(object):
+    """
+        Profiles training iterations [start_itr, stop_itr) and writes the result to logdir:
+        'sampling' writes profile_itr<a>-<b>.folded; 'torch' runs torch.profiler on the
+        cpu and writes a chrome trace (profile_itr<a>-<b>.json, shown as a flame chart by
+        perfetto or speedscope) of the torch ops, with every timing.phase (including the
+        env's departures/demand/cruising/reward) recorded as a labelled range. Python
+        stacks are not traced in torch mode, which would slow every call down.
+    """
+
+    def __init__(self, logdir, profile_iters, mode='sampling', interval=0.005):
+        self.start_itr, self.stop_itr = parse_iteration_range(profile_iters)
+        self.mode = mode
+        self.interval = interval
+        self.prefix = os.path.join(logdir, 'profile_itr{}-{}'.format(self.start_itr, self.stop_itr))
+        self.profiler = None
+
+    def before_iteration(self, itr):
+        if itr != self.start_itr:
+            return
+        print('\nProfiling iterations {} to {} ({})'.format(self.start_itr, self.stop_itr - 1, self.mode))
+        if self.mode == 'sampling':
+            self.profiler = SamplingProfiler(self.interval)
+            self.profiler.start()
+        else:
+            self.profiler = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU])
+            self.profiler.__enter__()
+            timing.set_phase_hook(torch.profiler.record_function)
+
+    def after_iteration(self, itr):
+        if itr == self.stop_itr - 1:
+            self.close()
+
+    def close(self):
+        if self.profiler is None:
+            return
+        if self.mode == 'sampling':
+            self.profiler.stop()
+            self.profiler.write_folded(self.prefix + '.folded')
+        else:
+            timing.set_phase_hook(None)
+            self.profiler.__exit__(None, None, None)
+            self.profiler.export_chrome_trace(self.prefix + '.json')
+        print('Saved profile to {}.*'.format(self.prefix))
+        self.profiler = None
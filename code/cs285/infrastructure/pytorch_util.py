@@ -1,5 +1,7 @@
+from collections import namedtuple
 from typing import Union
 
+import numpy as np
 import torch
 from torch import nn
 
@@ -81,3 +83,38 @@ def from_numpy(*args, **kwargs):
 
 def to_numpy(tensor):
     return tensor.to('cpu').detach().numpy()
+
+
+def as_tensor(data):
+    """
+        Float32 tensor on `device` for a numpy array or a tensor.
+        No copy is made when the data is already float32 on the device:
+        numpy arrays share their memory with the returned tensor.
+    """
+    if isinstance(data, torch.Tensor):
+        return data.to(device=device, dtype=torch.float32)
+    return torch.as_tensor(data, dtype=torch.float32, device=device)
+
+
+def find_modules_and_optimizers(obj):
+    """
+        Modules among obj's attributes, or one level further down (e.g. DQNCritic.q_net),
+        and the optimizers found there or on those modules (e.g. MLPPolicy.optimizer)
+    """
+    objects = list(vars(obj).values())
+    for value in list(objects):
+        if not isinstance(value, (nn.Module, np.ndarray)) and hasattr(value, '__dict__'):
+            objects += list(vars(value).values())
+    modules = {id(value): value for value in objects if isinstance(value, nn.Module)}
+    objects += [value for module in modules.values() for value in vars(module).values()]
+    optimizers = {id(value): value for value in objects if isinstance(value, torch.optim.Optimizer)}
+    return list(modules.values()), list(optimizers.values())
+
+
+# one sampled batch of transitions, converted to tensors once and passed
+# as-is through critic update, advantage estimation and actor update
+TensorBatch = namedtuple('TensorBatch', ['ob_no', 'ac_na', 're_n', 'next_ob_no', 'terminal_n'])
+
+
+def to_tensor_batch(ob_no, ac_na, re_n, next_ob_no, terminal_n):
+    return TensorBatch(*[as_tensor(data) for data in (ob_no, ac_na, re_n, next_ob_no, terminal_n)])
@@ -13,12 +13,14 @@ class ReplayBuffer(object):
         self.unconcatenated_rews = None
         self.next_obs = None
         self.terminals = None
+        self.path_lengths = np.zeros(0, dtype=np.int64)
 
     def add_rollouts(self, paths, noised=False):
 
         # add new rollouts into our list of rollouts
         for path in paths:
             self.paths.append(path)
+        self.path_lengths = np.concatenate([self.path_lengths, [get_pathlength(path) for path in paths]]).astype(np.int64)
 
         # convert new rollouts into their component arrays, and append them onto our arrays
         observations, actions, next_observations, terminals, concatenated_rews, unconcatenated_rews = convert_listofrollouts(paths)
@@ -51,6 +53,26 @@ class ReplayBuffer(object):
             else:
                 self.unconcatenated_rews.append(unconcatenated_rews)  # TODO keep only latest max_size around
 
+    def add_dataset(self, dataset):
+        """
+            Add every transition of a RolloutDataset, straight from its arrays
+            (no per-path dicts are built, so these paths are not in self.paths)
+        """
+        fields = [dataset['observation'][-self.max_size:], dataset['action'][-self.max_size:],
+                  dataset['reward'][-self.max_size:], dataset['next_observation'][-self.max_size:],
+                  dataset['terminal'][-self.max_size:]]
+        if self.obs is None:
+            self.obs, self.acs, self.concatenated_rews, self.next_obs, self.terminals = \
+                [np.array(field) for field in fields]
+            self.unconcatenated_rews = []
+        else:
+            self.obs, self.acs, self.concatenated_rews, self.next_obs, self.terminals = [
+                np.concatenate([stored, field])[-self.max_size:]
+                for stored, field in zip([self.obs, self.acs, self.concatenated_rews, self.next_obs, self.terminals],
+                                         fields)
+            ]
+        self.path_lengths = np.concatenate([self.path_lengths, dataset.path_lengths()]).astype(np.int64)
+
     ########################################
     ########################################
 
@@ -70,19 +92,40 @@ class ReplayBuffer(object):
         rand_indices = np.random.permutation(self.obs.shape[0])[:batch_size]
         return self.obs[rand_indices], self.acs[rand_indices], self.concatenated_rews[rand_indices], self.next_obs[rand_indices], self.terminals[rand_indices]
 
+    def sample_random_nstep_data(self, batch_size, n_step, gamma):
+        rand_indices = np.random.permutation(self.obs.shape[0])[:batch_size]
+        return self._nstep_from_indices(rand_indices, n_step, gamma)
+
+    def _nstep_from_indices(self, indices, n_step, gamma):
+        """
+            n-step transitions starting at the given rows, all computed at once:
+            the discounted sum of up to n_step rewards, cut at the end of the trajectory,
+            the observation to bootstrap from, its terminal flag and gamma ** (steps taken).
+        """
+        size = self.obs.shape[0]
+        rows = np.minimum(indices[:, None] + np.arange(n_step), size - 1)
+        # step k is part of the return if no earlier step ended the trajectory
+        terminals = self.terminals[rows].astype(bool)
+        valid = np.cumsum(terminals, axis=1) - terminals == 0
+        valid &= indices[:, None] + np.arange(n_step) < size
+
+        rewards = np.sum(valid * gamma ** np.arange(n_step) * self.concatenated_rews[rows], axis=1)
+        num_steps = valid.sum(axis=1)
+        last = indices + num_steps - 1
+        return self.obs[indices], self.acs[indices], rewards.astype(np.float32), \
+            self.next_obs[last], self.terminals[last], (gamma ** num_steps).astype(np.float32)
+
     def sample_recent_data(self, batch_size=1, concat_rew=True):
 
         if concat_rew:
             return self.obs[-batch_size:], self.acs[-batch_size:], self.concatenated_rews[-batch_size:], self.next_obs[-batch_size:], self.terminals[-batch_size:]
         else:
-            num_recent_rollouts_to_return = 0
-            num_datapoints_so_far = 0
-            index = -1
-            while num_datapoints_so_far < batch_size:
-                recent_rollout = self.paths[index]
-                index -=1
-                num_recent_rollouts_to_return +=1
-                num_datapoints_so_far += get_pathlength(recent_rollout)
-            rollouts_to_return = self.paths[-num_recent_rollouts_to_return:]
-            observations, actions, next_observations, terminals, concatenated_rews, unconcatenated_rews = convert_listofrollouts(rollouts_to_return)
-            return observations, actions, unconcatenated_rews, next_observations, terminals
\ No newline at end of file
+            # walk back over the most recent paths until they hold batch_size datapoints
+            num_datapoints_so_far = np.cumsum(self.path_lengths[::-1])
+            num_recent_rollouts_to_return = min(np.searchsorted(num_datapoints_so_far, batch_size) + 1,
+                                                len(self.path_lengths))
+            num_datapoints = num_datapoints_so_far[num_recent_rollouts_to_return - 1]
+            split_points = np.cumsum(self.path_lengths[-num_recent_rollouts_to_return:])[:-1]
+            unconcatenated_rews = np.split(self.concatenated_rews[-num_datapoints:], split_points)
+            return self.obs[-num_datapoints:], self.acs[-num_datapoints:], unconcatenated_rews, \
+                self.next_obs[-num_datapoints:], self.terminals[-num_datapoints:]
\ No newline at end of file
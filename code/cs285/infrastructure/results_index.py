@@ -0,0 +1,147 @@
+import glob
+import os
+import re
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from tensorboardX.proto import event_pb2
+
+EVENTS_PATTERN = 'events.out.tfevents.*'
+CACHE_FILE = '.results_index.pkl'
+COLUMNS = ['run', 'tag', 'step', 'value', 'wall_time']
+
+# <exp_name>_<dd-mm-yyyy_HH-MM-SS> as written by the run_parking* scripts, plus an optional seed suffix
+TIMESTAMP_RE = re.compile(r'_\d{2}-\d{2}-\d{4}_\d{2}-\d{2}-\d{2}')
+SEED_RE = re.compile(r'[_/]seed_?\d+')
+
+
+def iter_records(filename):
+    """
+        Payloads of the TFRecord file written by tensorboardX: every record is
+        a uint64 length, a uint32 crc of the length, the payload and a uint32 crc
+        of the payload. The crcs are not checked; a record that is still being
+        written (the file ends inside it) ends the iteration.
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    offset = 0
+    while offset + 12 <= len(data):
+        length, = struct.unpack_from('<Q', data, offset)
+        start = offset + 12
+        end = start + length
+        if end + 4 > len(data):
+            break
+        yield data[start:end]
+        offset = end + 4
+
+
+def read_event_file(filename):
+    """
+        Every scalar of one events file, as a DataFrame with columns tag, step, value, wall_time
+    """
+    tags, steps, values, wall_times = [], [], [], []
+    event = event_pb2.Event()
+    for record in iter_records(filename):
+        event.ParseFromString(record)
+        for summary_value in event.summary.value:
+            if summary_value.HasField('simple_value'):
+                value = summary_value.simple_value
+            elif summary_value.HasField('tensor') and summary_value.tensor.float_val:
+                value = summary_value.tensor.float_val[0]
+            else:
+                continue
+            tags.append(summary_value.tag)
+            steps.append(event.step)
+            values.append(value)
+            wall_times.append(event.wall_time)
+    return pd.DataFrame({
+        'tag': tags,
+        'step': np.array(steps, dtype=np.int64),
+        'value': np.array(values, dtype=np.float64),
+        'wall_time': np.array(wall_times, dtype=np.float64),
+    })
+
+
+def experiment_name(run):
+    # runs that differ only in their timestamp and seed are seeds of the same experiment
+    return SEED_RE.sub('', TIMESTAMP_RE.sub('', run))
+
+
+def _file_key(filename):
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class ResultsIndex(object):
+    """
+        Long-format table (run, tag, step, value, wall_time) of every scalar logged
+        by every run under data_dir, cached in a pickle next to the runs.
+
+        update() only re-reads event files that are new or whose size or mtime
+        changed since they were cached, in parallel worker processes, and forgets
+        files that were deleted. A run is the directory of its events file,
+        relative to data_dir.
+    """
+
+    def __init__(self, data_dir, cache_file=None):
+        self.data_dir = os.path.abspath(data_dir)
+        self.cache_file = cache_file or os.path.join(self.data_dir, CACHE_FILE)
+        # relative events file path -> {'key': (size, mtime_ns), 'frame': DataFrame}
+        self.files = pd.read_pickle(self.cache_file) if os.path.exists(self.cache_file) else {}
+
+    def find_event_files(self):
+        pattern = os.path.join(self.data_dir, '**', EVENTS_PATTERN)
+        return sorted(os.path.relpath(filename, self.data_dir) for filename in glob.glob(pattern, recursive=True))
+
+    def update(self, workers=None):
+        event_files = self.find_event_files()
+        for removed in set(self.files) - set(event_files):
+            del self.files[removed]
+
+        keys = {filename: _file_key(os.path.join(self.data_dir, filename)) for filename in event_files}
+        stale = [filename for filename in event_files
+                 if filename not in self.files or self.files[filename]['key'] != keys[filename]]
+        paths = [os.path.join(self.data_dir, filename) for filename in stale]
+        if len(stale) > 1 and workers != 1:
+            with ProcessPoolExecutor(workers) as pool:
+                frames = list(pool.map(read_event_file, paths))
+        else:
+            frames = [read_event_file(path) for path in paths]
+
+        for filename, frame in zip(stale, frames):
+            self.files[filename] = {'key': keys[filename], 'frame': frame}
+        if stale:
+            pd.to_pickle(self.files, self.cache_file)
+        return stale
+
+    def table(self):
+        frames = [entry['frame'].assign(run=os.path.dirname(filename))
+                  for filename, entry in sorted(self.files.items())]
+        if not frames:
+            return pd.DataFrame(columns=COLUMNS)
+        table = pd.concat(frames, ignore_index=True)[COLUMNS]
+        table['run'] = table['run'].astype('category')
+        table['tag'] = table['tag'].astype('category')
+        return table
+
+
+def summarize(table, tags, last=1, group_seeds=False):
+    """
+        Per run (or, with group_seeds, per experiment across seeds) summary of each tag:
+        the mean of its last `last` logged values. Grouped rows report mean, std and
+        the number of seeds.
+    """
+    table = table[table['tag'].isin(tags)].sort_values('step')
+    final = table.groupby(['run', 'tag'], observed=True)['value'].apply(lambda v: v.iloc[-last:].mean())
+    final = final.unstack('tag').reindex(columns=tags)
+    if not group_seeds:
+        return final
+
+    final.index = final.index.map(experiment_name).rename('experiment')
+    grouped = final.groupby(level='experiment')
+    summary = pd.concat({'mean': grouped.mean(), 'std': grouped.std(ddof=0)}, axis=1)
+    summary = summary.swaplevel(axis=1).reindex(columns=tags, level=0)
+    summary['num_seeds'] = grouped.size()
+    return summary
@@ -9,9 +9,17 @@ import pandas as pd
 import torch
 from cs285.infrastructure import pytorch_util as ptu
 
+from cs285.infrastructure import distributed
+from cs285.infrastructure import timing
 from cs285.infrastructure import utils
+from cs285.infrastructure.checkpoint import CheckpointWriter, CHECKPOINT_DIR, latest_checkpoint, load_checkpoint
 from cs285.infrastructure.logger import Logger
+from cs285.infrastructure.memory import memory_report
+from cs285.infrastructure.profiling import IterationProfiler
+from cs285.infrastructure.rng import RandomStream, stream
+from cs285.infrastructure.rollout_dataset import RolloutDataset, export_rollouts
 from cs285.environment import parking
+from cs285.policies.stacked_policy import StackedPolicy
 
 # how many rollouts to save as videos to tensorboard
 MAX_NVIDEO = 2
@@ -28,34 +36,80 @@ class RL_Trainer(object):
 
         # Get params, create logger
         self.params = params
-        self.logger = Logger(self.params['logdir'])
-
-        # Set random seeds
         seed = self.params['seed']
-        np.random.seed(seed)
-        torch.manual_seed(seed)
+
+        # data-parallel ranks started by distributed.launch: each collects its share of every
+        # batch from its own envs, and only rank 0 logs
+        distributed.init_from_env()
+
+        # num_seeds > 1 trains seeds seed, ..., seed + num_seeds - 1 side by side, each with its
+        # own env, agent and logger (in logdir/seed<seed>); their rollouts are stepped in lockstep
+        self.num_seeds = self.params.get('num_seeds', 1)
+        self.seeds = [seed + k for k in range(self.num_seeds)]
+        self.loggers = []
+        if distributed.is_main():
+            self.loggers = [Logger(self.seed_dir(self.params['logdir'], k)) for k in range(self.num_seeds)]
+        self.logger = self.loggers[0] if self.loggers else None
+
+        # Set random seeds, different on every rank
+        np.random.seed(distributed.rank_seed(seed))
+        torch.manual_seed(distributed.rank_seed(seed))
+        # with several seeds, each builds its agent, draws its actions and trains from its own
+        # random stream, so that it gets the same random numbers as a single-seed run of it
+        self.rngs = None
+        if self.num_seeds > 1:
+            self.rngs = [RandomStream(distributed.rank_seed(seed_k)) for seed_k in self.seeds]
         ptu.init_gpu(
             use_gpu=not self.params['no_gpu'],
             gpu_id=self.params['which_gpu']
         )
 
+        # per-phase wall-clock timers; with this off, every timing.phase() is a no-op
+        if self.params.get('time_phases'):
+            timing.enable()
+
+        # profile a range of iterations, e.g. '10:12'
+        self.profiler = None
+        if self.params.get('profile_iters') and distributed.is_main():
+            self.profiler = IterationProfiler(self.params['logdir'], self.params['profile_iters'],
+                                              mode=self.params.get('profiler', 'sampling'),
+                                              interval=self.params.get('profile_interval_ms', 5) / 1000)
+
         #############
         ## ENV
         #############
 
-        # Make the environment
+        # Make the environments; they share the block neighbour arrays of the first one
         df_block = pd.read_csv('../data/Meters/Meter_block.csv')
         df_demand = pd.read_csv('../data/demand.csv')
-        self.env = parking.parking_env(df_block, df_demand)
-        self.env.seed(seed)
+        self.envs = []
+        for seed_k in self.seeds:
+            env = parking.parking_env(df_block, df_demand,
+                                      obs_mode=self.params.get('obs_mode', 'raw'),
+                                      spatial_bins=self.params.get('spatial_bins', 0),
+                                      neighbour_cache=self.params.get('env_cache_dir'),
+                                      neighbours=(self.envs[0].sorted_dist, self.envs[0].backup_block) if self.envs else None)
+            env.seed(distributed.rank_seed(seed_k))
+            self.envs.append(env)
+        self.env = self.envs[0]
+
+        # evaluate on a fixed suite of seeded episodes rather than eval_batch_size fresh steps;
+        # the suite only depends on eval_scenario_seed, so it is the same across runs
+        self.eval_scenarios = None
+        if self.params.get('eval_scenarios'):
+            assert self.params['eval_scenarios'] >= distributed.world_size(), 'every rank needs an eval scenario'
+            self.eval_scenarios = parking.eval_scenarios(self.params['eval_scenarios'],
+                                                         self.params.get('eval_scenario_seed', 0))
 
         discrete = False
 
         self.params['agent_params']['discrete'] = discrete # continuous action space
 
-        normal = True if self.params['policy'] == 'normal' else False
+        normal = True if self.params.get('policy') == 'normal' else False
 
         self.params['agent_params']['normal'] = normal
+        self.params['agent_params']['compile_policy'] = self.params.get('compile_policy', False)
+        self.params['agent_params']['shared_trunk'] = self.params.get('shared_trunk', False)
         # Observation and action sizes
 
         ob_dim = self.env.ob_dim
@@ -63,12 +117,98 @@ class RL_Trainer(object):
         self.params['agent_params']['ac_dim'] = ac_dim
         self.params['agent_params']['ob_dim'] = ob_dim
 
+        # keep the replay buffer on disk, by default under the run's logdir
+        if self.params.get('memmap_buffer') and not self.params.get('replay_buffer_dir'):
+            self.params['replay_buffer_dir'] = os.path.join(self.params['logdir'], 'replay_buffer')
+        self.params['agent_params']['replay_buffer_dir'] = self.params.get('replay_buffer_dir')
+
         #############
         ## AGENT
         #############
 
         agent_class = self.params['agent_class']
-        self.agent = agent_class(self.env, self.params['agent_params'])
+        self.agents = []
+        for k, env in enumerate(self.envs):
+            agent_params = dict(self.params['agent_params'])
+            if agent_params['replay_buffer_dir']:
+                agent_params['replay_buffer_dir'] = distributed.rank_dir(self.seed_dir(agent_params['replay_buffer_dir'], k))
+            with stream(self.rngs, k):
+                agent = agent_class(env, agent_params)
+            # start from rank 0's weights, and average gradients over ranks
+            distributed.sync_agent(agent)
+            self.agents.append(agent)
+        self.agent = self.agents[0]
+
+        #############
+        ## CHECKPOINTS
+        #############
+
+        # every rank checkpoints its own envs, random generators and collected data
+        self.checkpoint_dir = distributed.rank_dir(os.path.join(self.params['logdir'], CHECKPOINT_DIR))
+        self.checkpoint_writer = None
+        if self.params.get('checkpoint_freq', 0) > 0:
+            self.checkpoint_writer = CheckpointWriter(self.checkpoint_dir, self.params.get('keep_checkpoints', 3))
+
+        # per seed
+        self.start_itr = 0
+        self.total_envsteps = [0] * self.num_seeds
+        self.initial_return = [None] * self.num_seeds
+        self.elapsed_time = 0
+        if self.params.get('resume'):
+            checkpoint = latest_checkpoint(self.checkpoint_dir)
+            if checkpoint is None:
+                print('No checkpoint in {}, starting from scratch'.format(self.checkpoint_dir))
+            else:
+                self.load_checkpoint(checkpoint)
+            distributed.check_same(self.start_itr, 'the iteration to resume from')
+
+    def checkpoint_state(self, next_itr):
+        return {
+            'itr': next_itr,
+            'total_envsteps': self.total_envsteps,
+            'initial_return': self.initial_return,
+            'elapsed_time': time.time() - self.start_time,
+            'agents': [agent.state_dict() for agent in self.agents],
+            'envs': [env.state_dict() for env in self.envs],
+            'rng': {
+                'numpy': np.random.get_state(),
+                'torch': torch.get_rng_state(),
+                'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+                'seeds': None if self.rngs is None else [rng.state for rng in self.rngs],
+            },
+        }
+
+    def load_checkpoint(self, filename):
+        state = load_checkpoint(filename)
+        assert len(state['agents']) == self.num_seeds, \
+            '{} has {} seeds, not {}'.format(filename, len(state['agents']), self.num_seeds)
+        self.start_itr = state['itr']
+        self.total_envsteps = state['total_envsteps']
+        self.initial_return = state['initial_return']
+        self.elapsed_time = state['elapsed_time']
+        for agent, agent_state in zip(self.agents, state['agents']):
+            agent.load_state_dict(agent_state)
+        for env, env_state in zip(self.envs, state['envs']):
+            env.load_state_dict(env_state)
+        np.random.set_state(state['rng']['numpy'])
+        torch.set_rng_state(state['rng']['torch'])
+        if state['rng']['cuda'] is not None and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all(state['rng']['cuda'])
+        if state['rng'].get('seeds') is not None:
+            for rng, rng_state in zip(self.rngs, state['rng']['seeds']):
+                rng.state = rng_state
+        print('Resuming from {} at iteration {}'.format(filename, self.start_itr))
+
+    def seed_dir(self, directory, k):
+        # per-seed subdirectory, only when several seeds are trained at once
+        if self.num_seeds == 1:
+            return directory
+        return os.path.join(directory, 'seed{}'.format(self.seeds[k]))
+
+    def per_seed(self, policy):
+        # the same policy (e.g. agent.actor) of every seed's agent
+        name = next(name for name, value in vars(self.agent).items() if value is policy)
+        return [getattr(agent, name) for agent in self.agents]
 
     def run_training_loop(self, n_iter, collect_policy, eval_policy,
                           initial_expertdata=None, relabel_with_expert=False,
@@ -77,74 +217,173 @@ class RL_Trainer(object):
         :param n_iter:  number of iterations
         :param collect_policy:
         :param eval_policy:
-        :param initial_expertdata:
+        :param initial_expertdata: pickled list of paths, or a RolloutDataset directory
         :param relabel_with_expert:  whether to perform dagger
         :param start_relabel_with_expert: iteration at which to start relabel with expert
         :param expert_policy:
         """
 
-        # init vars at beginning of training
-        self.total_envsteps = 0
-        self.start_time = time.time()
-
-        for itr in range(n_iter):
-            print("\n\n********** Iteration %i ************"%itr)
-
-            self.log_video = self.logvideo = False
-
-            # decide if metrics should be logged
-            if self.params['scalar_log_freq'] == -1:
-                self.logmetrics = False
-            elif itr % self.params['scalar_log_freq'] == 0:
-                self.logmetrics = True
-            else:
-                self.logmetrics = False
-
-            # collect trajectories, to be used for training
-            training_returns = self.collect_training_trajectories(itr,
-                                initial_expertdata, collect_policy,
-                                self.params['batch_size'])
-            paths, envsteps_this_batch, train_video_paths = training_returns
-            self.total_envsteps += envsteps_this_batch
-
-            # add collected data to replay buffer
-            self.agent.add_to_replay_buffer(paths)
-
-            # train agent (using sampled data from replay buffer)
-            train_logs = self.train_agent()
-
-            # log/save
-            if self.logvideo or self.logmetrics:
-                # perform logging
-                print('\nBeginning logging procedure...')
-                self.perform_logging(itr, paths, eval_policy, train_video_paths, train_logs)
-
-                if self.params['save_params']:
-                    self.agent.save('{}/agent_itr_{}.pt'.format(self.params['logdir'], itr))
+        # init vars at beginning of training (or where the resumed checkpoint left off)
+        self.start_time = time.time() - self.elapsed_time
+
+        # one batched forward pass for the observations of all seeds
+        if self.num_seeds > 1:
+            collect_policy = StackedPolicy(self.per_seed(collect_policy))
+            eval_policy = StackedPolicy(self.per_seed(eval_policy))
+
+        try:
+            for itr in range(self.start_itr, n_iter):
+                print("\n\n********** Iteration %i ************"%itr)
+                if self.profiler is not None:
+                    self.profiler.before_iteration(itr)
+
+                self.log_video = self.logvideo = False
+
+                # decide if metrics should be logged
+                if self.params['scalar_log_freq'] == -1:
+                    self.logmetrics = False
+                elif itr % self.params['scalar_log_freq'] == 0:
+                    self.logmetrics = True
+                else:
+                    self.logmetrics = False
+
+                # collect trajectories, to be used for training
+                with timing.phase('collect'):
+                    training_returns = self.collect_training_trajectories(itr,
+                                        initial_expertdata, collect_policy,
+                                        distributed.shard(self.params['batch_size']))
+                # per seed
+                paths, envsteps_this_batch, train_video_paths = training_returns
+                self.total_envsteps = [total + envsteps for total, envsteps in zip(self.total_envsteps, envsteps_this_batch)]
+
+                # add collected data to replay buffer
+                with timing.phase('buffer_insert'):
+                    for k, (agent, seed_paths) in enumerate(zip(self.agents, paths)):
+                        if isinstance(seed_paths, RolloutDataset):
+                            agent.replay_buffer.add_dataset(seed_paths)
+                        else:
+                            agent.add_to_replay_buffer(seed_paths)
+                            if self.params.get('export_dataset'):
+                                export_rollouts(seed_paths, distributed.rank_dir(self.seed_dir(self.params['export_dataset'], k)))
+
+                # train agent (using sampled data from replay buffer)
+                with timing.phase('train'):
+                    train_logs = self.train_agent()
+
+                # log/save
+                if self.logvideo or self.logmetrics:
+                    # perform logging
+                    print('\nBeginning logging procedure...')
+                    self.perform_logging(itr, paths, eval_policy, train_video_paths, train_logs)
+
+                    if self.params['save_params'] and distributed.is_main():
+                        with timing.phase('checkpoint'):
+                            for k, agent in enumerate(self.agents):
+                                agent.save('{}/agent_itr_{}.pt'.format(self.seed_dir(self.params['logdir'], k), itr))
+
+                # checkpoint the state at the start of the next iteration
+                checkpoint_freq = self.params.get('checkpoint_freq', 0)
+                if checkpoint_freq > 0 and ((itr + 1) % checkpoint_freq == 0 or itr == n_iter - 1):
+                    with timing.phase('checkpoint'):
+                        self.checkpoint_writer.save(self.checkpoint_state(itr + 1), itr + 1)
+
+                self.log_phase_times(itr)
+                if self.params.get('log_memory') or self.params.get('memory_warn_mb'):
+                    self.log_memory(itr)
+                if self.profiler is not None:
+                    self.profiler.after_iteration(itr)
+        finally:
+            self.close()
+
+    def close(self):
+        # also when an iteration failed, so that its metrics and profile reach the disk
+        try:
+            for logger in self.loggers:
+                logger.close()
+            if self.profiler is not None:
+                self.profiler.close()
+            if timing.get_timer() is not None and distributed.is_main():
+                timing.get_timer().write_summary(os.path.join(self.params['logdir'], 'phase_times.json'))
+            if self.checkpoint_writer is not None:
+                self.checkpoint_writer.close()
+        finally:
+            distributed.close()
+
+    def log_memory(self, itr):
+        reports = [memory_report(agent, env) for agent, env in zip(self.agents, self.envs)]
+        if self.params.get('log_memory') and self.logmetrics:
+            # rank 0's, on rank 0
+            for logger, report in zip(self.loggers, reports):
+                for key, value in report.items():
+                    logger.log_scalar(value, key, itr)
+
+        # RSS is the whole process's, the other entries are per seed
+        report = reports[0]
+        warn_mb = self.params.get('memory_warn_mb')
+        if warn_mb and report['Memory/RSS'] > warn_mb:
+            largest = sorted(((value, key if self.num_seeds == 1 else 'seed{}/{}'.format(seed, key))
+                              for seed, seed_report in zip(self.seeds, reports)
+                              for key, value in seed_report.items()
+                              if key not in ('Memory/RSS', 'Memory/PeakRSS', 'Memory/Env_VehiclesAlive',
+                                             'Memory/Buffer_Total')), reverse=True)[:3]
+            print('WARNING: RSS {:.0f} MB exceeds {:.0f} MB; largest: {}'.format(
+                report['Memory/RSS'], warn_mb, ', '.join('{} {:.1f} MB'.format(key, value) for value, key in largest)))
+
+    def log_phase_times(self, itr):
+        timer = timing.get_timer()
+        if timer is None:
+            return
+        phase_times = timer.pop_iteration()
+        if self.logmetrics and self.logger is not None:
+            for key, seconds in phase_times.items():
+                self.logger.log_scalar(seconds, 'Perf/' + key, itr)
 
     ####################################
     ####################################
 
     def collect_training_trajectories(self, itr, load_initial_expertdata, collect_policy, batch_size):
         # if your load_initial_expertdata is None, then you need to collect new trajectories at *every* iteration
+        # paths and envsteps are returned per seed
         if itr==0 and load_initial_expertdata:
-            loaded_paths = pickle.load(open(load_initial_expertdata,'rb'))
-            return loaded_paths, 0, None
+            no_envsteps = [0] * self.num_seeds
+            if os.path.isdir(load_initial_expertdata):
+                return [RolloutDataset(load_initial_expertdata)] * self.num_seeds, no_envsteps, None
+            # a copy per seed, as agents may annotate the paths
+            loaded_paths = [pickle.load(open(load_initial_expertdata,'rb')) for _ in self.seeds]
+            return loaded_paths, no_envsteps, None
 
         print("\nCollecting data to be used for training...")
-        paths, envsteps_this_batch = utils.sample_trajectories(self.env, collect_policy, batch_size,
-                                                               self.params['ep_len'])
+        paths, envsteps_this_batch = self.sample_trajectories(collect_policy, batch_size)
         train_video_paths = None
         return paths, envsteps_this_batch, train_video_paths
 
+    def sample_trajectories(self, policy, batch_size, scenarios=None):
+        # paths and timesteps of every seed; one rollout per scenario (this rank's share) when given
+        if scenarios is not None:
+            scenarios = scenarios[distributed.rank()::distributed.world_size()]
+        if self.num_seeds == 1:
+            if scenarios is not None:
+                paths = utils.sample_scenario_trajectories(self.env, policy, scenarios, self.params['ep_len'])
+                return [paths], [sum(utils.get_pathlength(path) for path in paths)]
+            paths, envsteps = utils.sample_trajectories(self.env, policy, batch_size, self.params['ep_len'])
+            return [paths], [envsteps]
+        # the policies were trained since the last rollouts
+        policy.refresh()
+        return utils.sample_trajectories_multi(self.envs, policy, batch_size, self.params['ep_len'], scenarios,
+                                               self.rngs)
+
     def train_agent(self):
         print('\nTraining agent using sampled data from replay buffer...')
-        all_logs = []
+        # per seed
+        all_logs = [[] for _ in self.agents]
         for train_step in range(self.params['num_agent_train_steps_per_iter']):
-            ob_batch, ac_batch, re_batch, next_ob_batch, terminal_batch = self.agent.sample(
-                self.params['train_batch_size'])
-            train_log = self.agent.train(ob_batch, ac_batch, re_batch, next_ob_batch, terminal_batch)
-            all_logs.append(train_log)
+            for k, (agent, logs) in enumerate(zip(self.agents, all_logs)):
+                with stream(self.rngs, k):
+                    # ob, ac, re, next_ob, terminal, plus whatever else the agent samples (e.g. n-step discounts)
+                    with timing.phase('buffer_sample'):
+                        batch = agent.sample(distributed.shard(self.params['train_batch_size']))
+                    train_log = agent.train(*batch)
+                logs.append(train_log)
         return all_logs
 
     ####################################
@@ -152,65 +391,89 @@ class RL_Trainer(object):
 
     def perform_logging(self, itr, paths, eval_policy, train_video_paths, all_logs):
 
-        last_log = all_logs[-1]
-
         #######################
 
         # collect eval trajectories, for logging
         print("\nCollecting data for eval...")
-        eval_paths, eval_envsteps_this_batch = utils.sample_trajectories(self.env, eval_policy, self.params['eval_batch_size'], self.params['ep_len'])
+        with timing.phase('eval'):
+            eval_paths, eval_envsteps_this_batch = self.sample_trajectories(eval_policy,
+                                                                            distributed.shard(self.params['eval_batch_size']),
+                                                                            self.eval_scenarios)
 
         #######################
 
-        # save eval metrics
+        # save eval metrics, seed by seed
         if self.logmetrics:
-            # returns, for logging
-            train_returns = [path["reward"].sum() for path in paths]
-            eval_returns = [eval_path["reward"].sum() for eval_path in eval_paths]
+            for k in range(self.num_seeds):
+                if self.num_seeds > 1 and distributed.is_main():
+                    print('\nSeed {}'.format(self.seeds[k]))
+                self.log_seed_metrics(k, itr, paths[k], eval_paths[k], all_logs[k][-1])
+            print('Done logging...\n\n')
 
-            # episode lengths, for logging
+    def log_seed_metrics(self, k, itr, paths, eval_paths, last_log):
+        env = self.envs[k]
+
+        # returns, for logging
+        if isinstance(paths, RolloutDataset):
+            train_returns = paths.path_returns()
+            train_ep_lens = paths.path_lengths()
+        else:
+            train_returns = [path["reward"].sum() for path in paths]
             train_ep_lens = [len(path["reward"]) for path in paths]
-            eval_ep_lens = [len(eval_path["reward"]) for eval_path in eval_paths]
-
-            # actions, for logging
-            eval_actions_max = [np.max(eval_path["action"]) for eval_path in eval_paths]
-            eval_actions_min = [np.min(eval_path["action"]) for eval_path in eval_paths]
-
-            # observations, for logging
-            eval_occupancy = [np.mean(np.sum(eval_path["observation"][:,2:],axis=1)) for eval_path in eval_paths]
-
-            # decide what to log
-            logs = OrderedDict()
-            logs["Eval_AverageReturn"] = np.mean(eval_returns)
-            logs["Eval_StdReturn"] = np.std(eval_returns)
-            logs["Eval_MaxReturn"] = np.max(eval_returns)
-            logs["Eval_MinReturn"] = np.min(eval_returns)
-            logs["Eval_AverageEpLen"] = np.mean(eval_ep_lens)
-
-            logs["Train_AverageReturn"] = np.mean(train_returns)
-            logs["Train_StdReturn"] = np.std(train_returns)
-            logs["Train_MaxReturn"] = np.max(train_returns)
-            logs["Train_MinReturn"] = np.min(train_returns)
-            logs["Train_AverageEpLen"] = np.mean(train_ep_lens)
-
-            logs["Train_EnvstepsSoFar"] = self.total_envsteps
-            logs["TimeSinceStart"] = time.time() - self.start_time
-            logs['Eval_MaxAction'] = np.max(eval_actions_max)
-            logs['Eval_MinAction'] = np.max(eval_actions_min)
-            logs['Eval_Occupancy'] = np.mean(eval_occupancy)
-            logs['DateTime'] = int(self.env.date.strftime('%Y%m%d%H%M%S'))
-            logs['Stage'] = self.env.stage
-            logs.update(last_log)
-
-            if itr == 0:
-                self.initial_return = np.mean(train_returns)
-            logs["Initial_DataCollection_AverageReturn"] = self.initial_return
-
-            # perform the logging
+        eval_returns = [eval_path["reward"].sum() for eval_path in eval_paths]
+
+        # episode lengths, for logging
+        eval_ep_lens = [len(eval_path["reward"]) for eval_path in eval_paths]
+
+        # actions, for logging
+        eval_actions_max = [np.max(eval_path["action"]) for eval_path in eval_paths]
+        eval_actions_min = [np.min(eval_path["action"]) for eval_path in eval_paths]
+
+        # observations, for logging
+        eval_occupancy = [np.mean(env.total_occupancy(eval_path["observation"])) for eval_path in eval_paths]
+
+        # the rollouts of all ranks
+        gathered = distributed.gather_lists({
+            'train_returns': list(train_returns), 'train_ep_lens': list(train_ep_lens),
+            'eval_returns': eval_returns, 'eval_ep_lens': eval_ep_lens,
+            'eval_actions_max': eval_actions_max, 'eval_actions_min': eval_actions_min,
+            'eval_occupancy': eval_occupancy, 'total_envsteps': [self.total_envsteps[k]],
+        })
+        train_returns, train_ep_lens = gathered['train_returns'], gathered['train_ep_lens']
+        eval_returns, eval_ep_lens = gathered['eval_returns'], gathered['eval_ep_lens']
+        eval_actions_max, eval_actions_min = gathered['eval_actions_max'], gathered['eval_actions_min']
+        eval_occupancy = gathered['eval_occupancy']
+        if self.initial_return[k] is None:
+            self.initial_return[k] = np.mean(train_returns)
+        if not distributed.is_main():
+            return
+
+        # decide what to log
+        logs = OrderedDict()
+        logs["Eval_AverageReturn"] = np.mean(eval_returns)
+        logs["Eval_StdReturn"] = np.std(eval_returns)
+        logs["Eval_MaxReturn"] = np.max(eval_returns)
+        logs["Eval_MinReturn"] = np.min(eval_returns)
+        logs["Eval_AverageEpLen"] = np.mean(eval_ep_lens)
+
+        logs["Train_AverageReturn"] = np.mean(train_returns)
+        logs["Train_StdReturn"] = np.std(train_returns)
+        logs["Train_MaxReturn"] = np.max(train_returns)
+        logs["Train_MinReturn"] = np.min(train_returns)
+        logs["Train_AverageEpLen"] = np.mean(train_ep_lens)
+
+        logs["Train_EnvstepsSoFar"] = sum(gathered['total_envsteps'])
+        logs["TimeSinceStart"] = time.time() - self.start_time
+        logs['Eval_MaxAction'] = np.max(eval_actions_max)
+        logs['Eval_MinAction'] = np.max(eval_actions_min)
+        logs['Eval_Occupancy'] = np.mean(eval_occupancy)
+        logs['DateTime'] = int(env.date.strftime('%Y%m%d%H%M%S'))
+        logs['Stage'] = env.stage
+        logs.update(last_log)
+        logs["Initial_DataCollection_AverageReturn"] = self.initial_return[k]
+
+        # perform the logging
+        with timing.phase('logging'):
             for key, value in logs.items():
                 print('{} : {}'.format(key, value))
-                self.logger.log_scalar(value, key, itr)
-            print('Done logging...\n\n')
-
-            self.logger.flush()
-
+                self.loggers[k].log_scalar(value, key, itr)
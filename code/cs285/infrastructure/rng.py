@@ -0,0 +1,36 @@
+import contextlib
+
+import numpy as np
+import torch
+
+
+class RandomStream(object):
+    """
+        A global numpy and torch (cpu) random state of its own: the code run under
+        `with stream:` draws from the stream, which then continues where it left off,
+        and the global random state is left as it was. Gives every seed of a
+        multi-seed run the random numbers a single-seed run of that seed would draw.
+    """
+
+    def __init__(self, seed):
+        self.state = (np.random.RandomState(seed).get_state(), torch.Generator().manual_seed(seed).get_state())
+        self.outer = None
+
+    def __enter__(self):
+        self.outer = (np.random.get_state(), torch.get_rng_state())
+        np.random.set_state(self.state[0])
+        torch.set_rng_state(self.state[1])
+        return self
+
+    def __exit__(self, *exc):
+        self.state = (np.random.get_state(), torch.get_rng_state())
+        np.random.set_state(self.outer[0])
+        torch.set_rng_state(self.outer[1])
+        self.outer = None
+
+
+def stream(rngs, k):
+    # the k-th of a list of streams, or the global random state when there is none
+    if rngs is None or rngs[k] is None:
+        return contextlib.nullcontext()
+    return rngs[k]
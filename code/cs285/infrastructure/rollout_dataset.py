@@ -0,0 +1,148 @@
+import io
+import os
+
+import numpy as np
+
+from cs285.infrastructure.utils import get_pathlength
+
+# (path key, dtype) of every field exported to disk
+FIELDS = [
+    ('observation', np.float32),
+    ('action', np.float32),
+    ('reward', np.float32),
+    ('next_observation', np.float32),
+    ('terminal', np.float32),
+]
+OFFSETS_FILE = 'offsets.npy'
+
+
+class RolloutDataset(object):
+    """
+        Columnar, memory-mapped view of rollouts exported with export_rollouts.
+
+        Every field is one .npy file holding the concatenation of that field
+        across all trajectories, and offsets.npy holds the trajectory boundaries
+        (offsets[i]:offsets[i+1] is trajectory i). Nothing is read into memory
+        until it is indexed.
+    """
+
+    def __init__(self, dataset_dir, mmap_mode='r'):
+        self.dataset_dir = dataset_dir
+        self.offsets = np.load(os.path.join(dataset_dir, OFFSETS_FILE))
+        # offsets are written last, so they bound what has been fully appended
+        num_transitions = int(self.offsets[-1])
+        self.arrays = {
+            key: np.load(os.path.join(dataset_dir, key + '.npy'), mmap_mode=mmap_mode)[:num_transitions]
+            for key, _ in FIELDS
+        }
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+    @property
+    def num_paths(self):
+        return len(self.offsets) - 1
+
+    def path_lengths(self):
+        return np.diff(self.offsets)
+
+    def path_returns(self):
+        return np.add.reduceat(self.arrays['reward'], self.offsets[:-1]) if self.num_paths else np.zeros(0)
+
+
+def export_rollouts(paths, dataset_dir):
+    """
+        Append a list of rollout dicts to the dataset in dataset_dir,
+        creating it if needed. Only one process should write to a dataset at a time.
+    """
+    os.makedirs(dataset_dir, exist_ok=True)
+    offsets_file = os.path.join(dataset_dir, OFFSETS_FILE)
+    last_offset = np.load(offsets_file)[-1] if os.path.exists(offsets_file) else 0
+    for key, dtype in FIELDS:
+        filename = os.path.join(dataset_dir, key + '.npy')
+        # drop the rows of an export that was interrupted before its offsets were written
+        if os.path.exists(filename):
+            truncate_npy(filename, last_offset)
+        append_npy(filename, np.concatenate([np.asarray(path[key], dtype=dtype) for path in paths]))
+
+    lengths = np.array([get_pathlength(path) for path in paths], dtype=np.int64)
+    new_offsets = last_offset + np.cumsum(lengths)
+    if os.path.exists(offsets_file):
+        append_npy(offsets_file, new_offsets)
+    else:
+        np.save(offsets_file, np.concatenate([[0], new_offsets]).astype(np.int64))
+
+
+def _read_header(f):
+    # (version, shape, fortran_order, dtype, header length) of an open .npy file
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    return version, shape, fortran_order, dtype, f.tell()
+
+
+def _header(version, dtype, shape):
+    header = io.BytesIO()
+    header_dict = {
+        'descr': np.lib.format.dtype_to_descr(dtype),
+        'fortran_order': False,
+        'shape': shape,
+    }
+    if version == (1, 0):
+        np.lib.format.write_array_header_1_0(header, header_dict)
+    else:
+        np.lib.format.write_array_header_2_0(header, header_dict)
+    return header.getvalue()
+
+
+def append_npy(filename, array):
+    """
+        Append rows to a .npy file in place: the data is written at the end
+        of the file, then the shape in the header is rewritten, so that an
+        interrupted append leaves at most some bytes past the recorded rows.
+    """
+    if not os.path.exists(filename):
+        np.save(filename, array)
+        return
+
+    with open(filename, 'r+b') as f:
+        version, shape, fortran_order, dtype, header_len = _read_header(f)
+        assert not fortran_order and shape[1:] == array.shape[1:], \
+            'Cannot append {} rows to {} of shape {}'.format(array.shape, filename, shape)
+
+        header = _header(version, dtype, (shape[0] + array.shape[0],) + shape[1:])
+        if len(header) == header_len:
+            f.seek(header_len + shape[0] * int(np.prod(shape[1:], dtype=np.int64)) * dtype.itemsize)
+            f.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+            f.truncate()
+            f.seek(0)
+            f.write(header)
+            return
+
+    # the header outgrew its padding: rewrite the whole file
+    np.save(filename, np.concatenate([np.load(filename), array.astype(dtype)]))
+
+
+def truncate_npy(filename, rows):
+    """
+        Keep only the first `rows` rows of a .npy file, in the header and on disk
+    """
+    with open(filename, 'r+b') as f:
+        version, shape, fortran_order, dtype, header_len = _read_header(f)
+        assert rows <= shape[0], '{} has {} rows, fewer than the {} indexed'.format(filename, shape[0], rows)
+        end = header_len + rows * int(np.prod(shape[1:], dtype=np.int64)) * dtype.itemsize
+        if rows == shape[0] and os.fstat(f.fileno()).st_size == end:
+            return
+        header = _header(version, dtype, (int(rows),) + shape[1:])
+        if len(header) == header_len:
+            f.truncate(end)
+            f.seek(0)
+            f.write(header)
+            return
+
+    np.save(filename, np.load(filename)[:rows])
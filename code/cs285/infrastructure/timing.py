@@ -0,0 +1,107 @@
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+# returned by phase() while timing is off: entering it does nothing
+_NULL_PHASE = nullcontext()
+_timer = None
+# optional context manager factory entered with every phase, e.g. torch.profiler.record_function
+_phase_hook = None
+
+
+class PhaseTimer(object):
+    """
+        Wall-clock time per named phase. Phases nest, and a phase is keyed by its
+        path from the outermost phase, e.g. 'collect/env_step/cruising', so time
+        spent stepping the env during evaluation ('eval/env_step') is kept apart.
+    """
+
+    def __init__(self):
+        self._stack = []
+        # seconds and calls since the last pop_iteration, and over the whole run
+        self.iteration_totals = defaultdict(float)
+        self.iteration_counts = defaultdict(int)
+        self.run_totals = defaultdict(float)
+        self.run_counts = defaultdict(int)
+        self.run_max = defaultdict(float)
+        self.num_iterations = 0
+
+    @contextmanager
+    def phase(self, name):
+        self._stack.append(name)
+        key = '/'.join(self._stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.iteration_totals[key] += time.perf_counter() - start
+            self.iteration_counts[key] += 1
+            self._stack.pop()
+
+    def pop_iteration(self):
+        # the per-phase seconds of the iteration that just ended
+        totals = dict(self.iteration_totals)
+        for key, seconds in totals.items():
+            self.run_totals[key] += seconds
+            self.run_counts[key] += self.iteration_counts[key]
+            self.run_max[key] = max(self.run_max[key], seconds)
+        self.num_iterations += 1
+        self.iteration_totals.clear()
+        self.iteration_counts.clear()
+        return totals
+
+    def summary(self):
+        top_level_total = sum(seconds for key, seconds in self.run_totals.items() if '/' not in key)
+        return {
+            key: {
+                'total_s': self.run_totals[key],
+                'mean_per_iter_s': self.run_totals[key] / max(self.num_iterations, 1),
+                'max_per_iter_s': self.run_max[key],
+                'calls': self.run_counts[key],
+                'fraction_of_iteration': self.run_totals[key] / top_level_total if top_level_total else 0.,
+            }
+            for key in sorted(self.run_totals)
+        }
+
+    def write_summary(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({'num_iterations': self.num_iterations, 'phases': self.summary()}, f, indent=2)
+
+
+def enable():
+    global _timer
+    _timer = PhaseTimer()
+    return _timer
+
+
+def disable():
+    global _timer
+    _timer = None
+
+
+def get_timer():
+    return _timer
+
+
+def set_phase_hook(hook):
+    global _phase_hook
+    _phase_hook = hook
+
+
+def phase(name):
+    """
+        Context manager timing the enclosed block as `name` when timing is
+        enabled; otherwise a shared no-op context
+    """
+    if _phase_hook is not None:
+        return _hooked_phase(name)
+    if _timer is None:
+        return _NULL_PHASE
+    return _timer.phase(name)
+
+
+@contextmanager
+def _hooked_phase(name):
+    with _phase_hook(name), (_NULL_PHASE if _timer is None else _timer.phase(name)):
+        yield
@@ -2,6 +2,9 @@ import numpy as np
 import time
 import copy
 
+from cs285.infrastructure.rng import RandomStream
+from cs285.infrastructure.timing import phase
+
 ############################################
 ############################################
 
@@ -54,22 +57,26 @@ def mean_squared_error(a, b):
 ############################################
 ############################################
 
-def sample_trajectory(env, policy, max_path_length, render=False, render_mode=('rgb_array')):
-    # initialize env for the beginning of a new rollout
-    ob = env.reset()  # HINT: should be the output of resetting the env
+def sample_trajectory(env, policy, max_path_length, render=False, render_mode=('rgb_array'), scenario=None):
+    # initialize env for the beginning of a new rollout (a fresh episode, or the given eval scenario)
+    with phase('env_reset'):
+        ob = env.reset() if scenario is None else env.reset(scenario)  # HINT: should be the output of resetting the env
 
     # init vars
-    obs, acs, rewards, next_obs, terminals, image_obs = [], [], [], [], [], []
+    obs, acs, rewards, next_obs, terminals, image_obs, infos = [], [], [], [], [], [], []
     steps = 0
     while True:
         # use the most recent ob to decide what to do
         obs.append(ob)
-        ac = policy.get_action(ob)  # HINT: query the policy's get_action function
+        with phase('policy_inference'):
+            ac = policy.get_action(ob)  # HINT: query the policy's get_action function
         ac = ac[0]
         acs.append(ac)
 
         # take that action and record results
-        ob, rew, done, _ = env.step(ac)
+        with phase('env_step'):
+            ob, rew, done, info = env.step(ac)
+        infos.append(info)
 
         # record result of taking that action
         steps += 1
@@ -82,7 +89,7 @@ def sample_trajectory(env, policy, max_path_length, render=False, render_mode=('
         if rollout_done:
             break
 
-    return Path(obs, image_obs, acs, rewards, next_obs, terminals)
+    return Path(obs, image_obs, acs, rewards, next_obs, terminals, infos)
     
 def sample_trajectories(env, policy, min_timesteps_per_batch, max_path_length, render=False, render_mode=('rgb_array')):
     timesteps_this_batch = 0
@@ -93,6 +100,78 @@ def sample_trajectories(env, policy, min_timesteps_per_batch, max_path_length, r
         timesteps_this_batch += get_pathlength(path)
     return paths, timesteps_this_batch
 
+def sample_scenario_trajectories(env, policy, scenarios, max_path_length):
+    # one rollout per eval scenario, in order; the policy draws its actions from a stream
+    # seeded by the scenario, so that every policy gets the same random numbers on it
+    paths = []
+    for scenario in scenarios:
+        with RandomStream(scenario.seed):
+            paths.append(sample_trajectory(env, policy, max_path_length, scenario=scenario))
+    return paths
+
+def sample_trajectories_multi(envs, policy, min_timesteps_per_batch, max_path_length, scenarios=None, rngs=None):
+    """
+        sample_trajectories for K envs stepped side by side, e.g. one env per seed:
+        `policy` maps the K current observations to K actions in one call
+        (see StackedPolicy.get_action), drawing the action of env k from rngs[k]
+        when given. Every env collects whole rollouts until it has
+        min_timesteps_per_batch steps, or one rollout per scenario when scenarios
+        are given, drawing its actions from a stream seeded by the scenario (as in
+        sample_scenario_trajectories); envs that are done are left out of the `active`
+        ones, whose actions are used.
+        Returns a list of paths and the number of timesteps per env.
+    """
+    K = len(envs)
+    paths = [[] for _ in range(K)]
+    timesteps = [0] * K
+
+    if scenarios is not None:
+        rngs = [None] * K
+
+    def reset(k):
+        if scenarios is None:
+            return envs[k].reset()
+        scenario = scenarios[len(paths[k])]
+        rngs[k] = RandomStream(scenario.seed)
+        return envs[k].reset(scenario)
+
+    def finished(k):
+        if scenarios is None:
+            return timesteps[k] >= min_timesteps_per_batch
+        return len(paths[k]) == len(scenarios)
+
+    with phase('env_reset'):
+        obs = [reset(k) for k in range(K)]
+    rollouts = [([], [], [], [], [], []) for _ in range(K)]
+    active = list(range(K))
+    while active:
+        with phase('policy_inference'):
+            acs = policy.get_action(np.stack(obs), active, rngs)
+
+        for k in list(active):
+            rollout_obs, rollout_acs, rewards, next_obs, terminals, infos = rollouts[k]
+            rollout_obs.append(obs[k])
+            rollout_acs.append(acs[k])
+            with phase('env_step'):
+                obs[k], rew, done, info = envs[k].step(acs[k])
+            infos.append(info)
+            next_obs.append(obs[k])
+            rewards.append(rew)
+            rollout_done = done | (len(rewards) == max_path_length)
+            terminals.append(rollout_done)
+            if not rollout_done:
+                continue
+
+            paths[k].append(Path(rollout_obs, [], rollout_acs, rewards, next_obs, terminals, infos))
+            timesteps[k] += len(rewards)
+            if finished(k):
+                active.remove(k)
+            else:
+                with phase('env_reset'):
+                    obs[k] = reset(k)
+                rollouts[k] = ([], [], [], [], [], [])
+    return paths, timesteps
+
 def sample_n_trajectories(env, policy, ntraj, max_path_length, render=False, render_mode=('rgb_array')):
 
     paths = []
@@ -104,19 +183,23 @@ def sample_n_trajectories(env, policy, ntraj, max_path_length, render=False, ren
 ############################################
 ############################################
 
-def Path(obs, image_obs, acs, rewards, next_obs, terminals):
+def Path(obs, image_obs, acs, rewards, next_obs, terminals, infos=None):
     """
         Take info (separate arrays) from a single rollout
-        and return it in a single dictionary
+        and return it in a single dictionary;
+        the env's per-step info dicts, if any, become one array per key under "info"
     """
     if image_obs != []:
         image_obs = np.stack(image_obs, axis=0)
-    return {"observation" : np.array(obs, dtype=np.float32),
+    path = {"observation" : np.array(obs, dtype=np.float32),
             "image_obs" : np.array(image_obs, dtype=np.uint8),
             "reward" : np.array(rewards, dtype=np.float32),
             "action" : np.array(acs, dtype=np.float32),
             "next_observation": np.array(next_obs, dtype=np.float32),
             "terminal": np.array(terminals, dtype=np.float32)}
+    if infos and infos[0] is not None:
+        path["info"] = {key: np.array([info[key] for info in infos]) for key in infos[0]}
+    return path
 
 
 def convert_listofrollouts(paths):
@@ -139,6 +222,46 @@ def convert_listofrollouts(paths):
 def get_pathlength(path):
     return len(path["reward"])
 
+def segment_starts(lengths):
+    """
+        Index of the first element of each segment in the concatenation of segments
+        with the given lengths
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    return np.cumsum(lengths) - lengths
+
+def discounted_segment_sum(x, lengths, gamma):
+    """
+        For a flat array x made of consecutive segments (e.g. trajectories),
+        return sum_{t'=0}^T gamma^t' x_{t'} of each segment, repeated over the segment
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    starts = segment_starts(lengths)
+    steps = np.arange(len(x)) - np.repeat(starts, lengths)
+    sums = np.add.reduceat(gamma ** steps * x, starts)
+    return np.repeat(sums, lengths)
+
+def discounted_segment_cumsum(x, lengths, gamma):
+    """
+        For a flat array x made of consecutive segments (e.g. trajectories),
+        return at each index t sum_{t'=t}^T gamma^(t'-t) x_{t'}, where T is the end of t's segment.
+
+        The segments are laid out as rows of a zero-padded [num_segments, max_length]
+        matrix and scanned backwards one column at a time, for all segments at once.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    starts = segment_starts(lengths)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    cols = np.arange(len(x)) - starts[rows]
+
+    padded = np.zeros((len(lengths), lengths.max()))
+    padded[rows, cols] = x
+    running = np.zeros(len(lengths))
+    for t in reversed(range(padded.shape[1])):
+        running = padded[:, t] + gamma * running
+        padded[:, t] = running
+    return padded[rows, cols]
+
 def normalize(data, mean, std, eps=1e-8):
     return (data-mean)/(std+eps)
 
@@ -8,6 +8,7 @@ import numpy as np
 import torch
 from torch import distributions
 
+from cs285.infrastructure import distributed
 from cs285.infrastructure import pytorch_util as ptu
 from cs285.policies.base_policy import BasePolicy
 from cs285.infrastructure.utils import normalize
@@ -25,6 +26,8 @@ class MLPPolicy(BasePolicy, nn.Module, metaclass=abc.ABCMeta):
                  training=True,
                  nn_baseline=False,
                  normal=True,
+                 compile_inference=False,
+                 shared_trunk=False,
                  **kwargs
                  ):
         super().__init__(**kwargs)
@@ -39,65 +42,114 @@ class MLPPolicy(BasePolicy, nn.Module, metaclass=abc.ABCMeta):
         self.training = training
         self.nn_baseline = nn_baseline
         self.normal = normal
+        self.compile_inference = compile_inference
+        # rollout-time state: preallocated input row and (optionally) compiled networks,
+        # kept out of the module tree so that state_dict is unchanged
+        self._obs_buffer = None
+        self._inference_nets = {}
+        self.shared_trunk = shared_trunk
+
+        # with a shared trunk, the hidden layers are computed once per forward pass
+        # and every output (logits / mean / alpha / beta / baseline) is a linear head on top
+        if self.shared_trunk:
+            assert self.n_layers >= 1, 'a shared trunk needs at least one hidden layer'
+            self.trunk = ptu.build_mlp(input_size=self.ob_dim,
+                                       output_size=self.size,
+                                       n_layers=self.n_layers - 1, size=self.size,
+                                       output_activation='tanh')
+            self.trunk.to(ptu.device)
+            head_input_size, head_n_layers = self.size, 0
+            trunk_parameters = list(self.trunk.parameters())
+        else:
+            self.trunk = None
+            head_input_size, head_n_layers = self.ob_dim, self.n_layers
+            trunk_parameters = []
+
         if self.discrete:
-            self.logits_na = ptu.build_mlp(input_size=self.ob_dim,
+            self.logits_na = ptu.build_mlp(input_size=head_input_size,
                                            output_size=self.ac_dim,
-                                           n_layers=self.n_layers,
+                                           n_layers=head_n_layers,
                                            size=self.size)
             self.logits_na.to(ptu.device)
             self.mean_net = None
             self.logstd = None
-            self.optimizer = optim.Adam(self.logits_na.parameters(),
-                                        self.learning_rate)
+            policy_parameters = list(self.logits_na.parameters())
         else:
             if self.normal:
                 self.logits_na = None
-                self.mean_net = ptu.build_mlp(input_size=self.ob_dim,
+                self.mean_net = ptu.build_mlp(input_size=head_input_size,
                                           output_size=self.ac_dim,
-                                          n_layers=self.n_layers, size=self.size)
+                                          n_layers=head_n_layers, size=self.size)
                 self.logstd = nn.Parameter(
                     torch.zeros(self.ac_dim, dtype=torch.float32, device=ptu.device)
                 )
                 self.mean_net.to(ptu.device)
                 self.logstd.to(ptu.device)
-                self.optimizer = optim.Adam(
-                    itertools.chain([self.logstd], self.mean_net.parameters()),
-                    self.learning_rate
-                )
+                policy_parameters = [self.logstd] + list(self.mean_net.parameters())
             else:
-                self.logalpha = ptu.build_mlp(input_size=self.ob_dim,
+                self.logits_na = None
+                self.mean_net = None
+                self.logstd = None
+                self.logalpha = ptu.build_mlp(input_size=head_input_size,
                                           output_size=self.ac_dim,
-                                          n_layers=self.n_layers, size=self.size)
-                self.logbeta = ptu.build_mlp(input_size=self.ob_dim,
+                                          n_layers=head_n_layers, size=self.size)
+                self.logbeta = ptu.build_mlp(input_size=head_input_size,
                                           output_size=self.ac_dim,
-                                          n_layers=self.n_layers, size=self.size)
+                                          n_layers=head_n_layers, size=self.size)
                 self.logalpha.to(ptu.device)
                 self.logbeta.to(ptu.device)
-                self.optimizer = optim.Adam(
-                    itertools.chain(self.logalpha.parameters(), self.logbeta.parameters()),
-                    self.learning_rate
-                )
+                policy_parameters = list(self.logalpha.parameters()) + list(self.logbeta.parameters())
 
         if nn_baseline:
             self.baseline = ptu.build_mlp(
-                input_size=self.ob_dim,
+                input_size=head_input_size,
                 output_size=1,
-                n_layers=self.n_layers,
+                n_layers=head_n_layers,
                 size=self.size,
             )
             self.baseline.to(ptu.device)
-            self.baseline_optimizer = optim.Adam(
-                self.baseline.parameters(),
-                self.learning_rate,
+
+        if nn_baseline and self.shared_trunk:
+            # trunk, policy heads and baseline head are trained together on the summed loss
+            self.optimizer = optim.Adam(
+                itertools.chain(trunk_parameters, policy_parameters, self.baseline.parameters()),
+                self.learning_rate
             )
+            self.baseline_optimizer = None
         else:
-            self.baseline = None
+            self.optimizer = optim.Adam(
+                itertools.chain(trunk_parameters, policy_parameters),
+                self.learning_rate
+            )
+            if nn_baseline:
+                self.baseline_optimizer = optim.Adam(
+                    self.baseline.parameters(),
+                    self.learning_rate,
+                )
+            else:
+                self.baseline = None
 
     ##################################
 
     def save(self, filepath):
         torch.save(self.state_dict(), filepath)
 
+    def load(self, filepath):
+        self.load_state_dict(torch.load(filepath, map_location=ptu.device))
+
+    # optimizer states, which the module state_dict does not include
+    def optimizer_state_dict(self):
+        baseline_optimizer = getattr(self, 'baseline_optimizer', None)
+        return {
+            'optimizer': self.optimizer.state_dict(),
+            'baseline_optimizer': None if baseline_optimizer is None else baseline_optimizer.state_dict(),
+        }
+
+    def load_optimizer_state_dict(self, state):
+        self.optimizer.load_state_dict(state['optimizer'])
+        if state['baseline_optimizer'] is not None:
+            self.baseline_optimizer.load_state_dict(state['baseline_optimizer'])
+
     ##################################
 
     # query the policy with observation(s) to get selected action(s)
@@ -107,11 +159,69 @@ class MLPPolicy(BasePolicy, nn.Module, metaclass=abc.ABCMeta):
         else:
             observation = obs[None]
 
-        observation = ptu.from_numpy(observation)
-        action = self(observation).sample()
+        # rollout-time path: no autograd, no distribution objects built per call
+        with torch.inference_mode():
+            action = self.sample_action(self._observation_tensor(observation))
 
         return ptu.to_numpy(action)
 
+    def _observation_tensor(self, observation):
+        if observation.shape[0] != 1:
+            return ptu.as_tensor(observation)
+        # single observations are copied into a preallocated input tensor
+        if self._obs_buffer is None or self._obs_buffer.shape != observation.shape:
+            self._obs_buffer = torch.empty(observation.shape, dtype=torch.float32, device=ptu.device)
+        return self._obs_buffer.copy_(torch.from_numpy(observation))
+
+    # sample actions straight from the per-row distribution parameters;
+    # same distributions as forward(), for use under torch.inference_mode
+    def sample_action(self, observation):
+        return self._sample_action(observation, self._inference_net, self.logstd)
+
+    # `net` maps a network name to the callable to run, e.g. block-batched over the stacked
+    # weights of several policies (StackedPolicy), with logstd stacked the same way;
+    # deterministic: the most likely class / the mean action instead of a sample
+    def _sample_action(self, observation, net, logstd, deterministic=False):
+        return self._draw_action(self._action_parameters(observation, net), logstd, deterministic)
+
+    # outputs of the networks that parametrize the action distribution
+    def _action_parameters(self, observation, net):
+        features = observation if self.trunk is None else net('trunk')(observation)
+        if self.discrete:
+            return net('logits_na')(features)
+        elif self.normal:
+            return net('mean_net')(features)
+        else:
+            return torch.exp(net('logalpha')(features)) + 1, torch.exp(net('logbeta')(features)) + 1
+
+    # the only random draw of _sample_action
+    def _draw_action(self, parameters, logstd, deterministic=False):
+        if self.discrete:
+            if deterministic:
+                return parameters.argmax(-1)
+            return distributions.Categorical(logits=parameters, validate_args=False).sample()
+        elif self.normal:
+            if deterministic:
+                return parameters
+            return parameters + torch.exp(logstd) * torch.randn_like(parameters)
+        else:
+            alpha, beta = parameters
+            if deterministic:
+                return alpha / (alpha + beta)
+            return distributions.Beta(alpha, beta, validate_args=False).sample()
+
+    def _inference_net(self, name):
+        net = getattr(self, name)
+        if not self.compile_inference:
+            return net
+        if name not in self._inference_nets:
+            # compiled modules share their parameters with `net`, so they follow training updates
+            if hasattr(torch, 'compile'):
+                self._inference_nets[name] = torch.compile(net)
+            else:
+                self._inference_nets[name] = torch.jit.script(net)
+        return self._inference_nets[name]
+
     # update/train this policy
     def update(self, observations, actions, **kwargs):
         raise NotImplementedError
@@ -122,56 +232,99 @@ class MLPPolicy(BasePolicy, nn.Module, metaclass=abc.ABCMeta):
     # return more flexible objects, such as a
     # `torch.distributions.Distribution` object. It's up to you!
     def forward(self, observation: torch.FloatTensor):
+        return self.action_distribution(self.features(observation))
+
+    # input of the output heads: the shared trunk's last hidden layer, or the observation itself
+    def features(self, observation):
+        if self.trunk is None:
+            return observation
+        return self.trunk(observation)
+
+    def action_distribution(self, features):
         if self.discrete:
-            logits = self.logits_na(observation)
+            logits = self.logits_na(features)
             action_distribution = distributions.Categorical(logits=logits)
         else:
             if self.normal:
-                batch_mean = self.mean_net(observation)
-                scale_tril = torch.diag(torch.exp(self.logstd))
-                batch_dim = batch_mean.shape[0]
-                batch_scale_tril = scale_tril.repeat(batch_dim, 1, 1)
-                action_distribution = distributions.MultivariateNormal(
-                    batch_mean,
-                    scale_tril=batch_scale_tril,
+                # diagonal Gaussian: independent Normals whose log-probs are summed over
+                # the action dimensions, O(batch * ac_dim) instead of a batched triangular solve
+                batch_mean = self.mean_net(features)
+                action_distribution = distributions.Independent(
+                    distributions.Normal(batch_mean, torch.exp(self.logstd)),
+                    1,
                 )
             else:
                 action_distribution = distributions.beta.Beta(
-                    torch.FloatTensor(torch.exp(self.logalpha(observation))+1),
-                    torch.FloatTensor(torch.exp(self.logbeta(observation))+1)
+                    torch.FloatTensor(torch.exp(self.logalpha(features))+1),
+                    torch.FloatTensor(torch.exp(self.logbeta(features))+1)
                 )
         return action_distribution
 
+    # log-probability of a batch of actions, one value per row
+    def log_prob(self, action_distribution, actions):
+        if self.normal or self.discrete:
+            return action_distribution.log_prob(actions)
+        else:
+            return torch.sum(action_distribution.log_prob(actions), axis=1)
+
+    # log-probabilities of given actions under the current policy, as a np array
+    def get_log_prob(self, obs: np.ndarray, acs: np.ndarray) -> np.ndarray:
+        with torch.no_grad():
+            log_prob = self.log_prob(self(ptu.as_tensor(obs)), ptu.as_tensor(acs))
+        return ptu.to_numpy(log_prob)
+
 
 #####################################################
 #####################################################
 
 class MLPPolicyPG(MLPPolicy):
-    def __init__(self, ac_dim, ob_dim, n_layers, size, **kwargs):
+    def __init__(self, ac_dim, ob_dim, n_layers, size, ppo_clip=None, ppo_epochs=10,
+                 ppo_minibatch_size=None, ppo_target_kl=None, **kwargs):
 
         super().__init__(ac_dim, ob_dim, n_layers, size, **kwargs)
         self.baseline_loss = nn.MSELoss()
 
-    def update(self, observations, acs_na, adv_n=None, acs_labels_na=None,
-               qvals=None):
-        observations = ptu.from_numpy(observations)
-        actions = ptu.from_numpy(acs_na)
-        adv_n = ptu.from_numpy(adv_n)
+        # clipped-surrogate (PPO) updates when ppo_clip is set, else one vanilla PG step
+        assert ppo_clip is None or ppo_epochs >= 1, 'PPO needs at least one epoch'
+        self.ppo_clip = ppo_clip
+        self.ppo_epochs = ppo_epochs
+        self.ppo_minibatch_size = ppo_minibatch_size
+        self.ppo_target_kl = ppo_target_kl
 
-        action_distribution = self(observations)
-        if self.normal:
-            distribution_log_prob = action_distribution.log_prob(actions)
-        else:
-            distribution_log_prob = torch.sum(action_distribution.log_prob(actions), axis=1)
-        loss = - distribution_log_prob * adv_n
-        loss = loss.mean()
-        self.optimizer.zero_grad()
-        loss.backward()
-        self.optimizer.step()
+    def update(self, observations, acs_na, adv_n=None, acs_labels_na=None,
+               qvals=None, weights_n=None):
+        observations = ptu.as_tensor(observations)
+        actions = ptu.as_tensor(acs_na)
+        adv_n = ptu.as_tensor(adv_n)
+        # per-sample importance weights, e.g. for data collected by an older policy
+        if weights_n is not None:
+            adv_n = adv_n * ptu.as_tensor(weights_n)
 
         if self.nn_baseline:
-            targets_n = normalize(qvals, np.mean(qvals), np.std(qvals))
-            targets_n = ptu.from_numpy(targets_n)
+            targets_n = normalize(qvals, *distributed.mean_std(qvals))
+            targets_n = ptu.as_tensor(targets_n)
+        # with a shared trunk the baseline is fit together with the policy, on the same features
+        joint_targets_n = targets_n if self.nn_baseline and self.shared_trunk else None
+
+        if self.ppo_clip is not None:
+            log = self.ppo_update(observations, actions, adv_n, joint_targets_n)
+        else:
+            features = self.features(observations)
+            action_distribution = self.action_distribution(features)
+            distribution_log_prob = self.log_prob(action_distribution, actions)
+            loss = - distribution_log_prob * adv_n
+            loss = loss.mean()
+            total_loss = loss
+            if joint_targets_n is not None:
+                total_loss = loss + F.mse_loss(self.baseline(features).squeeze(1), joint_targets_n)
+            self.optimizer.zero_grad()
+            total_loss.backward()
+            self.optimizer.step()
+            log = {
+                'Training Loss': ptu.to_numpy(loss),
+            }
+
+        if self.nn_baseline and not self.shared_trunk:
             baseline_predictions = self.baseline(observations).squeeze()
             assert baseline_predictions.dim() == baseline_predictions.dim()
 
@@ -180,8 +333,61 @@ class MLPPolicyPG(MLPPolicy):
             baseline_loss.backward()
             self.baseline_optimizer.step()
 
+        return log
+
+    def ppo_update(self, observations, actions, adv_n, baseline_targets_n=None):
+        """
+            Several epochs of shuffled minibatch steps on the clipped surrogate objective.
+            All tensors stay on the device; minibatches are index tensors into them.
+            Stops early once the approximate KL to the data-collecting policy exceeds ppo_target_kl.
+            With baseline_targets_n (shared trunk), the baseline loss is added to every minibatch loss.
+        """
+        with torch.no_grad():
+            old_log_prob = self.log_prob(self(observations), actions)
+
+        n = observations.shape[0]
+        minibatch_size = self.ppo_minibatch_size or n
+        # data-parallel ranks split their batches, whose sizes may differ, into the same
+        # number of minibatches: every step all-reduces the gradients of all ranks
+        num_minibatches = distributed.max_int(-(-n // minibatch_size))
+        for epoch in range(self.ppo_epochs):
+            approx_kl, clip_fraction, loss_sum = 0., 0., 0.
+            permutation = torch.randperm(n, device=observations.device)
+            if distributed.is_enabled():
+                minibatches = torch.tensor_split(permutation, num_minibatches)
+            else:
+                minibatches = [permutation[start:start + minibatch_size] for start in range(0, n, minibatch_size)]
+            for indices in minibatches:
+                features = self.features(observations[indices])
+                log_prob = self.log_prob(self.action_distribution(features), actions[indices])
+                log_ratio = log_prob - old_log_prob[indices]
+                ratio = torch.exp(log_ratio)
+                adv = adv_n[indices]
+                surrogate = torch.min(ratio * adv, torch.clamp(ratio, 1 - self.ppo_clip, 1 + self.ppo_clip) * adv)
+                loss = - surrogate.mean()
+                total_loss = loss
+                if baseline_targets_n is not None:
+                    total_loss = loss + F.mse_loss(self.baseline(features).squeeze(1), baseline_targets_n[indices])
+
+                self.optimizer.zero_grad()
+                total_loss.backward()
+                self.optimizer.step()
+
+                # statistics of the epoch, weighted by minibatch size
+                with torch.no_grad():
+                    weight = len(indices) / n
+                    approx_kl += weight * ((ratio - 1) - log_ratio).mean().item()
+                    clip_fraction += weight * ((ratio - 1).abs() > self.ppo_clip).float().mean().item()
+                    loss_sum += weight * loss.item()
+
+            if self.ppo_target_kl is not None and distributed.mean(approx_kl) > self.ppo_target_kl:
+                break
+
         return {
-            'Training Loss': ptu.to_numpy(loss),
+            'Training Loss': loss_sum,
+            'PPO_ApproxKL': approx_kl,
+            'PPO_ClipFraction': clip_fraction,
+            'PPO_Epochs': epoch + 1,
         }
 
     def run_baseline_prediction(self, obs):
@@ -190,28 +396,26 @@ class MLPPolicyPG(MLPPolicy):
             calls the forward method of the baseline MLP,
             and returns a np array
 
-            Input: `obs`: np.ndarray of size [N, 1]
+            Input: `obs`: np.ndarray or tensor of size [N, 1]
             Output: np.ndarray of size [N]
 
         """
-        obs = ptu.from_numpy(obs)
-        predictions = self.baseline(obs)
+        obs = ptu.as_tensor(obs)
+        with torch.no_grad():
+            predictions = self.baseline(self.features(obs))
         return ptu.to_numpy(predictions)[:, 0]
 
 
 class MLPPolicyAC(MLPPolicy):
     def update(self, observations, actions, adv_n=None):
 
-        observations = ptu.from_numpy(observations)
-        actions = ptu.from_numpy(actions)
-        adv_n = ptu.from_numpy(adv_n)
+        observations = ptu.as_tensor(observations)
+        actions = ptu.as_tensor(actions)
+        adv_n = ptu.as_tensor(adv_n)
 
         # TODO: update the policy and return the loss
         action_distribution = self(observations)
-        if self.normal:
-            distribution_log_prob = action_distribution.log_prob(actions)
-        else:
-            distribution_log_prob = torch.sum(action_distribution.log_prob(actions), axis=1)
+        distribution_log_prob = self.log_prob(action_distribution, actions)
         loss = - distribution_log_prob * adv_n
         loss = loss.mean()
 
@@ -18,4 +18,31 @@ class ArgMaxPolicy(object):
         q_values = self.critic.qa_values(observation)
         action = q_values.argmax(-1)
 
-        return action[0]
\ No newline at end of file
+        return action[0]
+
+class PriceGridPolicy(ArgMaxPolicy):
+    """
+        Epsilon-greedy policy over a branching Q-function: every rate area picks
+        one of n_levels evenly spaced prices, independently of the others.
+        Actions are returned as normalized prices in [0, 1], like the MLP policies.
+    """
+
+    def __init__(self, critic, n_levels, epsilon=0.):
+        super().__init__(critic)
+        self.n_levels = n_levels
+        self.epsilon = epsilon
+
+    def get_action(self, obs):
+        observation = obs if len(obs.shape) > 1 else obs[None]
+        levels = self.critic.qa_values(observation).argmax(-1)
+
+        # explore area by area
+        if self.epsilon > 0:
+            explore = np.random.uniform(size=levels.shape) < self.epsilon
+            levels = np.where(explore, np.random.randint(self.n_levels, size=levels.shape), levels)
+
+        return levels / (self.n_levels - 1)
+
+    def to_levels(self, actions):
+        # inverse of get_action's scaling, for actions read back from the replay buffer
+        return np.rint(actions * (self.n_levels - 1)).astype(np.int64)
@@ -0,0 +1,111 @@
+import numpy as np
+import torch
+from torch import nn
+
+from cs285.infrastructure import pytorch_util as ptu
+from cs285.infrastructure.rng import stream
+from cs285.policies.MLP_policy import MLPPolicy
+
+# the networks MLPPolicy._sample_action may run
+NETWORKS = ('trunk', 'logits_na', 'mean_net', 'logalpha', 'logbeta')
+
+
+class StackedMLP(object):
+    """
+        K copies of one ptu.build_mlp architecture as block-batched linear layers:
+        the weights of the K networks are stacked along a leading dimension and each
+        layer is one batched matmul over inputs of shape [K, batch, in_size].
+    """
+
+    def __init__(self, networks):
+        self.layers = []
+        for layers in zip(*networks):
+            if isinstance(layers[0], nn.Linear):
+                weight = torch.stack([layer.weight for layer in layers]).transpose(1, 2)
+                bias = torch.stack([layer.bias for layer in layers])[:, None]
+                self.layers.append((weight, bias))
+            else:
+                # activations have no parameters
+                self.layers.append(layers[0])
+
+    def __call__(self, x):
+        for layer in self.layers:
+            if isinstance(layer, tuple):
+                x = torch.baddbmm(layer[1], x, layer[0])
+            else:
+                x = layer(x)
+        return x
+
+
+class StackedPolicy(object):
+    """
+        The rollout policies of K seeds, queried with one observation per seed at once.
+        MLP policies of one architecture run a single forward pass over copies of their
+        weights stacked along a leading seed dimension; call refresh() after training,
+        to copy the updated weights. Other policies (e.g. the epsilon-greedy
+        PriceGridPolicy) are queried one after the other.
+        deterministic: the MLP policies return their mean actions instead of samples.
+    """
+
+    def __init__(self, policies, deterministic=False):
+        self.policies = policies
+        self.deterministic = deterministic
+        self.stacked = all(isinstance(policy, MLPPolicy) for policy in policies)
+        self.networks = None
+        self.logstd = None
+
+    def refresh(self):
+        if not self.stacked:
+            return
+        policy = self.policies[0]
+        with torch.no_grad():
+            self.networks = {name: StackedMLP([getattr(policy, name) for policy in self.policies])
+                             for name in NETWORKS if getattr(policy, name, None) is not None}
+            if getattr(policy, 'logstd', None) is not None:
+                # [K, 1, ac_dim], to broadcast over the single observation of every seed
+                self.logstd = torch.stack([policy.logstd for policy in self.policies])[:, None]
+
+    def get_action(self, obs: np.ndarray, active=None, rngs=None) -> np.ndarray:
+        """
+            obs: one observation per seed, [K, ob_dim]; returns one action per seed.
+            active: the seeds whose actions are used; the others draw no random numbers
+            and get zeros. rngs: per seed, the RandomStream its action is drawn from;
+            without them, all seeds draw from the global random state at once.
+        """
+        rows = range(len(obs)) if active is None else active
+        if not self.stacked:
+            actions = {}
+            for k in rows:
+                with stream(rngs, k):
+                    actions[k] = self.policies[k].get_action(obs[k])[0]
+            return _fill(actions, len(obs))
+        if self.networks is None:
+            self.refresh()
+        policy = self.policies[0]
+        with torch.inference_mode():
+            observation = ptu.as_tensor(obs)[:, None]
+            parameters = policy._action_parameters(observation, self.networks.get)
+            if active is None and rngs is None:
+                return ptu.to_numpy(policy._draw_action(parameters, self.logstd, self.deterministic))[:, 0]
+            actions = {}
+            for k in rows:
+                with stream(rngs, k):
+                    actions[k] = ptu.to_numpy(policy._draw_action(
+                        _row(parameters, k), None if self.logstd is None else self.logstd[k], self.deterministic))[0]
+        return _fill(actions, len(obs))
+
+
+def _row(parameters, k):
+    # the distribution parameters of the k-th policy
+    if isinstance(parameters, tuple):
+        return tuple(parameter[k] for parameter in parameters)
+    return parameters[k]
+
+
+def _fill(actions, K):
+    # {seed: action} -> [K, ...] actions, zeros for the missing seeds
+    first = next(iter(actions.values()))
+    filled = np.zeros((K,) + first.shape, dtype=first.dtype)
+    for k, action in actions.items():
+        filled[k] = action
+    return filled
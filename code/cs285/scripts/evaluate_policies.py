@@ -0,0 +1,339 @@
+import glob
+import os
+import re
+import shutil
+import tempfile
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import torch
+
+from cs285.critics.dqn_critic import DQNCritic
+from cs285.environment import parking
+from cs285.infrastructure import utils
+from cs285.infrastructure.checkpoint import CHECKPOINT_DIR, load_checkpoint
+from cs285.infrastructure.dqn_utils import create_parking_q_network, parking_optimizer
+from cs285.policies.MLP_policy import MLPPolicyPG
+from cs285.policies.argmax_policy import PriceGridPolicy
+from cs285.policies.stacked_policy import StackedPolicy
+
+# per-step env info, summed over every episode
+INFO_KEYS = ['revenue', 'cruising_cost', 'lost_demand', 'arrivals']
+POLICY_HEADS = ('logits_na', 'mean_net', 'logalpha')
+
+
+def _linear_weights(state, prefix):
+    # weight matrices of a ptu.build_mlp network in a state dict, in layer order
+    pattern = (re.escape(prefix) + r'\.' if prefix else '') + r'\d+\.weight$'
+    keys = [key for key in state if re.match(pattern, key)]
+    return [state[key] for key in sorted(keys, key=lambda key: int(key.split('.')[-2]))]
+
+
+def _itr(filename):
+    match = re.search(r'(\d+)\.pt$', filename)
+    return int(match.group(1)) if match else -1
+
+
+def _run_root(directory):
+    # the directory holding the run that `directory` is or is part of (its checkpoints, seed<k>, rank<r>)
+    while re.match(r'({}|seed\d+|rank\d+)$'.format(CHECKPOINT_DIR), os.path.basename(directory)):
+        directory = os.path.dirname(directory)
+    return os.path.dirname(directory)
+
+
+def checkpoint_candidates(paths, ac_dim):
+    """
+        One candidate per agent_itr_*.pt file under the given run directories (in iteration
+        order) or per given .pt file, each file once; a trainer checkpoint gives one
+        candidate per seed. The architecture of every policy is read back from the
+        shapes of its weights.
+    """
+    candidates = []
+    seen = set()
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(glob.glob(os.path.join(path, '**', 'agent_itr_*.pt'), recursive=True),
+                           key=lambda filename: (os.path.dirname(filename), _itr(filename)))
+            root = _run_root(os.path.abspath(path))
+        else:
+            files = [path]
+            root = _run_root(os.path.dirname(os.path.abspath(path)))
+        for filename in files:
+            if os.path.realpath(filename) in seen:
+                continue
+            seen.add(os.path.realpath(filename))
+            state = load_checkpoint(filename)
+            # trainer checkpoints hold 'agents', one per seed, or 'agent' when written before multi-seed runs
+            if 'agents' in state:
+                agent_states = state['agents']
+            elif 'agent' in state:
+                agent_states = [state['agent']]
+            else:
+                agent_states = [state]
+            # named after the run
+            name = os.path.relpath(os.path.abspath(filename), root)
+            for k, agent_state in enumerate(agent_states):
+                candidate = agent_candidate(agent_state, ac_dim)
+                candidate['name'] = name if len(agent_states) == 1 else '{}#{}'.format(name, k)
+                candidate['path'] = os.path.abspath(filename) if len(agent_states) == 1 else \
+                    '{}#{}'.format(os.path.abspath(filename), k)
+                candidates.append(candidate)
+    return candidates
+
+
+def unique_names(candidates):
+    """
+        Runs of the same name under different parents are named by their full path;
+        any name still repeated gets numbered
+    """
+    counts = Counter(candidate['name'] for candidate in candidates)
+    for candidate in candidates:
+        if counts[candidate['name']] > 1 and 'path' in candidate:
+            candidate['name'] = candidate['path']
+    counts = Counter(candidate['name'] for candidate in candidates)
+    numbers = Counter()
+    for candidate in candidates:
+        if counts[candidate['name']] > 1:
+            numbers[candidate['name']] += 1
+            candidate['name'] = '{}_{}'.format(candidate['name'], numbers[candidate['name']])
+
+
+def agent_candidate(agent_state, ac_dim):
+    if 'q_net' in agent_state:
+        weights = _linear_weights(agent_state['q_net'], '')
+        assert weights[-1].shape[0] % ac_dim == 0, 'the Q-network is not for {} rate areas'.format(ac_dim)
+        return {'kind': 'dqn', 'state': agent_state['q_net'], 'ob_dim': weights[0].shape[1],
+                'n_layers': len(weights) - 1, 'size': weights[0].shape[0],
+                'n_levels': weights[-1].shape[0] // ac_dim}
+
+    state = agent_state['actor']
+    head = [name for name in POLICY_HEADS if name + '.0.weight' in state][0]
+    head_weights = _linear_weights(state, head)
+    assert head_weights[-1].shape[0] == ac_dim, 'the policy is not for {} rate areas'.format(ac_dim)
+    shared_trunk = 'trunk.0.weight' in state
+    weights = _linear_weights(state, 'trunk') if shared_trunk else head_weights
+    return {'kind': 'mlp', 'state': state, 'ob_dim': weights[0].shape[1],
+            'n_layers': len(weights) - (0 if shared_trunk else 1), 'size': weights[0].shape[0],
+            'shared_trunk': shared_trunk, 'discrete': head == 'logits_na', 'normal': head == 'mean_net',
+            'nn_baseline': any(key.startswith('baseline.') for key in state)}
+
+
+def obs_config(ob_dim, n_blocks, ac_dim):
+    # (obs_mode, spatial_bins) of the env whose observations have ob_dim entries
+    if ob_dim == 2 + n_blocks:
+        return 'raw', 0
+    spatial_bins = int(round(max(ob_dim - (2 * ac_dim + parking.N_STAGES + 2), 0) ** 0.5))
+    if ob_dim != 2 * ac_dim + parking.N_STAGES + 2 + spatial_bins ** 2:
+        raise ValueError('No observation mode of the env has {} entries'.format(ob_dim))
+    return 'aggregate', spatial_bins
+
+
+def build_policy(candidate, ac_dim):
+    if candidate['kind'] == 'mlp':
+        policy = MLPPolicyPG(ac_dim, candidate['ob_dim'], candidate['n_layers'], candidate['size'],
+                             discrete=candidate['discrete'], training=False,
+                             nn_baseline=candidate['nn_baseline'], normal=candidate['normal'],
+                             shared_trunk=candidate['shared_trunk'])
+        policy.load_state_dict(candidate['state'])
+        return policy
+    critic = DQNCritic({
+        'env_name': 'parking', 'ob_dim': candidate['ob_dim'], 'ac_dim': candidate['n_levels'],
+        'n_branches': ac_dim, 'double_q': False, 'grad_norm_clipping': None, 'gamma': 1.,
+        'q_func': lambda ob_dim, num_actions: create_parking_q_network(
+            ob_dim, num_actions, candidate['n_layers'], candidate['size']),
+    }, parking_optimizer(0.))
+    critic.q_net.load_state_dict(candidate['state'])
+    # greedy
+    return PriceGridPolicy(critic, candidate['n_levels'])
+
+
+class FixedPrices(object):
+    # the same normalized prices whatever the observations, one row per candidate
+    def __init__(self, actions):
+        self.actions = np.asarray(actions, dtype=np.float32)
+
+    def get_action(self, obs, active=None, rngs=None):
+        return self.actions
+
+
+class CandidatePolicy(object):
+    """
+        The policies of K candidates, queried with one observation each as in
+        utils.sample_trajectories_multi: the MLP policies of one architecture share
+        one StackedPolicy forward pass, fixed prices are repeated, and the DQN
+        policies are queried one after the other. The MLP policies act with their
+        mean actions unless sample_actions is set.
+    """
+
+    def __init__(self, candidates, ac_dim, sample_actions=False):
+        groups = OrderedDict()
+        for k, candidate in enumerate(candidates):
+            if candidate['kind'] == 'prices':
+                key = 'prices'
+            elif candidate['kind'] == 'mlp':
+                key = tuple((name, tuple(value.shape)) for name, value in candidate['state'].items())
+            else:
+                key = 'dqn'
+            groups.setdefault(key, []).append(k)
+
+        self.ac_dim = ac_dim
+        self.groups = []
+        for key, rows in groups.items():
+            if key == 'prices':
+                policy = FixedPrices([parking.price_action(candidates[k]['prices']) for k in rows])
+            else:
+                policy = StackedPolicy([build_policy(candidates[k], ac_dim) for k in rows],
+                                       deterministic=not sample_actions)
+            self.groups.append((rows, policy))
+
+    def get_action(self, obs, active=None, rngs=None):
+        actions = np.zeros((len(obs), self.ac_dim), dtype=np.float32)
+        for rows, policy in self.groups:
+            group_active = None if active is None else [i for i, k in enumerate(rows) if k in active]
+            if group_active == []:
+                continue
+            group_rngs = None if rngs is None else [rngs[k] for k in rows]
+            actions[rows] = policy.get_action(obs[rows], group_active, group_rngs)
+        return actions
+
+
+# per worker process: the envs and policy of every group of candidates
+_worker = {}
+
+
+def init_worker(groups, ac_dim, env_cache_dir, threads_per_worker, sample_actions):
+    torch.set_num_threads(threads_per_worker)
+    df_block = pd.read_csv('../data/Meters/Meter_block.csv')
+    df_demand = pd.read_csv('../data/demand.csv')
+    neighbours = parking.load_block_neighbours(env_cache_dir)
+    _worker['groups'] = []
+    for (obs_mode, spatial_bins), candidates in groups:
+        # one env per candidate, all sharing the block neighbour arrays
+        envs = [parking.parking_env(df_block, df_demand, obs_mode=obs_mode, spatial_bins=spatial_bins,
+                                    neighbours=neighbours) for _ in candidates]
+        _worker['groups'].append((envs, CandidatePolicy(candidates, ac_dim, sample_actions)))
+
+
+def run_scenario(group, scenario, ep_len):
+    """
+        One episode of every candidate of the group from the scenario; returns the
+        episode's return, info totals and average price, per candidate
+    """
+    envs, policy = _worker['groups'][group]
+    paths, _ = utils.sample_trajectories_multi(envs, policy, 0, ep_len, scenarios=[scenario])
+    results = []
+    for candidate_paths in paths:
+        path = candidate_paths[0]
+        result = {'return': path['reward'].sum()}
+        result.update((key, path['info'][key].sum()) for key in INFO_KEYS)
+        result['mean_price'] = np.mean(parking.P_MIN + (parking.P_MAX - parking.P_MIN) * path['action'])
+        results.append(result)
+    return results
+
+
+def summarize(episodes):
+    """
+        One row per candidate, best average return first: per-episode averages of
+        the return (with its standard error) and of the reward terms, and the paired
+        difference to the best candidate over the same scenarios
+    """
+    grouped = episodes.groupby('candidate', sort=False)
+    n = grouped.size()
+    table = grouped[['return'] + INFO_KEYS + ['mean_price']].mean()
+    table.insert(1, 'return_se', grouped['return'].std() / np.sqrt(n))
+    table.insert(table.columns.get_loc('arrivals') + 1, 'lost_share', table['lost_demand'] / table['arrivals'])
+
+    returns = episodes.pivot(index='scenario', columns='candidate', values='return')
+    differences = returns.sub(returns[table['return'].idxmax()], axis=0)
+    table['vs_best'] = differences.mean()
+    table['vs_best_se'] = differences.std() / np.sqrt(len(differences))
+    table['episodes'] = n
+    return table.rename(columns={'return': 'return_mean'}).sort_values('return_mean', ascending=False)
+
+
+def main(argv=None):
+
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoints', type=str, nargs='*', default=[]) #run directories (every agent_itr_*.pt in them) and/or .pt files
+    parser.add_argument('--uniform_prices', type=int, default=0) #N fixed prices evenly spaced over P_MIN..P_MAX, the same in every area
+    parser.add_argument('--no_historical', action='store_true') #leave out the historical per-area rates
+    parser.add_argument('--historical_fallback', type=float, default=2.) #rate of the areas without a historical one
+    parser.add_argument('--scenarios', type=int, default=14) #seeded episodes covering every stage, the same for every candidate
+    parser.add_argument('--scenario_seed', type=int, default=0)
+    parser.add_argument('--ep_len', type=int, default=48)
+    parser.add_argument('--sample_actions', action='store_true') #sample the MLP policies' actions (as in training eval) instead of using their means
+    parser.add_argument('--workers', type=int, default=None) #defaults to available cores / threads_per_worker
+    parser.add_argument('--threads_per_worker', type=int, default=1)
+    parser.add_argument('--env_cache_dir', type=str, default=None) #precomputed block neighbours, otherwise computed once here
+    parser.add_argument('--output', type=str, default=None) #csv of the table
+    parser.add_argument('--episodes_output', type=str, default=None) #csv of the per-episode results
+    args = parser.parse_args(argv)
+
+    df_block = pd.read_csv('../data/Meters/Meter_block.csv')
+    n_blocks, ac_dim = len(df_block), len(df_block['OLD_RATE_AREA_id'].unique())
+
+    candidates = checkpoint_candidates(args.checkpoints, ac_dim)
+    for price in np.linspace(parking.P_MIN, parking.P_MAX, args.uniform_prices):
+        candidates.append({'kind': 'prices', 'name': 'uniform_{:.2f}'.format(price), 'prices': np.full(ac_dim, price)})
+    if not args.no_historical:
+        candidates.append({'kind': 'prices', 'name': 'historical',
+                           'prices': parking.historical_prices(df_block, args.historical_fallback)})
+    assert candidates, 'Nothing to evaluate'
+    unique_names(candidates)
+
+    # candidates are stepped side by side, in groups that observe the env the same way;
+    # fixed prices ignore the observations and take the cheapest
+    groups = OrderedDict()
+    for candidate in candidates:
+        config = ('aggregate', 0) if candidate['kind'] == 'prices' else \
+            obs_config(candidate['ob_dim'], n_blocks, ac_dim)
+        groups.setdefault(config, []).append(candidate)
+    groups = list(groups.items())
+    scenarios = parking.eval_scenarios(args.scenarios, args.scenario_seed)
+    print('{} candidates in {} group(s), {} scenarios'.format(len(candidates), len(groups), len(scenarios)))
+
+    env_cache_dir = args.env_cache_dir or tempfile.mkdtemp()
+    if not os.path.exists(os.path.join(env_cache_dir, parking.NEIGHBOUR_FILES[-1])):
+        parking.save_block_neighbours(df_block, env_cache_dir)
+
+    # every (group, scenario) is one task
+    tasks = [(group, scenario) for group in range(len(groups)) for scenario in scenarios]
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    workers = min(args.workers or max(1, cores // args.threads_per_worker), len(tasks))
+    initargs = (groups, ac_dim, env_cache_dir, args.threads_per_worker, args.sample_actions)
+    start = time.time()
+    try:
+        if workers == 1:
+            init_worker(*initargs)
+            results = [run_scenario(group, scenario, args.ep_len) for group, scenario in tasks]
+        else:
+            with ProcessPoolExecutor(workers, initializer=init_worker, initargs=initargs) as pool:
+                results = list(pool.map(run_scenario, *zip(*tasks), [args.ep_len] * len(tasks)))
+    finally:
+        if args.env_cache_dir is None:
+            shutil.rmtree(env_cache_dir)
+    print('{} episodes in {:.1f}s with {} worker(s)'.format(
+        len(candidates) * len(scenarios), time.time() - start, workers))
+
+    episodes = []
+    for (group, scenario), task_results in zip(tasks, results):
+        for candidate, result in zip(groups[group][1], task_results):
+            episodes.append({'candidate': candidate['name'], 'scenario': scenarios.index(scenario),
+                             'start': scenario.start, **result})
+    episodes = pd.DataFrame(episodes)
+    table = summarize(episodes)
+
+    if args.output:
+        table.to_csv(args.output)
+    if args.episodes_output:
+        episodes.to_csv(args.episodes_output, index=False)
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 250):
+        print(table)
+
+
+if __name__ == '__main__':
+    main()
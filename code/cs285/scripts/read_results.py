@@ -1,26 +1,48 @@
-import glob
-# import tensorflow as tf
-from tensorflow.python.summary.summary_iterator import summary_iterator
-
-def get_section_results(file):
-    """
-        requires tensorflow==1.12.0
-    """
-    X = [1]
-    Y = [2]
-    for e in summary_iterator(file):
-        for v in e.summary.value:
-            if v.tag == 'Train_EnvstepsSoFar':
-                X.append(v.simple_value)
-            elif v.tag == 'Eval_AverageReturn':
-                Y.append(v.simple_value)
-    return X, Y
+import fnmatch
+import os
 
-if __name__ == '__main__':
-    import glob
+import pandas as pd
+
+from cs285.infrastructure.results_index import ResultsIndex, summarize
+
+
+def main():
+
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_dir', type=str,
+                        default=os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../data'))
+    parser.add_argument('--cache_file', type=str, default=None) #defaults to <data_dir>/.results_index.pkl
+    parser.add_argument('--runs', type=str, nargs='*', default=['*']) #glob patterns of run directories to include
+    parser.add_argument('--tags', type=str, nargs='*', default=['Eval_AverageReturn', 'Train_AverageReturn'])
+    parser.add_argument('--last', type=int, default=1) #average each tag over its last N logged values
+    parser.add_argument('--group_seeds', action='store_true') #aggregate runs that differ only in timestamp/seed
+    parser.add_argument('--curve', action='store_true') #print every step of the first tag instead, one column per run
+    parser.add_argument('--workers', type=int, default=None) #processes used to read new event files
+    parser.add_argument('--output', type=str, default=None) #also write the resulting table to this csv
+
+    args = parser.parse_args()
 
-    logdir = 'data/q1_sb_rtg_dsa_CartPole-v0_26-09-2020_15-14-17/events.out.tfevents.1601158457.hayashiintans-MacBook-Pro.local'
-    eventfile = glob.glob(logdir)[0]
-    X, Y = get_section_results(eventfile)
-    for i, (x, y) in enumerate(zip(X, Y)):
-        print('Iteration {:d} | Train steps: {:d} | Return: {}'.format(i, int(x), y))
\ No newline at end of file
+    index = ResultsIndex(args.data_dir, args.cache_file)
+    stale = index.update(workers=args.workers)
+    table = index.table()
+    print('Indexed {} event files ({} re-read), {} scalars'.format(len(index.files), len(stale), len(table)))
+
+    runs = [run for run in table['run'].cat.categories
+            if any(fnmatch.fnmatch(run, pattern) for pattern in args.runs)]
+    table = table[table['run'].isin(runs)]
+
+    if args.curve:
+        result = table[table['tag'] == args.tags[0]].pivot_table(
+            index='step', columns='run', values='value', aggfunc='last', observed=True)
+    else:
+        result = summarize(table, args.tags, last=args.last, group_seeds=args.group_seeds)
+
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200):
+        print(result)
+    if args.output:
+        result.to_csv(args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,7 @@ import os
 import time
 os.environ['KMP_DUPLICATE_LIB_OK']='True'
 
+from cs285.infrastructure import distributed
 from cs285.infrastructure.rl_trainer import RL_Trainer
 from cs285.agents.pg_agent import PGAgent
 
@@ -24,10 +25,19 @@ class PG_Trainer(object):
             'standardize_advantages': not(params['dont_standardize_advantages']),
             'reward_to_go': params['reward_to_go'],
             'nn_baseline': params['nn_baseline'],
+            'gae_lambda': params['gae_lambda'],
         }
 
         train_args = {
             'num_agent_train_steps_per_iter': params['num_agent_train_steps_per_iter'],
+            'ppo_clip': params['ppo_clip'],
+            'ppo_epochs': params['ppo_epochs'],
+            'ppo_minibatch_size': params['ppo_minibatch_size'],
+            'ppo_target_kl': params['ppo_target_kl'],
+            'reuse_batches': params['reuse_batches'],
+            'is_mode': params['is_mode'],
+            'is_truncation': params['is_truncation'],
+            'min_ess': params['min_ess'],
         }
 
         agent_params = {**computation_graph_args, **estimate_advantage_args, **train_args}
@@ -49,10 +59,16 @@ class PG_Trainer(object):
             self.params['n_iter'],
             collect_policy = self.rl_trainer.agent.actor,
             eval_policy = self.rl_trainer.agent.actor,
+            initial_expertdata = self.params['initial_dataset'],
             )
 
 
-def main():
+def run(params):
+    trainer = PG_Trainer(params)
+    trainer.run_training_loop()
+
+
+def main(argv=None):
 
     import argparse
     parser = argparse.ArgumentParser()
@@ -62,11 +78,22 @@ def main():
 
     parser.add_argument('--reward_to_go', '-rtg', action='store_true')
     parser.add_argument('--nn_baseline', action='store_true')
+    parser.add_argument('--gae_lambda', type=float, default=None) #GAE(lambda) advantages on top of --nn_baseline and -rtg
     parser.add_argument('--dont_standardize_advantages', '-dsa', action='store_true')
     parser.add_argument('--batch_size', '-b', type=int, default=480) #steps collected per train iteration
     parser.add_argument('--eval_batch_size', '-eb', type=int, default=480) #steps collected per eval iteration
+    parser.add_argument('--eval_scenarios', type=int, default=0) #instead, evaluate on N fixed seeded episodes covering every stage, identical for every policy
+    parser.add_argument('--eval_scenario_seed', type=int, default=0) #seed of that suite of eval episodes
 
     parser.add_argument('--num_agent_train_steps_per_iter', type=int, default=1)
+    parser.add_argument('--ppo_clip', type=float, default=None) #clipped-surrogate updates, e.g. 0.2
+    parser.add_argument('--ppo_epochs', type=int, default=10)
+    parser.add_argument('--ppo_minibatch_size', type=int, default=None)
+    parser.add_argument('--ppo_target_kl', type=float, default=None) #stop the epochs early past this approximate KL
+    parser.add_argument('--reuse_batches', type=int, default=0) #also train on the last K batches, importance weighted
+    parser.add_argument('--is_mode', type=str, default='decision', choices=['decision', 'trajectory'])
+    parser.add_argument('--is_truncation', type=float, default=1.0) #upper bound of the importance weights
+    parser.add_argument('--min_ess', type=float, default=0.1) #drop past batches below this normalized effective sample size
     parser.add_argument('--discount', type=float, default=1.0)
     parser.add_argument('--learning_rate', '-lr', type=float, default=5e-3)
     parser.add_argument('--n_layers', '-l', type=int, default=2)
@@ -74,16 +101,44 @@ def main():
 
     parser.add_argument('--ep_len', type=int, default=48) #students shouldn't change this away from env's default
     parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--num_seeds', type=int, default=1) #train seeds seed..seed+K-1 side by side in this process, logged to logdir/seed<seed>
+    parser.add_argument('--world_size', type=int, default=1) #data-parallel processes, each collecting batch_size / world_size steps
+    parser.add_argument('--dist_port', type=int, default=29500) #localhost port the processes connect through
     parser.add_argument('--no_gpu', '-ngpu', action='store_true')
     parser.add_argument('--which_gpu', '-gpu_id', default=0)
     parser.add_argument('--video_log_freq', type=int, default=-1)
     parser.add_argument('--scalar_log_freq', type=int, default=1)
 
     parser.add_argument('--save_params', action='store_true')
+    parser.add_argument('--time_phases', action='store_true') #log Perf/* per-phase wall-clock times and phase_times.json
+    parser.add_argument('--profile_iters', type=str, default=None) #a:b profiles iterations a..b-1 into logdir
+    parser.add_argument('--profiler', type=str, default='sampling', choices=['sampling', 'torch'])
+    parser.add_argument('--profile_interval_ms', type=float, default=5) #sampling profiler period
+    parser.add_argument('--log_memory', action='store_true') #log Memory/* scalars (buffer, env, torch, RSS) every iteration
+    parser.add_argument('--memory_warn_mb', type=float, default=None) #warn when the process RSS exceeds this
+    parser.add_argument('--checkpoint_freq', type=int, default=0) #iterations between full-state checkpoints (0: none)
+    parser.add_argument('--keep_checkpoints', type=int, default=3) #number of most recent checkpoints kept
+    parser.add_argument('--resume', type=str, default=None) #logdir of a run to continue from its latest checkpoint (if any)
 
     parser.add_argument('--policy', type=str, default='normal')
-
-    args = parser.parse_args()
+    parser.add_argument('--obs_mode', type=str, default='raw', choices=['raw', 'aggregate']) #aggregate: per-rate-area features
+    parser.add_argument('--spatial_bins', type=int, default=0) #aggregate: add an occupancy grid of this many bins per side
+    parser.add_argument('--env_cache_dir', type=str, default=None) #precomputed block neighbours, shared between processes
+    parser.add_argument('--compile_policy', action='store_true') #compile the policy networks used during rollouts
+    parser.add_argument('--shared_trunk', action='store_true') #one hidden-layer trunk shared by all policy/baseline heads
+
+    parser.add_argument('--memmap_buffer', action='store_true') #keep the replay buffer in memory-mapped files under logdir
+    parser.add_argument('--replay_buffer_dir', type=str, default=None) #reopen (or create) a disk-backed replay buffer here
+    parser.add_argument('--initial_dataset', type=str, default=None) #warm-start the replay buffer from an exported dataset
+    parser.add_argument('--export_dataset', type=str, default=None) #append every collected batch to a dataset here
+
+    args = parser.parse_args(argv)
+    if args.keep_checkpoints < 1:
+        parser.error('--keep_checkpoints must be at least 1')
+    if args.ppo_epochs < 1:
+        parser.error('--ppo_epochs must be at least 1')
+    if args.gae_lambda is not None and not (args.nn_baseline and args.reward_to_go):
+        parser.error('--gae_lambda needs --nn_baseline and --reward_to_go')
 
     # convert to dictionary
     params = vars(args)
@@ -100,8 +155,12 @@ def main():
     if not (os.path.exists(data_path)):
         os.makedirs(data_path)
 
-    logdir = 'pg_' + args.exp_name + '_' + time.strftime("%d-%m-%Y_%H-%M-%S")
-    logdir = os.path.join(data_path, logdir)
+    if args.resume:
+        # keep logging into the resumed run's directory
+        logdir = args.resume
+    else:
+        logdir = 'pg_' + args.exp_name + '_' + time.strftime("%d-%m-%Y_%H-%M-%S")
+        logdir = os.path.join(data_path, logdir)
     params['logdir'] = logdir
     if not(os.path.exists(logdir)):
         os.makedirs(logdir)
@@ -110,8 +169,11 @@ def main():
     ### RUN TRAINING
     ###################
 
-    trainer = PG_Trainer(params)
-    trainer.run_training_loop()
+    if args.world_size > 1:
+        # data-parallel ranks on this machine, talking over localhost
+        distributed.launch(run, args.world_size, args.dist_port, params)
+    else:
+        run(params)
 
 
 if __name__ == "__main__":
@@ -2,6 +2,7 @@ import os
 import time
 
 from cs285.agents.ac_agent import ACAgent
+from cs285.infrastructure import distributed
 from cs285.infrastructure.rl_trainer import RL_Trainer
 
 
@@ -19,6 +20,7 @@ class AC_Trainer(object):
             'learning_rate': params['learning_rate'],
             'num_target_updates': params['num_target_updates'],
             'num_grad_steps_per_target_update': params['num_grad_steps_per_target_update'],
+            'critic_minibatch_size': params['critic_minibatch_size'],
             }
 
         estimate_advantage_args = {
@@ -30,6 +32,9 @@ class AC_Trainer(object):
             'num_agent_train_steps_per_iter': params['num_agent_train_steps_per_iter'],
             'num_critic_updates_per_agent_update': params['num_critic_updates_per_agent_update'],
             'num_actor_updates_per_agent_update': params['num_actor_updates_per_agent_update'],
+            'prioritized_replay': params['prioritized_replay'],
+            'per_alpha': params['per_alpha'],
+            'per_beta': params['per_beta'],
         }
 
         agent_params = {**computation_graph_args, **estimate_advantage_args, **train_args}
@@ -51,10 +56,16 @@ class AC_Trainer(object):
             self.params['n_iter'],
             collect_policy = self.rl_trainer.agent.actor,
             eval_policy = self.rl_trainer.agent.actor,
+            initial_expertdata = self.params['initial_dataset'],
             )
 
 
-def main():
+def run(params):
+    trainer = AC_Trainer(params)
+    trainer.run_training_loop()
+
+
+def main(argv=None):
 
     import argparse
     parser = argparse.ArgumentParser()
@@ -66,9 +77,14 @@ def main():
     parser.add_argument('--num_agent_train_steps_per_iter', type=int, default=1)
     parser.add_argument('--num_critic_updates_per_agent_update', type=int, default=1)
     parser.add_argument('--num_actor_updates_per_agent_update', type=int, default=1)
+    parser.add_argument('--prioritized_replay', '-per', action='store_true') #fit the critic on TD-error prioritized batches
+    parser.add_argument('--per_alpha', type=float, default=0.6)
+    parser.add_argument('--per_beta', type=float, default=0.4)
 
     parser.add_argument('--batch_size', '-b', type=int, default=480) #steps collected per train iteration
     parser.add_argument('--eval_batch_size', '-eb', type=int, default=480) #steps collected per eval iteration
+    parser.add_argument('--eval_scenarios', type=int, default=0) #instead, evaluate on N fixed seeded episodes covering every stage, identical for every policy
+    parser.add_argument('--eval_scenario_seed', type=int, default=0) #seed of that suite of eval episodes
     parser.add_argument('--train_batch_size', '-tb', type=int, default=480) ##steps used per gradient step
 
     parser.add_argument('--discount', type=float, default=1.0)
@@ -76,20 +92,45 @@ def main():
     parser.add_argument('--dont_standardize_advantages', '-dsa', action='store_true')
     parser.add_argument('--num_target_updates', '-ntu', type=int, default=10)
     parser.add_argument('--num_grad_steps_per_target_update', '-ngsptu', type=int, default=10)
+    parser.add_argument('--critic_minibatch_size', '-cmb', type=int, default=None) #steps per critic gradient step
     parser.add_argument('--n_layers', '-l', type=int, default=2)
     parser.add_argument('--size', '-s', type=int, default=64)
 
     parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--num_seeds', type=int, default=1) #train seeds seed..seed+K-1 side by side in this process, logged to logdir/seed<seed>
+    parser.add_argument('--world_size', type=int, default=1) #data-parallel processes, each collecting batch_size / world_size steps
+    parser.add_argument('--dist_port', type=int, default=29500) #localhost port the processes connect through
     parser.add_argument('--no_gpu', '-ngpu', action='store_true')
     parser.add_argument('--which_gpu', '-gpu_id', default=0)
     parser.add_argument('--video_log_freq', type=int, default=-1)
     parser.add_argument('--scalar_log_freq', type=int, default=1)
 
     parser.add_argument('--save_params', action='store_true')
+    parser.add_argument('--time_phases', action='store_true') #log Perf/* per-phase wall-clock times and phase_times.json
+    parser.add_argument('--profile_iters', type=str, default=None) #a:b profiles iterations a..b-1 into logdir
+    parser.add_argument('--profiler', type=str, default='sampling', choices=['sampling', 'torch'])
+    parser.add_argument('--profile_interval_ms', type=float, default=5) #sampling profiler period
+    parser.add_argument('--log_memory', action='store_true') #log Memory/* scalars (buffer, env, torch, RSS) every iteration
+    parser.add_argument('--memory_warn_mb', type=float, default=None) #warn when the process RSS exceeds this
+    parser.add_argument('--checkpoint_freq', type=int, default=0) #iterations between full-state checkpoints (0: none)
+    parser.add_argument('--keep_checkpoints', type=int, default=3) #number of most recent checkpoints kept
+    parser.add_argument('--resume', type=str, default=None) #logdir of a run to continue from its latest checkpoint (if any)
 
     parser.add_argument('--policy', type=str, default='normal')
+    parser.add_argument('--obs_mode', type=str, default='raw', choices=['raw', 'aggregate']) #aggregate: per-rate-area features
+    parser.add_argument('--spatial_bins', type=int, default=0) #aggregate: add an occupancy grid of this many bins per side
+    parser.add_argument('--env_cache_dir', type=str, default=None) #precomputed block neighbours, shared between processes
+    parser.add_argument('--compile_policy', action='store_true') #compile the policy networks used during rollouts
+    parser.add_argument('--shared_trunk', action='store_true') #one hidden-layer trunk shared by all policy/baseline heads
 
-    args = parser.parse_args()
+    parser.add_argument('--memmap_buffer', action='store_true') #keep the replay buffer in memory-mapped files under logdir
+    parser.add_argument('--replay_buffer_dir', type=str, default=None) #reopen (or create) a disk-backed replay buffer here
+    parser.add_argument('--initial_dataset', type=str, default=None) #warm-start the replay buffer from an exported dataset
+    parser.add_argument('--export_dataset', type=str, default=None) #append every collected batch to a dataset here
+
+    args = parser.parse_args(argv)
+    if args.keep_checkpoints < 1:
+        parser.error('--keep_checkpoints must be at least 1')
 
     # convert to dictionary
     params = vars(args)
@@ -108,8 +149,12 @@ def main():
     if not (os.path.exists(data_path)):
         os.makedirs(data_path)
 
-    logdir = 'ac_' + args.exp_name + '_' + time.strftime("%d-%m-%Y_%H-%M-%S")
-    logdir = os.path.join(data_path, logdir)
+    if args.resume:
+        # keep logging into the resumed run's directory
+        logdir = args.resume
+    else:
+        logdir = 'ac_' + args.exp_name + '_' + time.strftime("%d-%m-%Y_%H-%M-%S")
+        logdir = os.path.join(data_path, logdir)
     params['logdir'] = logdir
     if not(os.path.exists(logdir)):
         os.makedirs(logdir)
@@ -120,8 +165,11 @@ def main():
     ### RUN TRAINING
     ###################
 
-    trainer = AC_Trainer(params)
-    trainer.run_training_loop()
+    if args.world_size > 1:
+        # data-parallel ranks on this machine, talking over localhost
+        distributed.launch(run, args.world_size, args.dist_port, params)
+    else:
+        run(params)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,166 @@
+import os
+import time
+
+from cs285.agents.dqn_agent import DQNAgent
+from cs285.infrastructure.dqn_utils import LinearSchedule, parking_optimizer
+from cs285.infrastructure import distributed
+from cs285.infrastructure.rl_trainer import RL_Trainer
+
+
+class Q_Trainer(object):
+
+    def __init__(self, params):
+
+        #####################
+        ## SET AGENT PARAMS
+        #####################
+
+        computation_graph_args = {
+            'env_name': params['env_name'],
+            'n_layers': params['n_layers'],
+            'size': params['size'],
+            'n_price_levels': params['n_price_levels'],
+            'optimizer_spec': parking_optimizer(params['learning_rate']),
+            'double_q': params['double_q'],
+            'grad_norm_clipping': params['grad_norm_clipping'],
+        }
+
+        estimate_target_args = {
+            'gamma': params['discount'],
+            'n_step': params['n_step'],
+        }
+
+        train_args = {
+            'num_agent_train_steps_per_iter': params['num_agent_train_steps_per_iter'],
+            'replay_buffer_size': params['replay_buffer_size'],
+            'learning_starts': params['learning_starts'],
+            'target_update_freq': params['target_update_freq'],
+            'exploration_schedule': LinearSchedule(params['exploration_steps'], params['final_epsilon']),
+        }
+
+        agent_params = {**computation_graph_args, **estimate_target_args, **train_args}
+
+        self.params = params
+        self.params['agent_class'] = DQNAgent
+        self.params['agent_params'] = agent_params
+        self.params['batch_size_initial'] = self.params['batch_size']
+
+        ################
+        ## RL TRAINER
+        ################
+
+        self.rl_trainer = RL_Trainer(self.params)
+
+    def run_training_loop(self):
+
+        self.rl_trainer.run_training_loop(
+            self.params['n_iter'],
+            collect_policy = self.rl_trainer.agent.collect_policy,
+            eval_policy = self.rl_trainer.agent.actor,
+            initial_expertdata = self.params['initial_dataset'],
+            )
+
+
+def run(params):
+    trainer = Q_Trainer(params)
+    trainer.run_training_loop()
+
+
+def main(argv=None):
+
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--env_name', type=str, default='parking')
+    parser.add_argument('--ep_len', type=int, default=48)
+    parser.add_argument('--exp_name', type=str, default='todo')
+    parser.add_argument('--n_iter', '-n', type=int, default=100)
+
+    parser.add_argument('--batch_size', '-b', type=int, default=480) #steps collected per train iteration
+    parser.add_argument('--eval_batch_size', '-eb', type=int, default=480) #steps collected per eval iteration
+    parser.add_argument('--eval_scenarios', type=int, default=0) #instead, evaluate on N fixed seeded episodes covering every stage, identical for every policy
+    parser.add_argument('--eval_scenario_seed', type=int, default=0) #seed of that suite of eval episodes
+    parser.add_argument('--train_batch_size', '-tb', type=int, default=256) #transitions per gradient step
+    parser.add_argument('--num_agent_train_steps_per_iter', type=int, default=100) #gradient steps per iteration
+
+    parser.add_argument('--n_price_levels', type=int, default=8) #evenly spaced prices per rate area
+    parser.add_argument('--n_step', type=int, default=3) #length of the bootstrapped returns
+    parser.add_argument('--discount', type=float, default=0.99)
+    parser.add_argument('--double_q', action='store_true')
+    parser.add_argument('--learning_rate', '-lr', type=float, default=1e-3)
+    parser.add_argument('--grad_norm_clipping', type=float, default=10)
+    parser.add_argument('--target_update_freq', type=int, default=500) #gradient steps between target network updates
+    parser.add_argument('--learning_starts', type=int, default=960) #env steps collected before the first update
+    parser.add_argument('--exploration_steps', type=int, default=20000) #env steps to anneal epsilon over
+    parser.add_argument('--final_epsilon', type=float, default=0.05)
+    parser.add_argument('--replay_buffer_size', type=int, default=50000)
+    parser.add_argument('--n_layers', '-l', type=int, default=2)
+    parser.add_argument('--size', '-s', type=int, default=64)
+
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--num_seeds', type=int, default=1) #train seeds seed..seed+K-1 side by side in this process, logged to logdir/seed<seed>
+    parser.add_argument('--world_size', type=int, default=1) #data-parallel processes, each collecting batch_size / world_size steps
+    parser.add_argument('--dist_port', type=int, default=29500) #localhost port the processes connect through
+    parser.add_argument('--no_gpu', '-ngpu', action='store_true')
+    parser.add_argument('--which_gpu', '-gpu_id', default=0)
+    parser.add_argument('--video_log_freq', type=int, default=-1)
+    parser.add_argument('--scalar_log_freq', type=int, default=1)
+
+    parser.add_argument('--save_params', action='store_true')
+    parser.add_argument('--time_phases', action='store_true') #log Perf/* per-phase wall-clock times and phase_times.json
+    parser.add_argument('--profile_iters', type=str, default=None) #a:b profiles iterations a..b-1 into logdir
+    parser.add_argument('--profiler', type=str, default='sampling', choices=['sampling', 'torch'])
+    parser.add_argument('--profile_interval_ms', type=float, default=5) #sampling profiler period
+    parser.add_argument('--log_memory', action='store_true') #log Memory/* scalars (buffer, env, torch, RSS) every iteration
+    parser.add_argument('--memory_warn_mb', type=float, default=None) #warn when the process RSS exceeds this
+    parser.add_argument('--checkpoint_freq', type=int, default=0) #iterations between full-state checkpoints (0: none)
+    parser.add_argument('--keep_checkpoints', type=int, default=3) #number of most recent checkpoints kept
+    parser.add_argument('--resume', type=str, default=None) #logdir of a run to continue from its latest checkpoint (if any)
+
+    parser.add_argument('--obs_mode', type=str, default='raw', choices=['raw', 'aggregate']) #aggregate: per-rate-area features
+    parser.add_argument('--spatial_bins', type=int, default=0) #aggregate: add an occupancy grid of this many bins per side
+    parser.add_argument('--env_cache_dir', type=str, default=None) #precomputed block neighbours, shared between processes
+
+    parser.add_argument('--initial_dataset', type=str, default=None) #warm-start the replay buffer from an exported dataset
+    parser.add_argument('--export_dataset', type=str, default=None) #append every collected batch to a dataset here
+
+    args = parser.parse_args(argv)
+    if args.keep_checkpoints < 1:
+        parser.error('--keep_checkpoints must be at least 1')
+
+    # convert to dictionary
+    params = vars(args)
+
+    ##################################
+    ### CREATE DIRECTORY FOR LOGGING
+    ##################################
+
+    data_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../data')
+
+    if not (os.path.exists(data_path)):
+        os.makedirs(data_path)
+
+    if args.resume:
+        # keep logging into the resumed run's directory
+        logdir = args.resume
+    else:
+        logdir = 'dqn_' + args.exp_name + '_' + time.strftime("%d-%m-%Y_%H-%M-%S")
+        logdir = os.path.join(data_path, logdir)
+    params['logdir'] = logdir
+    if not(os.path.exists(logdir)):
+        os.makedirs(logdir)
+
+    print("\n\n\nLOGGING TO: ", logdir, "\n\n\n")
+
+    ###################
+    ### RUN TRAINING
+    ###################
+
+    if args.world_size > 1:
+        # data-parallel ranks on this machine, talking over localhost
+        distributed.launch(run, args.world_size, args.dist_port, params)
+    else:
+        run(params)
+
+
+if __name__ == "__main__":
+    main()
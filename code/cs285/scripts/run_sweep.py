@@ -0,0 +1,162 @@
+import contextlib
+import importlib
+import itertools
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from cs285.environment import parking
+from cs285.infrastructure.results_index import ResultsIndex, summarize
+
+# sweep "script" -> module whose main(argv) runs one training job
+SCRIPTS = {
+    'pg': 'cs285.scripts.run_parking',
+    'ac': 'cs285.scripts.run_parking_actor_critic',
+    'dqn': 'cs285.scripts.run_parking_dqn',
+}
+STATUS_FILE = 'sweep_status.json'
+
+
+def expand_jobs(sweep):
+    """
+        One job per (configuration, seed). Configurations are the cartesian product
+        of sweep['grid'] on top of sweep['base'], plus every entry of sweep['configs'];
+        a job is named after the values that are not in base.
+    """
+    base = sweep.get('base', {})
+    configs = []
+    grid = sweep.get('grid', {})
+    if grid:
+        keys = sorted(grid)
+        for values in itertools.product(*(grid[key] for key in keys)):
+            configs.append(dict(zip(keys, values)))
+    configs += sweep.get('configs', [])
+    if not configs:
+        configs = [{}]
+
+    jobs = []
+    for config in configs:
+        config = dict(config)
+        script = config.pop('script', None) or sweep['script']
+        name = config.pop('name', None) or '_'.join(
+            '{}{}'.format(key, '' if value is True else value) for key, value in sorted(config.items())
+            if value is not False) or 'base'
+        for seed in sweep.get('seeds', [1]):
+            jobs.append({
+                'name': '{}_seed{}'.format(name, seed),
+                'script': script,
+                'params': {**base, **config, 'seed': seed},
+            })
+    return jobs
+
+
+def to_argv(params):
+    argv = []
+    for key, value in params.items():
+        if value is True:
+            argv.append('--' + key)
+        elif value is not False and value is not None:
+            argv += ['--' + key, str(value)]
+    return argv
+
+
+def init_worker(threads_per_worker):
+    # several workers on one box: keep each one's torch ops on its own few cores
+    import torch
+    torch.set_num_threads(threads_per_worker)
+    torch.set_num_interop_threads(1)
+
+
+def run_job(job, logdir, env_cache_dir, checkpoint_freq):
+    os.makedirs(logdir, exist_ok=True)
+    argv = to_argv({'exp_name': job['name'], **job['params']}) + [
+        '--resume', logdir, '--env_cache_dir', env_cache_dir, '--checkpoint_freq', str(checkpoint_freq)]
+
+    start = time.time()
+    interrupted = None
+    with open(os.path.join(logdir, 'stdout.log'), 'a') as log, \
+            contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            importlib.import_module(SCRIPTS[job['script']]).main(argv)
+            status = 'done'
+        except KeyboardInterrupt as e:
+            # not a failure of the job: it runs again when the sweep is resumed
+            status, interrupted = 'interrupted', e
+        except BaseException:
+            # including argparse's SystemExit on bad params
+            traceback.print_exc()
+            status = 'failed'
+    with open(os.path.join(logdir, STATUS_FILE), 'w') as f:
+        json.dump({'status': status, 'argv': argv, 'seconds': time.time() - start}, f, indent=2)
+    if interrupted is not None:
+        raise interrupted
+    return status
+
+
+def job_status(logdir):
+    filename = os.path.join(logdir, STATUS_FILE)
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as f:
+        return json.load(f)['status']
+
+
+def main(argv=None):
+
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sweep', type=str) #json file with script, base, grid and/or configs, and seeds
+    parser.add_argument('--sweep_dir', type=str, default=None) #defaults to data/sweep_<name of the json file>
+    parser.add_argument('--threads_per_worker', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=None) #defaults to available cores / threads_per_worker
+    parser.add_argument('--checkpoint_freq', type=int, default=10) #so that an interrupted sweep resumes its jobs
+    parser.add_argument('--retry_failed', action='store_true')
+    parser.add_argument('--tags', type=str, nargs='*', default=['Eval_AverageReturn', 'Train_AverageReturn'])
+    parser.add_argument('--last', type=int, default=5) #summary: average each tag over its last N logged values
+    args = parser.parse_args(argv)
+
+    with open(args.sweep) as f:
+        sweep = json.load(f)
+    jobs = expand_jobs(sweep)
+
+    data_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../data')
+    sweep_name = os.path.splitext(os.path.basename(args.sweep))[0]
+    sweep_dir = os.path.abspath(args.sweep_dir or os.path.join(data_path, 'sweep_' + sweep_name))
+    os.makedirs(sweep_dir, exist_ok=True)
+
+    # finished jobs are skipped; interrupted ones continue from their latest checkpoint
+    pending = [job for job in jobs
+               if job_status(os.path.join(sweep_dir, job['name'])) not in
+               (('done',) if args.retry_failed else ('done', 'failed'))]
+    print('{} jobs, {} to run, in {}'.format(len(jobs), len(pending), sweep_dir))
+
+    # the block neighbour arrays are computed once and memory-mapped by every job
+    env_cache_dir = os.path.join(sweep_dir, 'env_cache')
+    if not os.path.exists(os.path.join(env_cache_dir, parking.NEIGHBOUR_FILES[-1])):
+        parking.save_block_neighbours(pd.read_csv('../data/Meters/Meter_block.csv'), env_cache_dir)
+
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    workers = args.workers or max(1, cores // args.threads_per_worker)
+    # a fresh process per job: no module state (e.g. an enabled phase timer) leaks into the next one
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(args.threads_per_worker,),
+                             max_tasks_per_child=1) as pool:
+        futures = {pool.submit(run_job, job, os.path.join(sweep_dir, job['name']), env_cache_dir,
+                               args.checkpoint_freq): job for job in pending}
+        for future in as_completed(futures):
+            print('{}: {}'.format(futures[future]['name'], future.result()))
+
+    # summary over seeds of every configuration
+    index = ResultsIndex(sweep_dir)
+    index.update()
+    summary = summarize(index.table(), args.tags, last=args.last, group_seeds=True)
+    summary.to_csv(os.path.join(sweep_dir, 'summary.csv'))
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200):
+        print(summary)
+
+
+if __name__ == '__main__':
+    main()
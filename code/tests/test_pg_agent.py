@@ -0,0 +1,44 @@
+import numpy as np
+
+from cs285.agents.pg_agent import PGAgent
+
+
+def make_agent(reuse_batches):
+    return PGAgent(None, {
+        'gamma': 0.99, 'standardize_advantages': True, 'nn_baseline': False, 'reward_to_go': True,
+        'reuse_batches': reuse_batches, 'is_mode': 'trajectory', 'is_truncation': 1.0, 'min_ess': 0.1,
+        'ac_dim': 1, 'ob_dim': 3, 'n_layers': 1, 'size': 8, 'discrete': False,
+        'learning_rate': 1e-3, 'normal': True,
+    })
+
+
+def make_batch(agent, log_prob_offset, n_paths=20):
+    # n_paths one-step trajectories whose behaviour log-probs are the current ones minus log_prob_offset
+    obs = np.random.randn(n_paths, 3).astype(np.float32)
+    acs = np.random.randn(n_paths, 1).astype(np.float32)
+    log_probs = agent.actor.get_log_prob(obs, acs) - log_prob_offset
+    return [{'observation': obs[i:i + 1], 'action': acs[i:i + 1], 'reward': np.ones(1, dtype=np.float32),
+             'next_observation': obs[i:i + 1], 'terminal': np.ones(1), 'log_prob': log_probs[i:i + 1]}
+            for i in range(n_paths)]
+
+
+def test_add_past_batches_drops_middle_batch():
+    np.random.seed(0)
+    agent = make_agent(reuse_batches=3)
+    good_old = make_batch(agent, np.zeros(20))
+    # one trajectory keeps weight 1, the rest are ~0: normalized ESS ~1/20 < min_ess
+    bad = make_batch(agent, np.r_[0., -np.full(19, 20.)])
+    good_new = make_batch(agent, np.zeros(20))
+    current = make_batch(agent, np.zeros(20))
+    agent.recent_batches.extend([good_old, bad, good_new, current])
+
+    obs, acs = np.concatenate([path['observation'] for path in current]), \
+        np.concatenate([path['action'] for path in current])
+    obs_all, acs_all, rews, weights, reuse_log = agent.add_past_batches(
+        obs, acs, [path['reward'] for path in current])
+
+    assert [id(paths) for paths in agent.recent_batches] == [id(good_old), id(good_new), id(current)]
+    assert agent.recent_batches.maxlen == 4
+    assert reuse_log['Reuse_Batches'] == 2
+    assert len(obs_all) == len(acs_all) == len(rews) == len(weights) == 60
+    np.testing.assert_allclose(weights, 1., rtol=1e-5)